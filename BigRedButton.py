@@ -12,25 +12,51 @@ from __future__ import with_statement, division
 from itertools import count
 from traceback import print_exc, format_tb
 from sys import exc_info
-from os.path import join, exists
+from os.path import join, exists, isdir
 from os import unlink
-from win32com.client import Dispatch
-from win32gui import PumpWaitingMessages
-from Utils.easygui import msgbox, buttonbox
 from time import time as Time
 from time import ctime, gmtime
 
 # Heat Source modules
 from Dieties.IniParamsDiety import IniParams
-from Excel.ExcelInterface import ExcelInterface
+from Stream.StreamReach import StreamReach
+from Stream.ArrayStreamNode import PackNodes
+from Stream.Ephemeris import Ephemeris
+from Stream.ShadeEngine import ShadeEngine, ShadeBlocks
+from Stream.RatingTable import RatingTable
+from Stream.Pipeline import Pipeline
+from Stream.DailySums import DailySums
 from Dieties.ChronosDiety import Chronos
 from Utils.Logger import Logger
 from Utils.Output import Output as O
-from HSmodule import HeatSourceError
+from Utils.BinaryOutput import BinaryOutput
+from Utils.Checkpoint import Save as SaveCheckpoint, Load as LoadCheckpoint
+from Utils.Profiler import Profiler
+from Utils.Dictionaries import ResampleForcing
 from __version__ import version_info
+try:
+    from HSmodule import HeatSourceError
+except ImportError:
+    from Stream.PyHeatsource import HeatSourceError
+try:
+    from win32gui import PumpWaitingMessages
+except ImportError:
+    # Not on Windows, so there's no Excel status bar to keep alive
+    def PumpWaitingMessages(): pass
 
 from . import opt
 
+def LoadInterface(spreadsheet, log, run_type=0):
+    """Read the model from a workbook or a directory of worksheets
+
+    The interfaces are imported here so that a headless run never
+    touches the win32 modules."""
+    if isdir(spreadsheet):
+        from Excel.CSVInterface import CSVInterface as Interface
+    else:
+        from Excel.ExcelInterface import ExcelInterface as Interface
+    return Interface(spreadsheet, log, run_type)
+
 class ModelControl(object):
     """Main model control class for Heat Source.
 
@@ -47,44 +73,111 @@ class ModelControl(object):
     Reach class. Since this was essentially an interim
     solution to the problem, don't hesitate to improve it.
     """
-    def __init__(self, spreadsheet, run_type=0):
-        """ModelControl(spreadsheet, run_type) -> Class instance
+    def __init__(self, spreadsheet, run_type=0, interface=None):
+        """ModelControl(spreadsheet, run_type, interface) -> Class instance
 
-        Spreadsheet is the path to an excel sheet containing the data.
+        Spreadsheet is the path to an excel sheet containing the data,
+        or to a directory of worksheets exported to CSV or parquet files
+        (see Excel/CSVDocument.py) for running without Excel.
         run_type is one of 0,1,2 for Heat Source, Solar only, or
-        hydraulics only, respectively.
+        hydraulics only, respectively. If interface is given, it is an
+        already loaded model (see LoadInterface()) and spreadsheet is
+        ignored.
         """
         # TODO: Fix the logger so it actually works
         self.ErrLog = Logger
 
-        # Create an ExcelInterface instance. Here, we could just grab
+        # Create an ExcelInterface (or CSVInterface) instance. Here, we could just grab
         # the Reach and PB (progress bar) attributes and then release it,
         # but internal use has suggested that it's nice to keep ownership
         # of the sheet throughout the model run.
-        self.HS = ExcelInterface(spreadsheet, self.ErrLog, run_type)
+        if interface is None:
+            interface = LoadInterface(spreadsheet, self.ErrLog, run_type)
+        self.HS = interface
 
         # This is the list of StreamNode instances- we sort it in reverse
         # order because we number stream kilometer from the mouth to the
         # headwater, but we want to run the model from headwater to mouth.
         self.reachlist = sorted(self.HS.Reach.itervalues(), reverse=True)
+        # Move the numbers of the nodes into arrays for the whole reach
+        if IniParams["node_arrays"]:
+            self.reachlist = PackNodes(self.reachlist)
+            for node in self.reachlist:
+                self.HS.Reach[node.km] = node
+        self.below = self.reachlist[1:] # Everything below the headwater
+        # The nodes' daily solar sums, which live in arrays for the whole reach
+        self.Daily = DailySums(self.reachlist)
+
+        # Swap the forcing dictionaries for tables on the timestep grid,
+        # which have to be built before the StreamReach looks at them.
+        if IniParams["forcing_tables"]:
+            ResampleForcing(self.reachlist, IniParams["flushtimestart"],
+                            IniParams["modelend"], IniParams["dt"])
+        # Only the headwater calculates the solar position, everyone else uses head.SolarPos
+        if IniParams["ephemeris"]:
+            head = self.reachlist[0]
+            head.Ephemeris = Ephemeris(head.Latitude, head.Longitude, head.UTC_offset, IniParams["dt"],
+                                       IniParams["flushtimestart"], IniParams["modelend"],
+                                       IniParams["radialsample_count"], IniParams["ephemeris_cache"])
+        # The rating tables have to be in place before the StreamReach stacks them up
+        if IniParams["rating_tables"]:
+            for node in self.reachlist:
+                node.Rating = RatingTable(node.W_b, node.z, node.n, node.S, IniParams["rating_tolerance"])
 
         # This if statement prevents us from having to test every timestep
         # We just call self.run_all(), which is a classmethod pointing to
         # the correct method.
+        self.run_type = run_type
         if run_type == 0: self.run_all = self.run_hs
         elif run_type == 1: self.run_all = self.run_sh
         elif run_type == 2: self.run_all = self.run_hy
         else: raise Exception("Bad run_type: %i. Must be 0, 1 or 2" %`self.run_type`)
+        # If we're vectorizing, the StreamReach has the same three methods, but
+        # runs them on arrays holding the entire reach.
+        self.Reach = None
+        if IniParams["vectorize"]:
+            self.Reach = StreamReach(self.reachlist, run_type, self.Daily)
+            self.run_all = getattr(self.Reach, self.run_all.__name__)
+        # Or the reach can be split up and run by several processes
+        self.Pipeline = None
+        if IniParams["pipeline"]:
+            if IniParams["vectorize"] or IniParams["checkpoint_file"] or IniParams["spinup_file"] or \
+                    IniParams["flush_tolerance"] is not None or IniParams["profile"]:
+                raise Exception("The pipeline can't be combined with vectorize, checkpoints, "
+                                "spin-up files, flush_tolerance or profile")
+            self.Pipeline = Pipeline(self.reachlist, run_type, IniParams["pipeline"], self.Daily)
+        # A shade-only run can do without the clock ticking node by node altogether
+        self.ShadeEngine = None
+        if IniParams["shade_engine"] and run_type == 1:
+            if IniParams["pipeline"] or IniParams["checkpoint_file"] or IniParams["spinup_file"]:
+                raise Exception("The shade engine can't be combined with the pipeline, checkpoints or spin-up files")
+            if IniParams["shade_engine"] > 1:
+                self.ShadeEngine = ShadeBlocks(self.reachlist, int(IniParams["shade_engine"]), daily=self.Daily)
+            else:
+                self.ShadeEngine = ShadeEngine(self.reachlist, daily=self.Daily)
         # Create a Chronos iterator that controls all model time.
         Chronos.Start(start = IniParams["modelstart"],
                       stop = IniParams["modelend"],
                       dt = IniParams["dt"],
                       spin = IniParams["flushdays"],
                       offset = IniParams["offset"])
+        # Pick up from a checkpoint, or from the end of a saved spin-up, if we have one.
+        # This restores the nodes and Chronos, and Run() takes care of the rest.
+        self.resume = None
+        if IniParams["resume"] and IniParams["checkpoint_file"] and exists(IniParams["checkpoint_file"]):
+            self.resume = LoadCheckpoint(IniParams["checkpoint_file"], self.reachlist, run_type)
+        elif IniParams["spinup_file"] and exists(IniParams["spinup_file"]):
+            self.resume = LoadCheckpoint(IniParams["spinup_file"], self.reachlist, run_type)
+        output_state = self.resume["output"] if self.resume else None
         # This is the output class, which is essentially just a list
         # of file objects and an append method which writes to them
         # every so often.
-        self.Output = O(self.HS.Reach, IniParams["modelstart"], run_type)
+        if IniParams["output_queue"] and IniParams["profile"]:
+            raise Exception("The profiler can't be combined with output_queue, which writes from another thread")
+        if IniParams["output_format"] == "text":
+            self.Output = O(self.HS.Reach, IniParams["modelstart"], run_type, output_state, self.Daily)
+        else:
+            self.Output = BinaryOutput(self.HS.Reach, IniParams["modelstart"], run_type, output_state, self.Daily)
 
     def Run(self):
         """Run the model one time
@@ -101,8 +194,36 @@ class ModelControl(object):
         # We define the timesteps by dividing dt (now in seconds) by 3600
         timesteps = (stop-flush)/IniParams["dt"]
         cnt = count() # Counter iterator for counting current timesteps passed
+        ts = -1 # Last value from cnt
         out = 0 # Volume of water flowing out of mouth (for simple mass balance)
+        if self.resume:
+            ts, out = self.resume["run"]["count"] - 1, self.resume["run"]["out"]
+            cnt = count(ts + 1)
+            if self.Reach: self.Reach.Gather()
+        first = time
+        checkpoint = IniParams["checkpoint_file"]
+        # Only save the spin-up state if there is a spin-up, and it wasn't loaded from the file
+        spinup = IniParams["spinup_file"] if IniParams["flushdays"] and not exists(IniParams["spinup_file"] or "") else None
+        quit = False
+        # For an early end to the spin-up, we keep each spin-up day's hourly temperatures
+        tolerance = IniParams["flush_tolerance"] if self.run_type == 0 and time < start else None
+        profile, last_profile = [], None
+        # Optional timing of the hot spots (see Utils/Profiler.py)
+        profiler = None
+        if IniParams["profile"]:
+            profiler = Profiler()
+            profiler.Install(self.reachlist)
+            profiler.NewDay(time)
         time1 = Time() # Current computer time- for estimating total model runtime
+        # The pipeline runs every timestep in its worker processes, taking
+        # care of the hourly output, and leaves Chronos at the end of the model.
+        if self.Pipeline:
+            out = self.Pipeline.Run(self.Output, self.HS.PB, timesteps)
+            time = Chronos.TheTime
+        # So does the shade engine
+        elif self.ShadeEngine:
+            out = self.ShadeEngine.Run(self.Output, self.HS.PB, timesteps)
+            time = Chronos.TheTime
         # Localize run_type for a bit more speed
         ################################################################
         # So, it's simple and stupid. We basically just cycle through the time
@@ -113,15 +234,35 @@ class ModelControl(object):
         # is still unfinished.
         while time <= stop:
             year, month, day, hour, minute, second, JD, offset, JDC = Chronos.TimeTuple()
+            # At the end of each spin-up day, see whether the temperatures have settled down
+            # since the day before, and if so, skip ahead to the start of the model.
+            if tolerance is not None and not (hour + minute + second) and time != first:
+                if last_profile is not None and len(profile) == len(last_profile) and \
+                        max([abs(a - b) for a, b in zip(profile, last_profile)]) < tolerance:
+                    msg = "Spin-up converged after %i of %i days" % (int((time - flush) // 86400), IniParams["flushdays"])
+                    Chronos.EndSpin()
+                    time = Chronos.TheTime
+                    year, month, day, hour, minute, second, JD, offset, JDC = Chronos.TimeTuple()
+                elif time >= start:
+                    msg = "Spin-up did not converge within %i days" % IniParams["flushdays"]
+                else:
+                    msg = None
+                if msg:
+                    self.ErrLog.write(msg)
+                    self.HS.PB(msg)
+                    tolerance = None
+                profile, last_profile = [], profile
+            # Snapshots are taken before the timestep is run, so a restart begins with this timestep
+            if spinup and time == start:
+                self.SaveState(spinup, {"count": ts + 1, "out": out}, False)
+            if checkpoint and not (hour + minute + second) and time != first and \
+                    not int((time - flush) // 86400) % IniParams["checkpoint_days"]:
+                self.SaveState(checkpoint, {"count": ts + 1, "out": out})
             # zero hour+minute+second means first timestep of new day
             # We want to zero out the daily flux sum at this point.
             if not (hour + minute + second):
-                for nd in self.reachlist:
-                    nd.F_DailySum = [0]*5
-                    nd.Solar_Blocked = {}
-                    for i in range(IniParams["radialsample_count"]):  #Seven directions
-                        nd.Solar_Blocked[i]=[0]*IniParams["transsample_count"] #A spot for each zone
-                    nd.Solar_Blocked['diffuse']=0
+                if profiler and time != first: profiler.NewDay(time)
+                self.Daily.Reset()
 
             # Back to every timestep level of the loop. Here we wrap the call to
             # run_all() in a try block to catch the exceptions thrown.
@@ -135,8 +276,10 @@ class ModelControl(object):
                     msg += stderr+"\nThe model run has been halted. You may ignore any further error messages."
                 except TypeError:
                     msg += `stderr`+"\nThe model run has been halted. You may ignore any further error messages."
-                msgbox(msg)
                 # Then just die
+                if IniParams["headless"]: raise SystemExit(msg)
+                from Utils.easygui import msgbox
+                msgbox(msg)
                 raise SystemExit
                         # If minute and second are both zero, we are at the top of the hour. Performing
 
@@ -149,6 +292,10 @@ class ModelControl(object):
                 self.HS.PB("%i of %i timesteps"% (ts*hr, timesteps))
                 # Update the Excel status bar when the queue is free
                 PumpWaitingMessages()
+                # Bring the StreamNodes up to date if the reach is running on arrays
+                if self.Reach: self.Reach.Scatter()
+                if tolerance is not None:
+                    profile.extend([x.T for x in self.reachlist] + [x.T_sed for x in self.reachlist])
                 # Call the Output class to update the textfiles. We call this every
                 # hour and store the data, then we write to file every day. Limiting
                 # disk access saves us considerable time.
@@ -156,19 +303,24 @@ class ModelControl(object):
                 # Check to see if the user pressed the stop button. Pretty crappy kludge here- VB code writing an
                 # empty file- but I basically got to lazy to figure out how to interact with the underlying
                 # COM API without using a threading interface.
-                if exists("c:\\quit_heatsource"):
+                if not IniParams["headless"] and exists("c:\\quit_heatsource"):
                     unlink("c:\\quit_heatsource")
                     if QuitMessage():
-                        break
+                        quit = True
 
             # We've made it through the entire stream without an error, so we update our mass balance
             # by adding the discharge of the mouth...
             out += self.reachlist[-1].Q
             # and tell Chronos that we're moving time forward.
             time = Chronos(True)
+            # If we're quitting, save where we got to so that the run can be resumed
+            if quit:
+                if checkpoint: self.SaveState(checkpoint, {"count": ts + 1, "out": out})
+                break
 
         # So, here we are at the end of a model run. First we calculate how long all of this took
         total_time = (Time() - time1) / 60
+        if self.Reach: self.Reach.Scatter()
         # Calculate the mass balance inflow
         balances = [x.Q_mass for x in self.reachlist]
         total_inflow = sum(balances)
@@ -183,10 +335,18 @@ class ModelControl(object):
         # so we do this before the final message so people don't accidentally
         # access the file and screw up the buffer)
         self.Output.close()
+        if profiler:
+            profiler.Remove(self.reachlist)
+            profiler.Write(IniParams["outputdir"])
         # write that final message to the Excel status bar
         self.HS.PB(message)
         # Hopefully, Python's cyclic garbage collection takes care of the rest :)
 
+    def SaveState(self, filename, run, output=True):
+        """Save a checkpoint (or a spin-up state, without the output) to filename"""
+        if self.Reach: self.Reach.Scatter()
+        SaveCheckpoint(filename, self.reachlist, self.run_type, run, self.Output if output else None)
+
     #############################################################
     # three different versions of the run() routine, depending on the run_type
     # We use list comprehension because it's slightly faster than a for loop,
@@ -194,7 +354,7 @@ class ModelControl(object):
     def run_hs(self, time, H, M, S, JD, JDC):
         """Call both hydraulic and solar routines for each StreamNode"""
         [x.CalcDischarge(time) for x in self.reachlist]
-        [x.CalcHeat(time, H, M, S, JD, JDC) for x in self.reachlist]
+        self.CalcHeat(time, H, M, S, JD, JDC)
         [x.MacCormick2(time) for x in self.reachlist]
 
     def run_hy(self, time, H, M, S, JD, JDC):
@@ -203,11 +363,21 @@ class ModelControl(object):
 
     def run_sh(self, time, H, M, S, JD, JDC):
         """Call solar routines for each StreamNode"""
-        [x.CalcHeat(time, H, M, S, JD, JDC, True) for x in self.reachlist]
+        self.CalcHeat(time, H, M, S, JD, JDC, True)
+
+    def CalcHeat(self, time, H, M, S, JD, JDC, solar_only=False):
+        """Call the heat routines for each StreamNode"""
+        # The headwater works out where the sun is, and if it's down, the
+        # rest of the reach can skip the solar fluxes altogether.
+        head = self.reachlist[0]
+        head.CalcHeat(time, H, M, S, JD, JDC, solar_only)
+        if head.SolarPos[2]: [x.CalcHeat(time, H, M, S, JD, JDC, solar_only) for x in self.below]
+        else: [x.CalcHeat_Night(time, H, M, S, JD, JDC, solar_only) for x in self.below]
 
 
 def QuitMessage():
     """Throw up a confirmation box to make sure we didn't hit the quit button accidentally"""
+    from Utils.easygui import buttonbox
     b = buttonbox("Do you really want to quit Heat Source", "Quit Heat Source", ["Cancel", "Quit"])
     if b == "Quit": return True
     else: return False
@@ -223,6 +393,7 @@ def RunHS(sheet):
         f = open("c:\\HSError.txt", "w")
         print_exc(file=f)
         f.close()
+        from Utils.easygui import msgbox
         msgbox("".join(format_tb(exc_info()[2]))+"\nSynopsis: %s"%stderr, "HeatSource Error", err=True)
 def RunSH(sheet):
     """Run solar routines only"""
@@ -233,6 +404,7 @@ def RunSH(sheet):
         f = open("c:\\HSError.txt", "w")
         print_exc(file=f)
         f.close()
+        from Utils.easygui import msgbox
         msgbox("".join(format_tb(exc_info()[2]))+"\nSynopsis: %s"%stderr, "HeatSource Error", err=True)
 def RunHY(sheet):
     """Run hydraulics only"""
@@ -243,7 +415,16 @@ def RunHY(sheet):
         f = open("c:\\HSError.txt", "w")
         print_exc(file=f)
         f.close()
+        from Utils.easygui import msgbox
         msgbox("".join(format_tb(exc_info()[2]))+"\nSynopsis: %s"%stderr, "HeatSource Error", err=True)
+def RunHeadless(inputdir, run_type=0):
+    """Run the model from a directory of exported worksheets, without Excel or a GUI
+
+    Errors are not caught, so they end up in the caller's traceback
+    (or a batch system's log) rather than in a message box."""
+    HSP = ModelControl(inputdir, run_type)
+    HSP.Run()
+    del HSP
 
 try:
     if opt(__name__):
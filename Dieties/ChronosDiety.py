@@ -1,5 +1,7 @@
 from time import strptime, ctime, gmtime
-from pywintypes import Time as pyTime
+try:
+    from pywintypes import Time as pyTime
+except ImportError: pyTime = None # Only needed for ExcelTime()
 from IniParamsDiety import IniParams
 
 from .. import opt
@@ -9,6 +11,26 @@ try:
         object = psyco.classes.psyobj
 except ImportError: pass
 
+def JulianCentury(time):
+    """Return the julian century of the day containing time (seconds since epoch)"""
+    # Then break out the time into a tuple
+    y,m,d,H,M,S,day,wk,tz = gmtime(time)
+    dec_day = d + (H + (M + S/60)/60)/24
+
+    if m < 3:
+        m += 12;
+        y -= 1;
+
+    julian_day = int(365.25*(y+4716.0)) + int(30.6001*(m+1)) + d - 1524.5;
+
+    # This value should only be added if we fall after a certain date
+    if julian_day > 2299160.0:
+        a = int(y/100)
+        b = (2 - a + int(a/4))
+        julian_day += b
+    #This is the julian century
+    return round((julian_day-2451545.0)/36525.0,10) # Eqn. 2-5 in HS Manual
+
 class ChronosDiety(object):
     """This class provides a clock to be used in the model timestepping.
 
@@ -108,23 +130,20 @@ class ChronosDiety(object):
         self.CalcJulianCentury()
 
     def CalcJulianCentury(self):
-        # Then break out the time into a tuple
-        y,m,d,H,M,S,day,wk,tz = gmtime(self.__current)
-        dec_day = d + (H + (M + S/60)/60)/24
-
-        if m < 3:
-            m += 12;
-            y -= 1;
-
-        julian_day = int(365.25*(y+4716.0)) + int(30.6001*(m+1)) + d - 1524.5;
-
-        # This value should only be added if we fall after a certain date
-        if julian_day > 2299160.0:
-            a = int(y/100)
-            b = (2 - a + int(a/4))
-            julian_day += b
-        #This is the julian century
-        self.__jdc = round((julian_day-2451545.0)/36525.0,10) # Eqn. 2-5 in HS Manual
+        self.__jdc = JulianCentury(self.__current)
+
+    def EndSpin(self):
+        """Cut the spin-up period short, moving the clock to the model start time"""
+        self.__current = self.__spin_current = self.__thisday = self.__start
+        self.CalcJulianCentury()
+
+    def GetState(self):
+        """Return the clock's position as a tuple, for checkpointing"""
+        return self.__current, self.__spin_current, self.__thisday, self.__jdc
+
+    def SetState(self, state):
+        """Move the clock to a position returned by GetState(). Start() must be called first."""
+        self.__current, self.__spin_current, self.__thisday, self.__jdc = state
 
     #####################################################
     # Properties to allow reading but no changes
@@ -0,0 +1,52 @@
+"""The forcing data of the model, kept in one place
+
+Each continuous data site has a series of (cloud, wind, humidity, T_air)
+tuples, and each node with tributaries a series of tuples of their flows
+and one of their temperatures. Most nodes share the continuous data of
+the nearest site and have no tributaries at all, so instead of every
+StreamNode owning its own dictionaries, the series are kept here and a
+node only has the integer handle of each of its ContData, Q_tribs and
+T_tribs. Forcing[handle] is the series, which is looked up by time just
+as the node's own dictionary used to be.
+
+Handle 0 (Forcing.none) is one empty series shared by all of the nodes
+without tributaries, which has an empty tuple for every time.
+"""
+from __future__ import division
+
+class Empty(object):
+    """A series with nothing in it at any time"""
+    def __getitem__(self, time):
+        return ()
+    def __len__(self):
+        return 0
+    def keys(self):
+        return []
+    def itervalues(self):
+        return iter(())
+
+class ForcingDiety(object):
+    """Registry of the model's forcing series, indexed by handle"""
+    none = 0
+    def __init__(self):
+        self.Clear()
+
+    def Clear(self):
+        """Forget every series, which we do before reading another model"""
+        self.series = [Empty()]
+
+    def Add(self, series):
+        """Keep a series (e.g. an Interpolator), returning its handle"""
+        self.series.append(series)
+        return len(self.series) - 1
+
+    def __getitem__(self, handle):
+        return self.series[handle]
+
+    def __setitem__(self, handle, series):
+        self.series[handle] = series
+
+    def __len__(self):
+        return len(self.series)
+
+Forcing = ForcingDiety()
@@ -39,4 +39,70 @@ IniParams = {"psyco": ('Dictionaries',
              #2. Output from C module does not include solar blocked and causes a crash.
              #WARNING !!!  DO NOT RUN IN C
              "run_in_python": True,
+             # Advance the whole reach at once using NumPy arrays (see
+             # Stream/StreamReach.py) instead of calling each StreamNode.
+             # Results match the per-node routines to within roundoff.
+             "vectorize": False,
+             # Keep the numeric attributes of the StreamNodes in arrays for
+             # the whole reach (see Stream/ArrayStreamNode.py), which the
+             # vectorized StreamReach can copy in one go.
+             "node_arrays": False,
+             # Interpolate the continuous, tributary and boundary condition
+             # data onto the timestep grid once at startup (see ForcingTable
+             # in Utils/Dictionaries.py) instead of at every lookup.
+             "forcing_tables": False,
+             # Calculate the sun's position for the whole run up front (see
+             # Stream/Ephemeris.py). If ephemeris_cache names a directory,
+             # the result is saved there and reused by runs with the same
+             # location, timezone, timestep and dates.
+             "ephemeris": False,
+             "ephemeris_cache": None,
+             # Look up the wetted depth in a rating table (see
+             # Stream/RatingTable.py) instead of solving Manning's equation
+             # every timestep. rating_tolerance is the largest relative
+             # error in the depth allowed from the table.
+             "rating_tables": False,
+             "rating_tolerance": 1e-7,
+             # How the output is written: "text" for the usual fixed width
+             # text files, or "memmap", "npz" or "hdf5" for arrays (see
+             # Utils/BinaryOutput.py) of output_dtype floats.
+             "output_format": "text",
+             "output_dtype": "float64",
+             # Number of hours of output that can wait for a background
+             # thread to format and write them (see Utils/Output.py). Zero
+             # writes them from the model's own thread, and has to be used
+             # for a profiled run.
+             "output_queue": 0,
+             # Save the model state to checkpoint_file every checkpoint_days
+             # days (and when the run is stopped), and restart from it if
+             # resume is set (see Utils/Checkpoint.py). If spinup_file is
+             # set, the state at the end of the spin-up is saved there, or
+             # loaded from there if it already exists.
+             "checkpoint_file": None,
+             "checkpoint_days": 1,
+             "resume": False,
+             "spinup_file": None,
+             # If set, the spin-up ends as soon as every node's hourly
+             # temperature and sediment temperature over a spin-up day
+             # are within flush_tolerance (*C) of the day before.
+             "flush_tolerance": None,
+             # Time the model's hot spots and write profile.json and
+             # profile.csv to the output directory (see Utils/Profiler.py).
+             "profile": False,
+             # Split the reach into this many segments and run them in
+             # parallel, one process each (see Stream/Pipeline.py).
+             # Zero runs the whole reach in this process.
+             "pipeline": 0,
+             # Run a shade-only model a window of timesteps at a time, on
+             # arrays of every node and daytime timestep (see Stream/ShadeEngine.py).
+             # A number greater than one splits the reach into that many
+             # blocks of nodes, and runs each block in its own process.
+             "shade_engine": False,
+             # Directory to keep the models that have been read in, so that a
+             # later run with the same inputs loads the model rather than
+             # reading it again (see Utils/ModelCache.py). None reads every time.
+             "model_cache": None,
+             # Set when there is nobody to click on a message box (i.e. the
+             # model was loaded by CSVInterface). Errors are raised instead.
+             "headless": False,
              }
@@ -0,0 +1,154 @@
+"""A class that reads the Heat Source workbook from exported sheets
+
+CSVDocument provides the read-only half of ExcelDocument (GetValue(),
+GetColumn() and friends) for a directory holding one file per worksheet
+instead of a live Excel workbook. This lets the model be set up on a
+machine without Excel, pywin32 or a desktop.
+"""
+from __future__ import division
+import csv
+from datetime import datetime
+from os.path import join, exists, isdir
+from os import listdir
+from time import strptime
+
+from SheetData import SheetData
+
+# Date formats that we understand in a cell, tried in order. These
+# cover what Excel writes out when it saves a sheet as CSV, plus ISO.
+date_formats = ("%m/%d/%Y %H:%M:%S", "%m/%d/%Y %H:%M", "%m/%d/%Y",
+                "%m/%d/%y %H:%M:%S", "%m/%d/%y %H:%M", "%m/%d/%y",
+                "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d")
+
+class Time(datetime):
+    """A datetime that quacks like the pywintypes time objects returned by COM
+
+    The interface calls Format() on dates it gets from the workbook,
+    which is just strftime() under another name."""
+    Format = datetime.strftime
+
+class CSVDocument(SheetData):
+    """
+    Read-only stand-in for ExcelDocument backed by a directory of files.
+
+    Each worksheet is stored as "<sheet name>.csv" (what Excel gives you
+    with Save As -> CSV, one sheet at a time) or "<sheet name>.parquet".
+    The files hold the sheet cell for cell, starting at cell A1, so all of
+    the row and column positions used by the interface are unchanged. A
+    parquet file's column names are ignored, only its rows are used.
+    Numbers should be saved at full precision (the General format), since
+    Excel writes the displayed value to the CSV file.
+    """
+    def __init__(self, dirname):
+        if not isdir(dirname):
+            raise Exception("Input directory (%s) does not exist" % dirname)
+        self.dirname = dirname
+        # Cache of sheet data, a list of rows for each sheet name
+        self.sheets = {}
+        self.sheet = None
+        self._last = None
+
+    def PB(self, message, num=None, divisor=None):
+        """Print a message to the console. There's no status bar, so we skip the ticks."""
+        if message != self._last:
+            print message
+            self._last = message
+
+    def SetSheet(self, sheet):
+        """
+        Set the active worksheet.
+        """
+        if not isinstance(sheet, str):
+            raise Exception("Sheet must be set to a name")
+        self.sheet = sheet
+
+    def SourceFiles(self):
+        """Return the files that the worksheets might come from (see Utils/ModelCache.py)"""
+        return sorted([join(self.dirname, name) for name in listdir(self.dirname)
+                       if name.endswith(".csv") or name.endswith(".parquet")])
+
+    def GetData(self, sheet=None):
+        """
+        Return the sheet's data as a list of rows, reading the file the first time
+        """
+        sheet = sheet if sheet else self.sheet
+        try:
+            return self.sheets[sheet]
+        except KeyError:
+            pass
+        csvfile = join(self.dirname, sheet + ".csv")
+        parquetfile = join(self.dirname, sheet + ".parquet")
+        if exists(csvfile):
+            data = self.ReadCSV(csvfile)
+        elif exists(parquetfile):
+            data = self.ReadParquet(parquetfile)
+        else:
+            raise Exception("Cannot find the '%s' worksheet (%s.csv or %s.parquet) in %s" %
+                            (sheet, sheet, sheet, self.dirname))
+        # Strip the trailing blank rows, like Excel's last used cell
+        while len(data) and not len([x for x in data[-1] if x is not None]):
+            data.pop()
+        self.sheets[sheet] = data
+        return data
+
+    def ReadCSV(self, filename):
+        """Return a list of rows of cell values from a CSV file"""
+        f = open(filename, "rb")
+        try:
+            return [[self.Convert(x) for x in row] for row in csv.reader(f)]
+        finally:
+            f.close()
+
+    def ReadParquet(self, filename):
+        """Return a list of rows of cell values from a parquet file"""
+        try:
+            from pandas import read_parquet
+        except ImportError:
+            raise Exception("Reading %s requires the pandas package (with pyarrow or fastparquet)" % filename)
+        data = []
+        for row in read_parquet(filename).itertuples(index=False):
+            line = []
+            for x in row:
+                if x is None or x != x: x = None # NaN and NaT are empty cells
+                elif isinstance(x, basestring): x = self.Convert(x)
+                elif hasattr(x, "to_pydatetime"): x = Time(*x.to_pydatetime().timetuple()[:6])
+                elif type(x).__name__ in ("bool", "bool_"): x = bool(x)
+                else: x = float(x)
+                line.append(x)
+            data.append(line)
+        return data
+
+    def Convert(self, value):
+        """
+        Convert the text in a cell into what the COM interface would return.
+
+        Empty cells are None, numbers are floats, TRUE/FALSE are booleans
+        and dates are Time instances. Anything else is left as a string.
+        """
+        value = value.strip()
+        if not value: return None
+        try:
+            if value[-1] == "%": return float(value[:-1])/100
+            return float(value)
+        except ValueError:
+            pass
+        if value.upper() in ("TRUE", "FALSE"):
+            return value.upper() == "TRUE"
+        for fmt in date_formats:
+            try:
+                return Time(*strptime(value, fmt)[:6])
+            except ValueError:
+                pass
+        return value
+
+    def GetUsedRange(self, sheet=None):
+        """
+        Return the data for the entire used range.
+        """
+        return self.GetValue((1, 0, self.LastRow(sheet), self.LastColumn(sheet)-1), sheet)
+
+    def GetRangeValue(self, range, sheet=None):
+        """
+        There's no Excel to ask about ranges that GetBounds() doesn't understand.
+        """
+        raise Exception("Cannot understand the range %s" % `range`)
@@ -0,0 +1,21 @@
+"""Headless interface for building the model from exported sheets
+
+CSVInterface converts a directory holding the Heat Source worksheets
+(see CSVDocument) into a list of StreamNode classes, exactly as
+ExcelInterface does for a live workbook. Nothing here needs Excel,
+pywin32 or a GUI, so it can be used on any machine with Python.
+"""
+from __future__ import division
+
+# Heat Source Methods
+from ..Dieties.IniParamsDiety import IniParams
+from CSVDocument import CSVDocument
+from HeatSourceInterface import HeatSourceInterface
+
+class CSVInterface(CSVDocument, HeatSourceInterface):
+    """Build the model's StreamNodes from a directory of exported worksheets"""
+    def __init__(self, dirname, log=None, run_type=0):
+        CSVDocument.__init__(self, dirname)
+        # Nobody is watching, so errors are raised instead of shown in a message box
+        IniParams["headless"] = True
+        HeatSourceInterface.__init__(self, log, run_type)
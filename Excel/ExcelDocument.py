@@ -8,6 +8,7 @@ from os.path import exists
 from os import remove
 
 from ..Dieties.IniParamsDiety import IniParams
+from SheetData import SheetData
 
 borderTop = 3
 borderBottom = 4
@@ -45,7 +46,7 @@ class TextPB(Tobject):
 
 # psyco fills memory if this class is optimized, so we just use
 # the normal Python object
-class ExcelDocument(object):
+class ExcelDocument(SheetData):
     """
     This is a recipe class culled from ASPN (ActiveState). It implements
     many of the necessary methods to manipulate an Excel spreadsheet using
@@ -71,6 +72,11 @@ class ExcelDocument(object):
         # TextPB is a progress bar like class that creates a moving arrow and a message in the status
         # bar.
         self.PBtext = TextPB()
+        # Every call through COM is a round trip to Excel, which adds up when we read
+        # a big workbook a column or a cell at a time. Instead we read each sheet in one
+        # go, from A1 to its last used cell, and keep it here as a tuple of row tuples.
+        self.sheets = {}
+        self.sheet = None
         # If we don't have an active workbook, open one
         if not self.app.ActiveWorkbook:
             self.quit_excel = True
@@ -102,6 +108,13 @@ class ExcelDocument(object):
         """
         self.app.Workbooks.Open(filename)
 
+    def SourceFiles(self):
+        """Return the workbook's file, or None if the workbook has changes that aren't saved to it"""
+        book = self.app.ActiveWorkbook
+        if not book.Saved or not book.Path:
+            return None
+        return [book.FullName]
+
     def SetSheet(self, sheet):
         """
         Set the active worksheet.
@@ -116,13 +129,27 @@ class ExcelDocument(object):
         """
         return self.app.ActiveWorkbook.Worksheets(sheet)
 
-    def GetColumn(self, col, sheet):
+    def GetData(self, sheet=None):
+        """
+        Return the sheet's cells from A1 to the last used cell, reading them the first time
+        """
+        sheet = sheet if sheet else self.sheet
+        try:
+            return self.sheets[sheet]
+        except KeyError:
+            pass
+        ws = self.app.ActiveWorkbook.Sheets(sheet)
+        data = ws.Range(ws.Cells(1, 1), ws.Cells.SpecialCells(constants.xlLastCell)).Value
+        if not isinstance(data, tuple): # A sheet with only A1 gives us the value itself
+            data = ((data,),)
+        self.sheets[sheet] = data
+        return data
+
+    def Forget(self, sheet=None):
         """
-        Return a column of data
+        Drop what we've read of a sheet, after it has been changed
         """
-        strip = lambda x: x[0] if len(x) == 1 else x
-        lst = [strip(i) for i in self.GetValue((1, col, self.LastRow(sheet), col), sheet)]
-        return tuple(lst)
+        self.sheets.pop(sheet if sheet else self.sheet, None)
 
     def GetRange(self, range, sheet=None):
         """
@@ -152,12 +179,13 @@ class ExcelDocument(object):
         Set the value of 'cell' to 'value'.
         """
         self.GetRange(cell, sheet).Value = value
+        self.Forget(sheet)
 
-    def GetValue(self, cell, sheet=None):
+    def GetRangeValue(self, range, sheet=None):
         """
-        Get the value of 'cell'.
+        Ask Excel for the value of a range that GetBounds() doesn't understand.
         """
-        return self.GetRange(cell, sheet).Value
+        return self.GetRange(range, sheet).Value
 
     def GetUsedRange(self, sheet=None):
         """
@@ -165,19 +193,9 @@ class ExcelDocument(object):
         """
         return self.app.ActiveWorkbook.Sheets(sheet).UsedRange.Value
 
-    def LastRow(self, sheet=None):
-        return self.app.ActiveWorkbook.Sheets(sheet).Cells.SpecialCells(constants.xlLastCell).Row
-    def LastColumn(self, sheet=None):
-        return self.app.ActiveWorkbook.Sheets(sheet).Cells.SpecialCells(constants.xlLastCell).Column
-
-    def UsedRange(self, sheet=None):
-        """
-        Return the used range of the data in the form of (endcol,endrow)
-        """
-        return (self.LastColumn(sheet), self.LastRow(sheet))
-
     def Clear(self, cell, sheet=None):
         self.GetRange(cell, sheet).Clear()
+        self.Forget(sheet)
 
     def SetBorder(self, range, side, line_style=borderSolid, color=colorBlack):
         """
@@ -197,6 +215,7 @@ class ExcelDocument(object):
         specified 'key_cell'.
         """
         range.Sort(Key1=self.GetRange(key_cell), Order1=1, Header=0, OrderCustom=1, MatchCase=False, Orientation=1)
+        self.sheets.clear() # We don't know which sheet the range is on
 
     def HideRow(self, row, hide=True):
         """
@@ -217,12 +236,14 @@ class ExcelDocument(object):
         Delete the entire 'row'.
         """
         self.GetRange('a%s' % row).EntireRow.Delete(Shift=shift)
+        self.Forget()
 
     def DeleteColumn(self, column, shift=directionLeft):
         """
         Delete the entire 'column'.
         """
         self.GetRange('%s1' % column).EntireColumn.Delete(Shift=shift)
+        self.Forget()
 
     def FitColumn(self, column):
         """
@@ -291,14 +312,3 @@ class ExcelDocument(object):
             return chr(65+n)
         else:
             return self.excelize(div-1)+chr(65+n%26)
-    def deExcelize(self, s):
-        """
-        Returns an integer value for an excel formated column value.
-        Expects a string containing only English letters
-        """
-        s = s.upper() if not s.isupper() else s
-        rem = s[:-1]
-        if rem == "":
-            return ord(s) - 65
-        else:
-            return 26*(self.deExcelize(s[:-1])+1) + ord(s[-1]) - 65
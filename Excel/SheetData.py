@@ -0,0 +1,88 @@
+"""Reading cells out of a worksheet that has been read into memory
+
+Both of the documents that HeatSourceInterface is mixed into read each
+worksheet in one go, as a block of rows starting at cell A1, and look
+up cells and ranges in that. SheetData holds the part that is the same
+for both: making sense of the range forms accepted by
+ExcelDocument.GetRange() and slicing them out of the block. A document
+provides GetData(sheet), which returns the block of rows, and
+GetRangeValue(range, sheet), for a range that GetBounds() doesn't
+understand.
+"""
+from __future__ import division
+import re
+
+class SheetData(object):
+    """Cell lookups in the rows returned by GetData()"""
+    def GetBounds(self, range):
+        """
+        Return (r1,c1,r2,c2) for the range forms accepted by ExcelDocument.GetRange(), or None for anything else.
+
+        Rows are counted from one and columns from zero, as in ExcelDocument.
+        """
+        if isinstance(range, list) or isinstance(range, tuple):
+            if len(range) == 4: # (r1,c1,r2,c2)
+                return tuple([int(i) for i in range])
+            elif len(range) == 2: # ((r1,c1),(r2,c2)) or (r,c)
+                if (isinstance(range[0], list) or isinstance(range[0], tuple)) and \
+                    (isinstance(range[1], list) or isinstance(range[1], tuple)):
+                    return int(range[0][0]), int(range[0][1]), int(range[1][0]), int(range[1][1])
+                elif isinstance(range[0], int) and isinstance(range[1], int):
+                    return range[0], range[1], range[0], range[1]
+        elif isinstance(range, str):
+            cells = [re.match("^([A-Za-z]+)([0-9]+)$", x.strip()) for x in range.split(":")]
+            if len(cells) in (1, 2) and None not in cells:
+                c1, r1 = self.deExcelize(cells[0].group(1)), int(cells[0].group(2))
+                c2, r2 = self.deExcelize(cells[-1].group(1)), int(cells[-1].group(2))
+                return r1, c1, r2, c2
+        return None
+
+    def GetValue(self, cell, sheet=None):
+        """
+        Get the value of 'cell', or a tuple of row tuples if 'cell' is a range.
+
+        Cells are looked up in the sheet's data (see GetData()), so only
+        ranges that GetBounds() doesn't understand go to GetRangeValue().
+        """
+        bounds = self.GetBounds(cell)
+        if bounds is None:
+            return self.GetRangeValue(cell, sheet)
+        r1, c1, r2, c2 = bounds
+        data = self.GetData(sheet)
+        rows = []
+        for r in xrange(r1-1, r2):
+            line = data[r] if r < len(data) else ()
+            rows.append(tuple([line[c] if c < len(line) else None for c in xrange(c1, c2+1)]))
+        if r1 == r2 and c1 == c2:
+            return rows[0][0]
+        return tuple(rows)
+
+    def GetColumn(self, col, sheet):
+        """
+        Return a column of data
+        """
+        data = self.GetData(sheet)
+        return tuple([row[col] if col < len(row) else None for row in data])
+
+    def LastRow(self, sheet=None):
+        return len(self.GetData(sheet))
+    def LastColumn(self, sheet=None):
+        return max([len(row) for row in self.GetData(sheet)] or [0])
+
+    def UsedRange(self, sheet=None):
+        """
+        Return the used range of the data in the form of (endcol,endrow)
+        """
+        return (self.LastColumn(sheet), self.LastRow(sheet))
+
+    def deExcelize(self, s):
+        """
+        Returns an integer value for an excel formated column value.
+        Expects a string containing only English letters
+        """
+        s = s.upper() if not s.isupper() else s
+        rem = s[:-1]
+        if rem == "":
+            return ord(s) - 65
+        else:
+            return 26*(self.deExcelize(s[:-1])+1) + ord(s[-1]) - 65
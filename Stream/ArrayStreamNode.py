@@ -0,0 +1,97 @@
+"""StreamNodes whose numbers live in arrays for the whole reach
+
+A StreamNode keeps each of its values in a slot of its own, as a Python
+float. An ArrayStreamNode keeps the numeric attributes that StreamReach
+works with (its static and dynamic attributes) in a NodeArrays instead,
+which has one float array per attribute with an element for each node of
+the reach, headwater first. The node's attributes are properties that
+read and write its element, so the per-node routines, the Output and
+anything else that looks at a node see the same values as ever. None is
+kept as NaN, as in the checkpoints.
+
+The arrays are the state of the whole reach in the form the vectorized
+routines want it, so StreamReach (and the checkpoints) copy a whole array
+at a time where they would otherwise visit every node. Going through a
+property is a good deal slower than a slot (the per-node routines take
+nearly twice as long), so they are meant for IniParams["vectorize"].
+
+PackNodes() turns the reach of StreamNodes read by the interface into
+ArrayStreamNodes, which ModelControl does if IniParams["node_arrays"] is
+set.
+"""
+from __future__ import division
+import numpy as np
+
+from StreamNode import StreamNode
+from StreamReach import StreamReach
+
+class NodeArrays(object):
+    """One float array per numeric StreamNode attribute, for a list of nodes"""
+    attrs = StreamReach.static + StreamReach.dynamic
+
+    def __init__(self, nodes):
+        self.nodes = len(nodes)
+        for attr in self.attrs:
+            values = [getattr(x, attr) for x in nodes]
+            setattr(self, attr, np.array([np.nan if v is None else v for v in values], dtype=float))
+
+    def Rows(self, nodes):
+        """Return the slice of the arrays that belongs to a list of nodes, or None
+
+        The nodes have to be ArrayStreamNodes of ours, one after the other
+        in the order of the arrays."""
+        if not len(nodes) or getattr(nodes[0], "arrays", None) is not self:
+            return None
+        a = nodes[0].index
+        for i, x in enumerate(nodes):
+            if getattr(x, "arrays", None) is not self or x.index != a + i:
+                return None
+        return slice(a, a + len(nodes))
+
+def Column(attr):
+    """Return a property for attr that reads and writes the node's element of the array"""
+    def get(self):
+        v = getattr(self.arrays, attr).item(self.index)
+        return v if v == v else None
+    def set(self, value):
+        getattr(self.arrays, attr)[self.index] = np.nan if value is None else value
+    return property(get, set)
+
+class ArrayStreamNode(StreamNode):
+    """A StreamNode that keeps its numeric attributes in a NodeArrays"""
+    __slots__ = ("arrays", "index")
+
+    def __init__(self, node, arrays, index):
+        """ArrayStreamNode(node, arrays, index) -> Class instance
+
+        The new node has all of node's attributes, but those in arrays are
+        kept in its index'th element."""
+        self.arrays = arrays
+        self.index = index
+        numeric = set(arrays.attrs)
+        for attr in StreamNode.__slots__:
+            if attr not in numeric:
+                setattr(self, attr, getattr(node, attr))
+
+for attr in NodeArrays.attrs:
+    setattr(ArrayStreamNode, attr, Column(attr))
+
+def PackNodes(reachlist):
+    """Return a list of ArrayStreamNodes in place of reachlist, from the headwater down
+
+    The new nodes point at each other (and at their own methods) where
+    the old ones did."""
+    arrays = NodeArrays(reachlist)
+    new = [ArrayStreamNode(x, arrays, i) for i, x in enumerate(reachlist)]
+    index = dict([(id(x), i) for i, x in enumerate(reachlist)])
+    for x in new:
+        for attr in ("next_km", "prev_km", "head"):
+            old = getattr(x, attr)
+            if old is not None:
+                setattr(x, attr, new[index[id(old)]])
+        # The nodes hold the bound methods that Initialize() chose
+        for attr in ("CalcHeat", "CalcDischarge"):
+            old = getattr(x, attr)
+            if old is not None:
+                setattr(x, attr, getattr(x, old.__name__))
+    return new
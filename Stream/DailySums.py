@@ -0,0 +1,70 @@
+"""The daily sums of the solar fluxes for a whole reach, in arrays
+
+Over a day, each node adds up its solar fluxes 1 and 4 (for the Shade
+output) and the flux blocked by each vegetation zone of the direction
+the sun is in (for SolarBlock). DailySums keeps these for every node of
+a reach, headwater first, in two arrays:
+
+    F_DailySum     (node, 5), of which only the columns 1 and 4 are used
+    Solar_Blocked  (node, direction, zone+1), where the last "zone" of a
+                   direction is the diffuse flux blocked while the sun
+                   was in that direction
+
+so a node's veg_block (the flux blocked by each zone, then the diffuse
+blocked) goes into its direction with a single add. The nodes' own
+F_DailySum and Solar_Blocked are views of their rows, so the per-node
+routines add to the same numbers that StreamReach and the ShadeEngine
+add to a whole reach at a time, and the start of a day is one fill.
+"""
+from __future__ import division
+import numpy as np
+
+from ..Dieties.IniParamsDiety import IniParams
+
+class DailySums(object):
+    """Daily solar sums of a list of StreamNodes"""
+    def __init__(self, nodes, F_DailySum=None, Solar_Blocked=None):
+        """DailySums(nodes) -> Class instance
+
+        nodes is the list of StreamNodes ordered from the headwater to
+        the mouth, whose F_DailySum and Solar_Blocked become views of
+        the new arrays (or of the arrays given, see Block())."""
+        self.nodes = nodes
+        self.directions = IniParams["radialsample_count"]
+        self.zones = IniParams["transsample_count"]
+        n = len(nodes)
+        self.F_DailySum = np.zeros((n, 5)) if F_DailySum is None else F_DailySum
+        self.Solar_Blocked = np.zeros((n, self.directions, self.zones + 1)) if Solar_Blocked is None else Solar_Blocked
+        for i, x in enumerate(nodes):
+            x.F_DailySum = self.F_DailySum[i]
+            x.Solar_Blocked = self.Solar_Blocked[i]
+
+    def Block(self, a, b):
+        """Return the DailySums of nodes a to b, which share our arrays"""
+        return DailySums(self.nodes[a:b], self.F_DailySum[a:b], self.Solar_Blocked[a:b])
+
+    def Reset(self):
+        """Zero out the sums at the start of a new day"""
+        self.F_DailySum.fill(0)
+        self.Solar_Blocked.fill(0)
+
+    def Add(self, dir, F_Solar, veg_block):
+        """Add a timestep's (node, 8) solar fluxes and (node, zone+1) blocked flux, with the sun in dir"""
+        self.F_DailySum[:, 1::3] += F_Solar[:, 1:5:3]
+        self.Solar_Blocked[:, dir] += veg_block
+
+    def Shade(self):
+        """Return each node's effective shade for the day"""
+        return (self.F_DailySum[:, 1] - self.F_DailySum[:, 4]) / self.F_DailySum[:, 1]
+
+    def Blocked(self, directions=None):
+        """Return the flux blocked by each zone, then the diffuse flux blocked, as (node, direction*zone+1)
+
+        The zones are those of the first directions directions (all of
+        them by default), one direction after the other."""
+        directions = self.directions if directions is None else directions
+        n = len(self.nodes)
+        blocked = np.empty((n, directions * self.zones + 1))
+        blocked[:, :-1] = self.Solar_Blocked[:, :directions, :-1].reshape(n, -1)
+        blocked[:, -1] = self.Solar_Blocked[:, :, -1].sum(axis=1)
+        return blocked
@@ -0,0 +1,71 @@
+"""Solar position for every timestep of a model run
+
+The sun's position only depends on where the headwater is and what time
+it is, yet CalcHeat_BoundaryNode works it out from scratch every timestep
+(and every spin-up day, and every scenario of a batch run). The Ephemeris
+calculates it once for the entire run with the array version of
+CalcSolarPosition, and can keep the result in a cache directory so that
+later runs over the same place and time just load it.
+"""
+from __future__ import division
+import numpy as np
+from time import gmtime
+from os.path import join, exists
+from hashlib import sha1
+
+from ..Dieties.ChronosDiety import JulianCentury
+from ..Utils.Logger import Logger
+import PyHeatsource as py_HS
+import VectorHeatsource as vec_HS
+
+class Ephemeris(object):
+    def __init__(self, lat, lon, offset, dt, start, stop, radial_samples, cachedir=None):
+        """Ephemeris(lat, lon, offset, dt, start, stop, radial_samples, cachedir) -> Class instance
+
+        Calculate (or load from cachedir, if given) the Altitude, Zenith,
+        Daytime and direction of the sun for every timestep between start
+        and stop. Indexing the instance with a time returns the same tuple
+        as CalcSolarPosition."""
+        self.lat, self.lon, self.offset = lat, lon, offset
+        self.radial_samples = radial_samples
+        self.start = start
+        self.dt = dt
+        self.steps = int((stop - start) // dt) + 1
+        key = repr((float(lat), float(lon), float(offset), float(dt), float(start), float(stop), int(radial_samples)))
+        filename = join(cachedir, "ephemeris_%s.npz" % sha1(key).hexdigest()) if cachedir else None
+        if filename and exists(filename):
+            data = np.load(filename)
+            if str(data["key"]) == key:
+                self.Altitude, self.Zenith, self.Daytime, self.dir = \
+                    data["Altitude"], data["Zenith"], data["Daytime"], data["dir"]
+                Logger.write("Loaded solar ephemeris from %s" % filename)
+                return
+        self.Calculate()
+        if filename:
+            np.savez(filename, key=np.array(key), Altitude=self.Altitude, Zenith=self.Zenith,
+                     Daytime=self.Daytime, dir=self.dir)
+
+    def Calculate(self):
+        """Fill in the arrays for every timestep"""
+        times = self.start + self.dt * np.arange(self.steps)
+        # Chronos gets the hour, minute, second and julian century from gmtime(), so we do too.
+        seconds = times.astype(np.int64) % 86400
+        hour = seconds // 3600
+        min = (seconds % 3600) // 60
+        sec = seconds % 60
+        days = times.astype(np.int64) // 86400
+        JDC = np.empty(self.steps)
+        for day in np.unique(days):
+            JDC[days == day] = JulianCentury(int(day) * 86400)
+        self.Altitude, self.Zenith, self.Daytime, self.dir = \
+            vec_HS.CalcSolarPosition(self.lat, self.lon, hour, min, sec, self.offset, JDC, self.radial_samples)
+
+    def __getitem__(self, time):
+        step = (time - self.start) / self.dt
+        i = int(step)
+        if i != step or i < 0 or i >= self.steps:
+            # Not on our grid, so work it out the long way
+            year, month, day, hour, min, sec = gmtime(time)[:6]
+            return py_HS.CalcSolarPosition(self.lat, self.lon, hour, min, sec, self.offset,
+                                           JulianCentury(time), self.radial_samples)
+        return self.Altitude.item(i), self.Zenith.item(i), self.Daytime.item(i), self.dir.item(i)
@@ -0,0 +1,250 @@
+"""Run the timesteps of a reach on several CPU cores at once
+
+The reach is split into IniParams["pipeline"] contiguous segments, each
+of which is run by its own worker process with the same StreamNode
+methods that ModelControl.run_all() calls. A node only looks at its
+neighbours, so a segment only needs a few values from the nodes on
+either side of it, which the workers pass to each other through shared
+memory. Segment k's timestep t needs
+
+    Q and Q_prev of the node upstream, after its discharge at t
+    T_prev of the node upstream, after its heat at t
+    T of the node upstream, after its MacCormick corrector at t
+    T_prev and Mix_T_Delta of the node downstream, after its heat at t-1
+    T and Mix_T_Delta of the node downstream, after its heat at t
+
+so while segment k runs the corrector for timestep t, segment k-1 can
+already be working on the discharge and heat of timestep t+1, and the
+timesteps move down the reach as a wavefront. Every node does exactly
+the same arithmetic, in the same order, as in a serial run, so the
+results are identical, bit for bit.
+
+The neighbours' values are copied into the worker's own copy of the
+neighbouring node (the "ghost"), which then looks to the node methods
+like it does in a serial run. Each of the four kinds of message has two
+slots, by the parity of the timestep. A slot holds the timestep it was
+written for and the last timestep read from it: the reader spins until
+it sees the timestep it wants, and the writer until the slot's last
+message has been read (which only holds anything up in a hydraulics
+run, where nothing stops the upstream segments from running ahead).
+
+On the hour, each worker copies the state of its own nodes into shared
+arrays (see Utils/Checkpoint.py for the layout) and the parent process
+puts them back into its nodes and calls the Output, as a serial run
+would. The workers inherit the model from the parent, so this needs an
+operating system that can fork (i.e. not Windows). Only the per-node
+routines are pipelined; checkpoints, the early end to the spin-up, the
+profiler and the vectorized StreamReach need the whole reach in one
+process and can't be combined with it.
+"""
+from __future__ import division
+from multiprocessing import Process, Queue
+from multiprocessing.sharedctypes import RawArray
+from traceback import format_exc
+from time import sleep
+import os
+import numpy as np
+
+from ..Dieties.IniParamsDiety import IniParams
+from ..Dieties.ChronosDiety import Chronos
+from ..Utils.Checkpoint import GetNodeState, SetNodeState
+from StreamReach import StreamReach
+from DailySums import DailySums
+import StreamNode
+
+# The messages that pass between neighbouring segments, and the number of values in each
+DISC, HEATU, CORR, HEATD = range(4) # Upstream discharge, upstream heat, upstream corrector, downstream heat
+width = 3
+
+def Shared(shape):
+    """Return a float array of shape in memory that survives a fork"""
+    size = int(np.prod(shape))
+    return np.frombuffer(RawArray('d', size), dtype=float).reshape(shape)
+
+class PipelineFailed(Exception): pass
+
+class Pipeline(object):
+    def __init__(self, reachlist, run_type, segments, daily=None):
+        """Pipeline(reachlist, run_type, segments, daily) -> Class instance
+
+        reachlist is the list of StreamNodes ordered from the headwater
+        to the mouth, segments is the number of worker processes and
+        daily is the nodes' DailySums (a new one if not given)."""
+        if not hasattr(os, "fork"):
+            raise Exception("The pipeline needs an operating system that can fork")
+        if not 1 < segments <= len(reachlist):
+            raise Exception("The pipeline needs between 2 and %i segments, not %i" % (len(reachlist), segments))
+        self.reachlist = reachlist
+        self.run_type = run_type
+        self.segments = segments
+        n = len(reachlist)
+        self.bounds = [i * n // segments for i in xrange(segments + 1)]
+        if daily is None: daily = DailySums(reachlist)
+        self.daily = [daily.Block(a, b) for a, b in zip(self.bounds, self.bounds[1:])]
+        # mail[boundary, message, slot] is (timestep written, timestep read, values...)
+        # from the segments either side of a boundary
+        self.mail = Shared((segments - 1, 4, 2, width + 2))
+        self.mail[..., :2] = -1
+        # Hours published by each worker, hours taken by the parent, the mouth's outflow, and a failure flag
+        self.hours = Shared((segments,))
+        self.ack = Shared((1,))
+        self.out = Shared((1,))
+        self.failed = Shared((1,))
+        self.errors = Queue()
+        self.workers = [] # The worker processes, while Run() is going
+        # Two buffers of the node state, by the parity of the hour
+        directions = IniParams["radialsample_count"]
+        shapes = dict([(attr, (n,)) for attr in StreamReach.dynamic])
+        shapes.update({"F_Solar": (n, 8), "F_DailySum": (n, 5),
+                       "Solar_Blocked": (n, directions, IniParams["transsample_count"] + 1)})
+        self.state = [dict([(name, Shared(shape)) for name, shape in shapes.iteritems()]) for i in xrange(2)]
+
+    def Wait(self, array, index, value, pause=0.0001, workers=()):
+        """Wait until array[index] reaches value, or somebody fails
+
+        A worker that is killed (or crashes) can't set the failure flag,
+        so the parent passes in the workers to look for that itself."""
+        spins = 0
+        while array[index] < value:
+            if self.failed[0]: raise PipelineFailed
+            # Neighbours usually answer quickly, but with more segments than
+            # CPUs we have to get out of the way of the one we're waiting for.
+            spins += 1
+            if spins > 100:
+                if [w for w in workers if w.exitcode]: raise PipelineFailed
+                sleep(pause)
+
+    def Send(self, boundary, message, step, *values):
+        slot = self.mail[boundary, message, step % 2]
+        # Wait for the message from two timesteps ago to be read
+        self.Wait(slot, 1, step - 2)
+        slot[2:len(values) + 2] = [v if v is not None else np.nan for v in values]
+        # The timestep goes in last, since it tells the reader that the values are there
+        slot[0] = step
+
+    def Receive(self, boundary, message, step, last=True):
+        """Return the values of a message, which is marked as read if this is the last look at it"""
+        slot = self.mail[boundary, message, step % 2]
+        self.Wait(slot, 0, step)
+        values = [v if v == v else None for v in slot[2:].tolist()]
+        if last: slot[1] = step
+        return values
+
+    def Publish(self, k, hour, nodes):
+        """Copy the state of segment k's nodes into the buffer for hour"""
+        # The parent has to be done with this buffer from two hours ago
+        self.Wait(self.ack, 0, hour - 2)
+        a, b = self.bounds[k], self.bounds[k + 1]
+        state = self.state[hour % 2]
+        for name, array in GetNodeState(nodes).iteritems():
+            state[name][a:b] = array
+        self.hours[k] = hour
+
+    def Worker(self, k):
+        """Run segment k from the current time to the end of the model"""
+        try:
+            self.RunSegment(k)
+        except PipelineFailed:
+            pass # Somebody else failed, and they report it
+        except:
+            self.errors.put("Segment %i: %s" % (k, format_exc()))
+            self.failed[0] = 1
+
+    def RunSegment(self, k):
+        nodes = self.reachlist[self.bounds[k]:self.bounds[k + 1]]
+        daily = self.daily[k]
+        first, last = nodes[0], nodes[-1]
+        # Ghosts of the neighbouring segments' end nodes
+        up = first.prev_km if k else None
+        down = last.next_km if k < self.segments - 1 else None
+        head = first.head
+        below = nodes[1:] if head is first else nodes # As in ModelControl.run_hs()
+        hydraulics = self.run_type in (0, 2)
+        heat = self.run_type in (0, 1)
+        transport = self.run_type == 0
+        solar_only = self.run_type == 1
+        time = Chronos.TheTime
+        stop = Chronos.stop
+        step = 0
+        hours = 0
+        out = 0
+        while time <= stop:
+            year, month, day, hour, minute, second, JD, offset, JDC = Chronos.TimeTuple()
+            if not (hour + minute + second):
+                daily.Reset()
+            if hydraulics:
+                if up: up.Q, up.Q_prev = self.Receive(k - 1, DISC, step)[:2]
+                [x.CalcDischarge(time) for x in nodes]
+                if down: self.Send(k, DISC, step, last.Q, last.Q_prev)
+            if heat:
+                if up:
+                    up.T_prev = self.Receive(k - 1, HEATU, step)[0]
+                    # The headwater works out the solar position for everyone, so we do the same for our nodes
+                    if head.Ephemeris:
+                        head.SolarPos = head.Ephemeris[time]
+                    else:
+                        head.SolarPos = StreamNode._HS.CalcSolarPosition(head.Latitude, head.Longitude, hour, minute, second,
+                                                                         head.UTC_offset, JDC, IniParams["radialsample_count"])
+                if down and step: down.T_prev, down.Mix_T_Delta = self.Receive(k, HEATD, step - 1)[:2]
+                if not up: head.CalcHeat(time, hour, minute, second, JD, JDC, solar_only)
+                if head.SolarPos[2]: [x.CalcHeat(time, hour, minute, second, JD, JDC, solar_only) for x in below]
+                else: [x.CalcHeat_Night(time, hour, minute, second, JD, JDC, solar_only) for x in below]
+                if down: self.Send(k, HEATU, step, last.T_prev)
+                if up: self.Send(k - 1, HEATD, step, first.T_prev, first.Mix_T_Delta, first.T)
+            if transport:
+                # The heat of the next timestep looks at this message again
+                if down: down.T_prev, down.Mix_T_Delta, down.T = self.Receive(k, HEATD, step, False)
+                if up: up.T = self.Receive(k - 1, CORR, step)[0]
+                [x.MacCormick2(time) for x in nodes]
+                if down: self.Send(k, CORR, step, last.T)
+            if not (minute + second):
+                hours += 1
+                self.Publish(k, hours, nodes)
+            if not down: out += last.Q
+            time = Chronos(True)
+            step += 1
+        if not down: self.out[0] = out
+        self.Publish(k, hours + 1, nodes)
+
+    def Run(self, output, PB, timesteps):
+        """Run the model to the end, returning the volume that flowed out of the mouth
+
+        output is called on the hour, as in ModelControl.Run(), and PB
+        is given the progress."""
+        workers = self.workers = [Process(target=self.Worker, args=(k,)) for k in xrange(self.segments)]
+        for w in workers: w.start()
+        try:
+            time = Chronos.TheTime
+            stop = Chronos.stop
+            step = 0
+            hours = 0
+            while time <= stop:
+                year, month, day, hour, minute, second, JD, offset, JDC = Chronos.TimeTuple()
+                if not (minute + second):
+                    hours += 1
+                    self.Take(hours)
+                    PB("%i of %i timesteps" % (step, timesteps))
+                    output(time, hour)
+                    self.ack[0] = hours
+                time = Chronos(True)
+                step += 1
+            self.Take(hours + 1)
+            for w in workers: w.join()
+        except PipelineFailed:
+            # The workers catch their own exceptions and end normally, so
+            # one with an exit code was killed before it could report anything
+            dead = [(k, w.exitcode) for k, w in enumerate(workers) if w.exitcode]
+            if dead: raise Exception("Segment %i died with exit code %i" % dead[0])
+            raise Exception(self.errors.get())
+        finally:
+            # Stop any workers that are still going if we didn't get to the end
+            if [w for w in workers if w.is_alive()]:
+                self.failed[0] = 2
+                for w in workers: w.terminate()
+        return self.out[0]
+
+    def Take(self, hour):
+        """Wait for every segment's state for hour and put it into the nodes"""
+        for k in xrange(self.segments):
+            self.Wait(self.hours, k, hour, 0.0005, self.workers)
+        SetNodeState(self.reachlist, self.state[hour % 2])
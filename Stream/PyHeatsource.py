@@ -176,7 +176,11 @@ def CalcMuskingum(Q_est, U, W_w, S, dx, dt):
     # TODO: reformulate this using an updated model, such as Moramarco, et.al., 2006
     return C1, C2, C3
 
-def CalcFlows(U, W_w, W_b, S, dx, dt, z, n, D_est, Q, Q_up, Q_up_prev, inputs, Q_bc):
+def CalcFlows(U, W_w, W_b, S, dx, dt, z, n, D_est, Q, Q_up, Q_up_prev, inputs, Q_bc, rating=None):
+    """Route the discharge and return it with the new stream geometry
+
+    If rating is a RatingTable for this channel, it is used in place of
+    the secant depth solver."""
     if Q_bc >= 0:
         Q_new = Q_bc
     else:
@@ -186,16 +190,36 @@ def CalcFlows(U, W_w, W_b, S, dx, dt, z, n, D_est, Q, Q_up, Q_up_prev, inputs, Q
         Q_new = C[0]*Q1 + C[1]*Q2 + C[2]*Q
 
     #if Q_new > 0.000:
-    Geom = GetStreamGeometry(Q_new, W_b, z, n, S, D_est, dx, dt)
+    if rating:
+        Geom = rating.GetStreamGeometry(Q_new, D_est, dx, dt)
+    else:
+        Geom = GetStreamGeometry(Q_new, W_b, z, n, S, D_est, dx, dt)
     return Q_new, Geom
 
+# Zeros for clearing the lists that CalcHeatFluxes() is given to fill
+_zeros3 = (0,)*3
+_zeros8 = (0,)*8
+_zeros11 = (0,)*9 + (0.0, 0.0)
+
+# Scratch space for GetSolarFlux(), whose every element is set before it is read.
+# Being module-wide, they make GetSolarFlux() single threaded. That holds, as
+# the models run side by side in processes (Pipeline, ShadeBlocks, Batch) and
+# the only other thread, the output writer, doesn't calculate anything.
+_F_Direct = [0]*8
+_F_Diffuse = [0]*8
+
 def GetSolarFlux(hour, JD, Altitude, Zenith, cloud, d_w, W_b, Elevation, TopoFactor,
-                 ViewToSky, SampleDist, phi, emergent, VDensity, VHeight, ShaderList):
-    """Old method, now pushed down to a C module. This is left for testing only"""
+                 ViewToSky, SampleDist, phi, emergent, VDensity, VHeight, ShaderList,
+                 F_Solar=None, veg_block=None):
+    """Old method, now pushed down to a C module. This is left for testing only
+
+    If F_Solar (8 long) and veg_block (an array one longer than the
+    number of vegetation zones) are given, the fluxes are written into
+    them and they are returned instead of new lists."""
     FullSunAngle, TopoShadeAngle, BankShadeAngle, rip, veg = ShaderList
-    F_Direct = [0]*8
-    F_Diffuse = [0]*8
-    F_Solar = [0]*8
+    F_Direct = _F_Direct
+    F_Diffuse = _F_Diffuse
+    if F_Solar is None: F_Solar = [0]*8
     FullSunAngle,TopoShadeAngle,BankShadeAngle,RipExtinction,VegetationAngle = ShaderList
     # Make all math functions local to save time by preventing failed searches of local, class and global namespaces
     #======================================================
@@ -236,7 +260,12 @@ def GetSolarFlux(hour, JD, Altitude, Zenith, cloud, d_w, W_b, Elevation, TopoFac
     ########################################################
     #======================================================
     #3 - Above Stream Surface (Above Bank Shade)
-    Solar_blocked_byVeg = [0]*len(VegetationAngle) #amount of solar radiation blocked by each zone, plus one for diffuse
+    #amount of solar radiation blocked by each zone, plus one for diffuse
+    if veg_block is None:
+        Solar_blocked_byVeg = [0]*(len(VegetationAngle)+1)
+    else:
+        Solar_blocked_byVeg = veg_block
+        Solar_blocked_byVeg.fill(0)
     if Altitude <= TopoShadeAngle:    #>Topographic Shade IS Occurring<
         F_Direct[2] = 0
         F_Diffuse[2] = F_Diffuse[1] * TopoFactor
@@ -260,7 +289,7 @@ def GetSolarFlux(hour, JD, Altitude, Zenith, cloud, d_w, W_b, Elevation, TopoFac
         F_Direct[3] = F_Direct[2]
     F_Diffuse[3] = F_Diffuse[2] * ViewToSky
     diffuse_blocked = F_Diffuse[2]-F_Diffuse[3]
-    Solar_blocked_byVeg.append(diffuse_blocked)
+    Solar_blocked_byVeg[len(VegetationAngle)] = diffuse_blocked
     #4 - Above Stream Surface (What a Solar Pathfinder measures)
     #Account for bank shade
     if Altitude > TopoShadeAngle and Altitude <= BankShadeAngle:  #Bank shade is occurring
@@ -360,7 +389,11 @@ def GetSolarFlux(hour, JD, Altitude, Zenith, cloud, d_w, W_b, Elevation, TopoFac
 
 def GetGroundFluxes(Cloud, Wind, Humidity, T_Air, Elevation, phi, VHeight, ViewToSky, SedDepth, dx,
                     dt, SedThermCond, SedThermDiff, calcalluv, T_alluv, P_w, W_w, emergent, penman, wind_a,
-                    wind_b, calcevap, T_prev, T_sed, Q_hyp, F_Solar5, F_Solar7):
+                    wind_b, calcevap, T_prev, T_sed, Q_hyp, F_Solar5, F_Solar7, out=None):
+    """Return the ground fluxes and new sediment temperature, as a tuple
+
+    If out is given, the nine values are written into its first nine
+    elements and it is returned instead."""
 
     #SedThermCond units of W/(m *C)
     #SedThermDiff units of cm^2/sec
@@ -462,10 +495,22 @@ def GetGroundFluxes(Cloud, Wind, Humidity, T_Air, Elevation, phi, VHeight, ViewT
         F_Conv = F_Evap * Bowen
     F_Conv = F_Evap * Bowen
     E = Evap_Rate*W_w if calcevap else 0
-    return F_Cond, T_sed_new, F_Longwave, F_LW_Atm, F_LW_Stream, F_LW_Veg, F_Evap, F_Conv, E
+    if out is None:
+        return F_Cond, T_sed_new, F_Longwave, F_LW_Atm, F_LW_Stream, F_LW_Veg, F_Evap, F_Conv, E
+    out[0] = F_Cond
+    out[1] = T_sed_new
+    out[2] = F_Longwave
+    out[3] = F_LW_Atm
+    out[4] = F_LW_Stream
+    out[5] = F_LW_Veg
+    out[6] = F_Evap
+    out[7] = F_Conv
+    out[8] = E
+    return out
 
 def CalcMacCormick(dt, dx, U, T_sed, T_prev, Q_hyp, Q_tup, T_tup, Q_up, Delta_T, Disp, S1,
-                   S1_value, T0, T1, T2, Q_accr, T_accr, MixTDelta_dn):
+                   S1_value, T0, T1, T2, Q_accr, T_accr, MixTDelta_dn, out=None):
+    """Return the new temperature, S and the mixing change as a tuple, or in out if it's given"""
     Q_in = 0
     T_in = 0
     T_up = T0
@@ -506,48 +551,114 @@ def CalcMacCormick(dt, dx, U, T_sed, T_prev, Q_hyp, Q_tup, T_tup, Q_up, Delta_T,
     else:
         Temp = T1 + S * dt
 
-    return Temp, S, T_mix
+    if out is None:
+        return Temp, S, T_mix
+    out[0] = Temp
+    out[1] = S
+    out[2] = T_mix
+    return out
+
+def CalcGroundBalance(ContData, C_args, area, P_w, W_w, U, Q_tribs, T_tribs, T_prev, T_sed, Q_hyp,
+                      T_dn_prev, Disp, Q_up_prev, T_up_prev, MixTDelta_dn_prev,
+                      F_Solar5, F_Solar6, F_Solar7, fluxes, Mac):
+    """The rest of a node's heat balance, once the solar fluxes are known
+
+    CalcHeatFluxes() and CalcNightFluxes() both finish with this, giving
+    it solar fluxes 5, 6 and 7 (which are 0 at night). It fills fluxes
+    with the 9 ground fluxes, F_Total and Delta_T, and Mac with the
+    MacCormick Temp, S and T_mix, except for a boundary node."""
+    cloud, wind, humidity, T_air = ContData
+    W_b, Elevation, TopoFactor, ViewToSky, phi, VDensity, VHeight, \
+        SedDepth, dx, dt, SedThermCond, SedThermDiff, Q_accr, T_accr, \
+        has_prev, SampleDist, emergent, wind_a, wind_b, calcevap, penman, calcalluv, T_alluv = C_args
+
+    GetGroundFluxes(cloud, wind, humidity, T_air, Elevation,
+                    phi, VHeight, ViewToSky, SedDepth, dx,
+                    dt, SedThermCond, SedThermDiff, calcalluv, T_alluv, P_w,
+                    W_w, emergent, penman, wind_a, wind_b,
+                    calcevap, T_prev, T_sed, Q_hyp, F_Solar5,
+                    F_Solar7, fluxes)
+
+    F_Total = fluxes[9] = F_Solar6 + fluxes[0] + fluxes[2] + fluxes[6] + fluxes[7]
+    Delta_T = fluxes[10] = F_Total * dt / ((area / W_w) * 4182 * 998.2) # Vars are Cp (J/kg *C) and P (kgS/m3)
+
+    if has_prev:
+        #Mac includes Temp, S, T_mix
+        CalcMacCormick(dt, dx, U, fluxes[1], T_prev, Q_hyp, Q_tribs, T_tribs, Q_up_prev,
+                    Delta_T, Disp, 0, 0.0, T_up_prev, T_prev, T_dn_prev, Q_accr, T_accr, MixTDelta_dn_prev, Mac)
 
 def CalcHeatFluxes(ContData, C_args, d_w, area, P_w, W_w, U, Q_tribs, T_tribs, T_prev,
                    T_sed, Q_hyp, T_dn_prev, ShaderList, Disp, hour, JD, daytime, Altitude, Zenith,
-                   Q_up_prev, T_up_prev, solar_only, MixTDelta_dn_prev):
+                   Q_up_prev, T_up_prev, solar_only, MixTDelta_dn_prev,
+                   F_Solar=None, veg_block=None, fluxes=None, Mac=None):
+    """Calculate the heat fluxes and new temperature of a node for one timestep
+
+    Without the last four arguments, this returns the solar fluxes, the
+    ground fluxes, F_Total, Delta_T, the MacCormick results (except for
+    a boundary node) and veg_block, which it fills in new lists. A
+    StreamNode calls this for every node and timestep, so it passes its
+    own lists instead: F_Solar (8 long), veg_block (an array one longer than
+    the number of vegetation zones), fluxes (the 9 ground fluxes followed by F_Total and
+    Delta_T) and Mac (Temp, S and T_mix), which are filled in place, and
+    nothing is returned."""
     cloud, wind, humidity, T_air = ContData
     W_b, Elevation, TopoFactor, ViewToSky, phi, VDensity, VHeight, \
         SedDepth, dx, dt, SedThermCond, SedThermDiff, Q_accr, T_accr, \
         has_prev, SampleDist, emergent, wind_a, wind_b, calcevap, penman, calcalluv, T_alluv = C_args
 
-    solar = [0]*8
-    veg_block = [0]*len(ShaderList[4])+[0] #plus one for diffuse blocked
+    tuples = fluxes is None
+    if tuples:
+        F_Solar = [0]*8
+        fluxes = [0]*11
+        Mac = [0]*3
+        # By day, GetSolarFlux() makes veg_block
+        if not daytime: veg_block = [0]*(len(ShaderList[4])+1) #plus one for diffuse blocked
+
     if daytime:
-        solar,veg_block = GetSolarFlux(hour, JD, Altitude, Zenith, cloud, d_w, W_b,
+        F_Solar, veg_block = GetSolarFlux(hour, JD, Altitude, Zenith, cloud, d_w, W_b,
                     Elevation, TopoFactor, ViewToSky, SampleDist, phi, emergent,
-                    VDensity, VHeight, ShaderList)
+                    VDensity, VHeight, ShaderList, F_Solar, veg_block)
+    elif not tuples:
+        veg_block.fill(0)
+        F_Solar[:] = _zeros8
 
     # We're only running shade, so return solar and some empty calories
     if solar_only:
+        fluxes[:] = _zeros11
+        if has_prev: Mac[:] = _zeros3
+    else:
+        CalcGroundBalance(ContData, C_args, area, P_w, W_w, U, Q_tribs, T_tribs, T_prev, T_sed, Q_hyp,
+                          T_dn_prev, Disp, Q_up_prev, T_up_prev, MixTDelta_dn_prev,
+                          F_Solar[5], F_Solar[6], F_Solar[7], fluxes, Mac)
+
+    if tuples:
+        ground = tuple(fluxes[:9])
         # Boundary node
-        if not has_prev: return solar, [0]*9, 0.0, 0.0, veg_block
+        if not has_prev: return F_Solar, ground, fluxes[9], fluxes[10], veg_block
         # regular node
-        else: return solar, [0]*9, 0.0, 0.0, [0]*3, veg_block
-
-    ground = GetGroundFluxes(cloud, wind, humidity, T_air, Elevation,
-                    phi, VHeight, ViewToSky, SedDepth, dx,
-                    dt, SedThermCond, SedThermDiff, calcalluv, T_alluv, P_w,
-                    W_w, emergent, penman, wind_a, wind_b,
-                    calcevap, T_prev, T_sed, Q_hyp, solar[5],
-                    solar[7])
-
-    F_Total =  solar[6] + ground[0] + ground[2] + ground[6] + ground[7]
-    Delta_T = F_Total * dt / ((area / W_w) * 4182 * 998.2) # Vars are Cp (J/kg *C) and P (kgS/m3)
-
-    if not has_prev:
-        return solar, ground, F_Total, Delta_T, veg_block
-
-    Mac = CalcMacCormick(dt, dx, U, ground[1], T_prev, Q_hyp, Q_tribs, T_tribs, Q_up_prev,
-                Delta_T, Disp, 0, 0.0, T_up_prev, T_prev, T_dn_prev, Q_accr, T_accr, MixTDelta_dn_prev)
-
-    #Mac includes Temp, S, T_mix
-    return solar, ground, F_Total, Delta_T, Mac, veg_block
+        return F_Solar, ground, fluxes[9], fluxes[10], tuple(Mac), veg_block
+
+def CalcNightFluxes(ContData, C_args, d_w, area, P_w, W_w, U, Q_tribs, T_tribs, T_prev,
+                    T_sed, Q_hyp, T_dn_prev, Disp, Q_up_prev, T_up_prev, MixTDelta_dn_prev,
+                    fluxes=None, Mac=None):
+    """CalcHeatFluxes() for a node below the headwater when the sun is down
+
+    There is no solar flux and nothing for the vegetation to block, so
+    this skips straight to the ground fluxes and the MacCormick predictor,
+    and returns the same as CalcHeatFluxes() without the solar fluxes and
+    veg_block. As there, fluxes and Mac can be given to be filled in
+    instead."""
+    tuples = fluxes is None
+    if tuples:
+        fluxes = [0]*11
+        Mac = [0]*3
+
+    CalcGroundBalance(ContData, C_args, area, P_w, W_w, U, Q_tribs, T_tribs, T_prev, T_sed, Q_hyp,
+                      T_dn_prev, Disp, Q_up_prev, T_up_prev, MixTDelta_dn_prev,
+                      0, 0, 0, fluxes, Mac)
+
+    if tuples:
+        return tuple(fluxes[:9]), fluxes[9], fluxes[10], tuple(Mac)
 
 try:
     from .. import opt
@@ -560,5 +671,7 @@ try:
         bind(GetSolarFlux)
         bind(GetGroundFluxes)
         bind(CalcMacCormick)
+        bind(CalcGroundBalance)
         bind(CalcHeatFluxes)
+        bind(CalcNightFluxes)
 except ImportError: pass
@@ -0,0 +1,277 @@
+"""Shade-a-lator runs for the whole model period on arrays
+
+A shade-only run (run_type 1) doesn't calculate any hydraulics or water
+temperatures, so a node's solar flux only depends on where the sun is,
+the node's shade geometry, the cloudiness and the (unchanging) depth.
+Nothing has to wait for the timestep before it, so rather than asking
+every node for its fluxes one timestep at a time, the ShadeEngine
+takes a window of timesteps from the Chronos clock, and calls the array
+version of GetSolarFlux once for every daytime timestep of the window
+and every node. The window is as long as it can be without the biggest
+array (the flux blocked by each vegetation zone) going over cells
+values, so a long model period is worked through a few days at a time.
+
+The daily sums are then added up timestep by timestep (into the reach's
+DailySums, which the nodes share) in the same order as the nodes add
+them, so Heat_SR1/SR4/SR6, Shade, VTS and SolarBlock
+come out the same as in a per-node shade run. On the hour, the nodes are
+given the state the Output looks at, as in ModelControl.Run(). There is
+nothing to save in the middle of a window, so checkpoints and spin-up
+files can't be combined with it.
+
+A node's shade doesn't depend on its neighbours either, so ShadeBlocks
+splits the reach into blocks of nodes and runs a ShadeEngine for each
+block in its own worker process. On the hour, each worker copies the
+solar fluxes of its nodes (and at the end of the day, the daily sums)
+into shared arrays, and the parent process puts them into its nodes
+and DailySums, and calls the Output as a single engine would. As with
+the Pipeline, the workers inherit the model from the parent, so this
+needs an operating system that can fork.
+"""
+from __future__ import division
+from multiprocessing import Process, Queue
+from traceback import format_exc
+from time import sleep
+import os
+import numpy as np
+
+from ..Dieties.IniParamsDiety import IniParams
+from ..Dieties.ChronosDiety import Chronos
+from ..Dieties.ForcingDiety import Forcing
+import VectorHeatsource as vec_HS
+from ShadeGeometry import StackShaderLists
+from DailySums import DailySums
+from Pipeline import Shared, PipelineFailed
+import StreamNode
+
+# Number of values in the biggest array of a window
+cells = 1 << 21
+
+class ShadeEngine(object):
+    def __init__(self, reachlist, cells=cells, daily=None):
+        """ShadeEngine(reachlist, cells, daily) -> Class instance
+
+        reachlist is the list of StreamNodes ordered from the headwater
+        to the mouth, or a block of them (see ShadeBlocks), and daily is
+        their DailySums (a new one if not given)."""
+        self.nodes = reachlist
+        self.head = reachlist[0].head
+        self.FullSunAngle, self.TopoShadeAngle, self.BankShadeAngle, self.RipExtinction, self.VegetationAngle = \
+            StackShaderLists([x.ShaderList for x in reachlist])
+        self.directions, self.zones = self.VegetationAngle.shape[1:]
+        self.window = max(1, cells // (len(reachlist) * (self.zones + 1)))
+        for attr in ("W_b", "Elevation", "TopoFactor", "ViewToSky", "phi", "VDensity", "VHeight", "d_w"):
+            setattr(self, attr, np.array([getattr(x, attr) or 0.0 for x in reachlist], dtype=float))
+        # Cloudiness is looked up once per continuous data site, as in StreamReach
+        self.sites = []
+        index = {}
+        for x in reachlist:
+            if x.ContData not in index:
+                index[x.ContData] = len(self.sites)
+                self.sites.append(Forcing[x.ContData])
+        self.site_index = np.array([index[x.ContData] for x in reachlist])
+        # Daily sums of the solar fluxes 1 and 4, and of what the vegetation blocks
+        self.daily = daily if daily is not None else DailySums(reachlist)
+
+    def SolarPosition(self, time, hour, minute, second, JDC):
+        """Return (Altitude, Zenith, Daytime, dir) at time, the way the headwater works it out"""
+        head = self.head
+        if head.Ephemeris:
+            return head.Ephemeris[time]
+        return StreamNode._HS.CalcSolarPosition(head.Latitude, head.Longitude, hour, minute, second,
+                                                head.UTC_offset, JDC, IniParams["radialsample_count"])
+
+    def GetSolarFlux(self, steps):
+        """Return the solar fluxes and blocked flux for a list of daytime steps, as (step, node, ...) arrays"""
+        times = [s[0] for s in steps]
+        hour = np.array([s[4] for s in steps], dtype=float)[:, np.newaxis]
+        JD = np.array([s[7] for s in steps], dtype=float)[:, np.newaxis]
+        Altitude = np.array([s[10] for s in steps], dtype=float)[:, np.newaxis]
+        Zenith = np.array([s[11] for s in steps], dtype=float)[:, np.newaxis]
+        dirs = np.array([s[13] for s in steps])
+        cloud = np.array([[site[time][0] for site in self.sites] for time in times], dtype=float)[:, self.site_index]
+        return vec_HS.GetSolarFlux(hour, JD, Altitude, Zenith, cloud, self.d_w, self.W_b, self.Elevation,
+                    self.TopoFactor, self.ViewToSky, IniParams["transsample"], self.phi, IniParams["emergent"],
+                    self.VDensity, self.VHeight, self.FullSunAngle[:, dirs].T, self.TopoShadeAngle[:, dirs].T,
+                    self.BankShadeAngle[:, dirs].T, self.RipExtinction[:, dirs].transpose(1, 0, 2),
+                    self.VegetationAngle[:, dirs].transpose(1, 0, 2))
+
+    def ClearHeat(self):
+        """Give the nodes the empty calories that a shade-only CalcHeat() hands them"""
+        for x in self.nodes:
+            x.F_Conduction, x.T_sed, x.F_Longwave, x.F_LW_Atm, x.F_LW_Stream, \
+                x.F_LW_Veg, x.F_Evaporation, x.F_Convection, x.E = [0]*9
+            x.F_Total = x.Delta_T = 0.0
+            if x is not self.head:
+                x.T = x.T_prev = x.S1 = x.Mix_T_Delta = 0
+
+    def Run(self, output, PB, timesteps):
+        """Run the model to the end, returning the volume that flowed out of the mouth
+
+        output is called on the hour, as in ModelControl.Run(), and PB
+        is given the progress."""
+        nodes = self.nodes
+        mouth = nodes[-1]
+        self.ClearHeat()
+        time = Chronos.TheTime
+        stop = Chronos.stop
+        step = 0
+        out = 0
+        while time <= stop:
+            # Take a window of timesteps off the clock, with the sun's position for each
+            window = []
+            while time <= stop and len(window) < self.window:
+                year, month, day, hour, minute, second, JD, offset, JDC = Chronos.TimeTuple()
+                window.append((time, year, month, day, hour, minute, second, JD, offset, JDC) +
+                              tuple(self.SolarPosition(time, hour, minute, second, JDC)))
+                time = Chronos(True)
+            daytime = [s for s in window if s[12]]
+            if daytime:
+                F_Solar, veg_block = self.GetSolarFlux(daytime)
+            # Then go through it as ModelControl.Run() would
+            j = 0
+            for s in window:
+                t, hour, minute, second, Daytime, dir = s[0], s[4], s[5], s[6], s[12], s[13]
+                if not (hour + minute + second):
+                    self.daily.Reset()
+                if Daytime:
+                    self.daily.Add(dir, F_Solar[j], veg_block[j])
+                if not (minute + second):
+                    if Daytime:
+                        for x, v in zip(nodes, F_Solar[j].tolist()):
+                            x.F_Solar = v
+                    else:
+                        for x in nodes:
+                            x.F_Solar = [0]*8
+                    PB("%i of %i timesteps" % (step, timesteps))
+                    output(t, hour)
+                if Daytime: j += 1
+                out += mouth.Q
+                step += 1
+        # The headwater keeps its boundary temperature, as in CalcHeat_BoundaryNode()
+        if step: self.head.T = self.head.T_prev = self.head.T_bc[t]
+        return out
+
+class ShadeBlocks(object):
+    def __init__(self, reachlist, blocks, cells=cells, daily=None):
+        """ShadeBlocks(reachlist, blocks, cells, daily) -> Class instance
+
+        reachlist is the list of StreamNodes ordered from the headwater
+        to the mouth, and blocks is the number of worker processes. Each
+        worker's ShadeEngine gets cells values for its biggest array.
+        daily is the nodes' DailySums (a new one if not given)."""
+        if not hasattr(os, "fork"):
+            raise Exception("The shade engine needs an operating system that can fork to run in blocks")
+        if not 1 < blocks <= len(reachlist):
+            raise Exception("The shade engine needs between 2 and %i blocks, not %i" % (len(reachlist), blocks))
+        self.nodes = reachlist
+        n = len(reachlist)
+        self.bounds = [i * n // blocks for i in xrange(blocks + 1)]
+        self.daily = daily if daily is not None else DailySums(reachlist)
+        self.engines = [ShadeEngine(reachlist[a:b], cells // blocks, self.daily.Block(a, b))
+                        for a, b in zip(self.bounds, self.bounds[1:])]
+        # Hours published by each worker, hours taken by the parent, and a failure flag
+        self.hours = Shared((blocks,))
+        self.ack = Shared((1,))
+        self.failed = Shared((1,))
+        self.errors = Queue()
+        self.workers = [] # The worker processes, while Run() is going
+        # Two buffers of the node state, by the parity of the hour
+        self.state = [{"F_Solar": Shared((n, 8)), "F_DailySum": Shared(self.daily.F_DailySum.shape),
+                       "Solar_Blocked": Shared(self.daily.Solar_Blocked.shape)}
+                      for i in xrange(2)]
+
+    def Wait(self, array, index, value, pause=0.0005, workers=()):
+        """Wait until array[index] reaches value, or somebody fails
+
+        A worker that is killed (or crashes) can't set the failure flag,
+        so the parent passes in the workers to look for that itself."""
+        while array[index] < value:
+            if self.failed[0]: raise PipelineFailed
+            if [w for w in workers if w.exitcode]: raise PipelineFailed
+            sleep(pause)
+
+    def Publish(self, k, hour, daily):
+        """Copy the state of block k's nodes into the buffer for hour"""
+        # The parent has to be done with this buffer from two hours ago
+        self.Wait(self.ack, 0, hour - 2)
+        engine = self.engines[k]
+        a, b = self.bounds[k], self.bounds[k + 1]
+        state = self.state[hour % 2]
+        state["F_Solar"][a:b] = [x.F_Solar for x in engine.nodes]
+        if daily:
+            state["F_DailySum"][a:b] = engine.daily.F_DailySum
+            state["Solar_Blocked"][a:b] = engine.daily.Solar_Blocked
+        self.hours[k] = hour
+
+    def Worker(self, k, timesteps):
+        """Run block k from the current time to the end of the model"""
+        try:
+            hours = [0]
+            def output(time, hour):
+                hours[0] += 1
+                self.Publish(k, hours[0], hour == 23)
+            self.engines[k].Run(output, lambda msg: None, timesteps)
+            self.Publish(k, hours[0] + 1, True)
+        except PipelineFailed:
+            pass # Somebody else failed, and they report it
+        except:
+            self.errors.put("Block %i: %s" % (k, format_exc()))
+            self.failed[0] = 1
+
+    def Take(self, hour, daily):
+        """Wait for every block's state for hour and put it into the nodes"""
+        for k in xrange(len(self.engines)):
+            self.Wait(self.hours, k, hour, workers=self.workers)
+        state = self.state[hour % 2]
+        for x, v in zip(self.nodes, state["F_Solar"].tolist()):
+            x.F_Solar = v
+        if daily:
+            self.daily.F_DailySum[:] = state["F_DailySum"]
+            self.daily.Solar_Blocked[:] = state["Solar_Blocked"]
+
+    def Run(self, output, PB, timesteps):
+        """Run the model to the end, returning the volume that flowed out of the mouth
+
+        output is called on the hour, as in ModelControl.Run(), and PB
+        is given the progress."""
+        workers = self.workers = [Process(target=self.Worker, args=(k, timesteps)) for k in xrange(len(self.engines))]
+        for w in workers: w.start()
+        try:
+            for engine in self.engines: engine.ClearHeat()
+            mouth = self.nodes[-1]
+            time = Chronos.TheTime
+            stop = Chronos.stop
+            step = 0
+            hours = 0
+            out = 0
+            last = None
+            while time <= stop:
+                year, month, day, hour, minute, second, JD, offset, JDC = Chronos.TimeTuple()
+                if not (minute + second):
+                    hours += 1
+                    self.Take(hours, hour == 23)
+                    PB("%i of %i timesteps" % (step, timesteps))
+                    output(time, hour)
+                    self.ack[0] = hours
+                out += mouth.Q
+                last = time
+                time = Chronos(True)
+                step += 1
+            self.Take(hours + 1, True)
+            for w in workers: w.join()
+        except PipelineFailed:
+            # The workers catch their own exceptions and end normally, so
+            # one with an exit code was killed before it could report anything
+            dead = [(k, w.exitcode) for k, w in enumerate(workers) if w.exitcode]
+            if dead: raise Exception("Block %i died with exit code %i" % dead[0])
+            raise Exception(self.errors.get())
+        finally:
+            # Stop any workers that are still going if we didn't get to the end
+            if [w for w in workers if w.is_alive()]:
+                self.failed[0] = 2
+                for w in workers: w.terminate()
+        # The headwater keeps its boundary temperature, as in CalcHeat_BoundaryNode()
+        head = self.engines[0].head
+        if last is not None: head.T = head.T_prev = head.T_bc[last]
+        return out
@@ -0,0 +1,80 @@
+"""Shade geometry of a whole reach in a few arrays
+
+Each node's ShaderList used to be a tuple with a tuple for each
+direction, (FullSunAngle, TopoShadeAngle, BankShadeAngle, RipExtinction,
+VegetationAngle), the last two being tuples with one value per zone.
+That is a lot of Python floats and tuples for a big model (16 directions
+of 20 zones is some 700 objects per node). ShadeGeometry keeps the same
+numbers for every node in five arrays:
+
+    FullSunAngle, TopoShadeAngle, BankShadeAngle    node x direction
+    RipExtinction, VegetationAngle                  node x direction x zone
+
+BuildZones() fills them in, and gives each node a ShaderView in place of
+the tuple. The view still hands GetSolarFlux() the tuple for a direction
+(ShaderList[dir]), but only builds it when the sun moves into a new
+direction. StreamReach and the shade engine use the arrays directly.
+"""
+from __future__ import division
+import numpy as np
+
+class ShadeGeometry(object):
+    def __init__(self, FullSunAngle, TopoShadeAngle, BankShadeAngle, RipExtinction, VegetationAngle):
+        """ShadeGeometry(FullSunAngle, TopoShadeAngle, BankShadeAngle, RipExtinction, VegetationAngle) -> Class instance
+
+        The first three are (node, direction) arrays and the last two
+        (node, direction, zone) arrays, with the nodes in the order of
+        the reach, from the headwater down."""
+        self.FullSunAngle = FullSunAngle
+        self.TopoShadeAngle = TopoShadeAngle
+        self.BankShadeAngle = BankShadeAngle
+        self.RipExtinction = RipExtinction
+        self.VegetationAngle = VegetationAngle
+        self.nodes, self.directions, self.zones = VegetationAngle.shape
+
+    def Row(self, node, dir):
+        """Return the ShaderList tuple for a direction at the node'th node"""
+        return (self.FullSunAngle.item(node, dir), self.TopoShadeAngle.item(node, dir), self.BankShadeAngle.item(node, dir),
+                tuple(self.RipExtinction[node, dir].tolist()), tuple(self.VegetationAngle[node, dir].tolist()))
+
+    def View(self, node):
+        return ShaderView(self, node)
+
+class ShaderView(object):
+    """One node's window onto a ShadeGeometry, indexed by direction like the old ShaderList"""
+    __slots__ = ("geometry", "index", "dir", "row")
+    def __init__(self, geometry, index):
+        self.geometry = geometry
+        self.index = index
+        self.dir = None # The direction of the last row we built, which we keep
+        self.row = None
+
+    def __getitem__(self, dir):
+        if dir != self.dir:
+            self.row = self.geometry.Row(self.index, dir)
+            self.dir = dir
+        return self.row
+
+    def __len__(self):
+        return self.geometry.directions
+
+    def __getstate__(self):
+        return self.geometry, self.index
+
+    def __setstate__(self, state):
+        self.geometry, self.index = state
+        self.dir = self.row = None
+
+def StackShaderLists(shaderlists):
+    """Return the five ShadeGeometry arrays for a list of ShaderLists (views or tuples), in that order"""
+    geometry = getattr(shaderlists[0], "geometry", None)
+    if geometry is not None and not [s for s in shaderlists if getattr(s, "geometry", None) is not geometry]:
+        # All views onto one geometry, so we just pick out their rows
+        index = np.array([s.index for s in shaderlists])
+        if len(index) == geometry.nodes and (index == np.arange(geometry.nodes)).all():
+            return (geometry.FullSunAngle, geometry.TopoShadeAngle, geometry.BankShadeAngle,
+                    geometry.RipExtinction, geometry.VegetationAngle)
+        return (geometry.FullSunAngle[index], geometry.TopoShadeAngle[index], geometry.BankShadeAngle[index],
+                geometry.RipExtinction[index], geometry.VegetationAngle[index])
+    rows = [[s[i] for i in xrange(len(s))] for s in shaderlists]
+    return tuple([np.array([[d[k] for d in r] for r in rows], dtype=float) for k in xrange(5)])
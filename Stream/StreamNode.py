@@ -5,12 +5,12 @@ from math import pi,exp,log10,log,sqrt,sin,cos,tan,atan,radians
 from itertools import count
 from warnings import warn
 from time import ctime, gmtime
+import numpy as np
 
 from ..Dieties.ChronosDiety import Chronos
 from ..Dieties.IniParamsDiety import IniParams
+from ..Dieties.ForcingDiety import Forcing
 from ..Utils.Logger import Logger
-from ..Utils.easygui import indexbox, msgbox
-from ..Utils.Dictionaries import Interpolator
 import PyHeatsource as py_HS
 #Commented out below as a kludge needed to have multiple versions available to run on one machine.
 #C routines are out of date anyway and should not be run
@@ -27,72 +27,76 @@ except ImportError: pass
 
 class StreamNode(object):
     """Definition of an individual stream segment"""
+    # Declaring the members in __slots__ means that no later member names can be added accidentally,
+    # and the nodes don't each carry a dictionary of them
+    __slots__ = ("Latitude", "Longitude", "Elevation", # Geographic params
+            "FLIR_Temp", "FLIR_Time", # FLIR data
+            "T_sed", "T_in", "T_tribs", # Temperature attrs
+            "VHeight", "VDensity", "Overhang", #Vegetation params
+            "ContData", # Continuous data
+            "Zone", "T_bc", # Initialization parameters, Zone and boundary conditions
+            "Delta_T", # Current temperature calculated from only local fluxes
+            "Mix_T_Delta", #Change in temperature due to tribs, gw, points sources, accretion
+            "T", "T_prev", # Current and previous stream temperature
+            "TopoFactor", # was Topo_W+Topo_S+Topo_E/(90*3) in original code. From Above stream surface solar flux calculations
+            "ViewToSky", # Total angle of full sun view
+            "ShaderList", # List of angles and attributes to determine sun shading.
+            "F_DailySum", "F_Total", "Solar_Blocked", # Specific sums of solar fluxes
+            "SedThermCond", "SedThermDiff", "SedDepth", # Sediment conduction values
+            "hyp_percent", # Percent hyporheic exchange
+            "F_Solar", # List of important solar fluxes
+            "S",        # Slope
+            "n",        # Manning's n
+            "z", # z factor: Ration of run to rise of the side of a trapazoidal channel
+            "d_w", # Wetted depth. Calculated in GetWettedDepth()
+            "d_w_prev", # Wetted depth for the previous timestep
+            "d_cont", # Control depth
+            "W_b", # Bottom width
+            "W_w", # Wetted width, calculated as W_b + 2*z*d_w
+            "A", # Cross-sectional Area, calculated d_w * (W_b + z * d_w)
+            "P_w", # Wetted Perimeter, calculated as W_b + 2 * d_w * sqrt(1 + z**2)
+            "R_h", # Hydraulic Radius, calculated as A_x/P_w
+            "dx", # Length of this stream reach.
+            "U", # Velocity from Manning's relationship
+            "Q", # Discharge, from Manning's relationship
+            "Q_prev", # Discharge at previous timestep, previous space step is taken from another node
+            "Q_cont", # Control discharge
+            "V", # Total volume, based on current flow
+            "Q_tribs", # Inputs from tribs.
+            "Q_in", # Inputs from "accretion" in cubic meters per second
+            "Q_out", # Withdrawls from the stream, in cubic meters per second
+            "Q_hyp", # Hyporheic flow
+            "km", # River kilometer, from mouth
+            "Q_bc", # Boundary conditions, in a TimeList class, for discharge.
+            "E", # Evaporation volume inm m^3
+            "dt", # This is the timestep (for kinematic wave movement, etc.)
+            "phi", # Porosity of the bed
+            "Log",  # Global logging class
+            "Disp", "S1", # Dispersion due to shear stress and placeholder calculation variable
+            "next_km", "prev_km", "head", # reference placeholders for next, previous nodes and headwater node
+            "Q_mass", # Local mass balance variable (StreamChannel level)
+            "F_Conduction","F_Convection","F_Longwave","F_Evaporation", # Ground flux variables
+            "F_LW_Stream", "F_LW_Atm", "F_LW_Veg", # Longwave fluxes
+            "C_args", # tuple of variables that do not change during the model
+            "CalcHeat", "CalcDischarge", # Reference to correct heat calculation method
+            "SolarPos", "UTC_offset", # Solar position variables and UTC_offset for their calculation
+            "Ephemeris", # Precalculated solar positions (headwater only, optional)
+            "Rating", # Depth-discharge rating table (optional)
+            "Scratch" # Lists for CalcHeatFluxes() to fill, shared by the nodes of a reach
+            )
+
     def __init__(self, **kwargs):
-        __slots = ["Latitude", "Longitude", "Elevation", # Geographic params
-                "FLIR_Temp", "FLIR_Time", # FLIR data
-                "T_sed", "T_in", "T_tribs", # Temperature attrs
-                "VHeight", "VDensity", "Overhang", #Vegetation params
-                "ContData", # Continuous data
-                "Zone", "T_bc", # Initialization parameters, Zone and boundary conditions
-                "Delta_T", # Current temperature calculated from only local fluxes
-                "Mix_T_Delta", #Change in temperature due to tribs, gw, points sources, accretion
-                "T", "T_prev", # Current and previous stream temperature
-                "TopoFactor", # was Topo_W+Topo_S+Topo_E/(90*3) in original code. From Above stream surface solar flux calculations
-                "ViewToSky", # Total angle of full sun view
-                "ShaderList", # List of angles and attributes to determine sun shading.
-                "F_DailySum", "F_Total", "Solar_Blocked" # Specific sums of solar fluxes
-                "SedThermCond", "SedThermDiff", "SedDepth", # Sediment conduction values
-                "hyp_percent", # Percent hyporheic exchange
-                "F_Solar", # List of important solar fluxes
-                "S",        # Slope
-                "n",        # Manning's n
-                "z", # z factor: Ration of run to rise of the side of a trapazoidal channel
-                "d_w", # Wetted depth. Calculated in GetWettedDepth()
-                "d_w_prev", # Wetted depth for the previous timestep
-                "d_cont", # Control depth
-                "W_b", # Bottom width
-                "W_w", # Wetted width, calculated as W_b + 2*z*d_w
-                "A", # Cross-sectional Area, calculated d_w * (W_b + z * d_w)
-                "P_w", # Wetted Perimeter, calculated as W_b + 2 * d_w * sqrt(1 + z**2)
-                "R_h", # Hydraulic Radius, calculated as A_x/P_w
-                "dx", # Length of this stream reach.
-                "U", # Velocity from Manning's relationship
-                "Q", # Discharge, from Manning's relationship
-                "Q_prev", # Discharge at previous timestep, previous space step is taken from another node
-                "Q_cont", # Control discharge
-                "V", # Total volume, based on current flow
-                "Q_tribs", # Inputs from tribs.
-                "Q_in", # Inputs from "accretion" in cubic meters per second
-                "Q_out", # Withdrawls from the stream, in cubic meters per second
-                "Q_hyp", # Hyporheic flow
-                "km", # River kilometer, from mouth
-                "Q_bc", # Boundary conditions, in a TimeList class, for discharge.
-                "E", # Evaporation volume inm m^3
-                "dt", # This is the timestep (for kinematic wave movement, etc.)
-                "phi", # Porosity of the bed
-                "Log",  # Global logging class
-                "Disp", "S1", # Dispersion due to shear stress and placeholder calculation variable
-                "next_km", "prev_km", "head", # reference placeholders for next, previous nodes and headwater node
-                "Q_mass", # Local mass balance variable (StreamChannel level)
-                "F_Conduction","F_Convection","F_Longwave","F_Evaporation", # Ground flux variables
-                "F_LW_Stream", "F_LW_Atm", "F_LW_Veg", # Longwave fluxes
-                "C_args", # tuple of variables that do not change during the model
-                "CalcHeat", "CalcDischarge", # Reference to correct heat calculation method
-                "SolarPos", "UTC_offset" # Solar position variables and UTC_offset for their calculation
-                ]
-        # Define members in __slots__ to ensure that later member names cannot be added accidentally
-        # Set all the attributes to bare lists, or set from the constructor
-        for attr in __slots:
-            x = kwargs[attr] if attr in kwargs.keys() else None
-            setattr(self, attr, x)
-        self.__slots = __slots
-        self.__slots.sort()
+        # Set all the attributes to None, or set from the constructor
+        for attr in self.__slots__:
+            setattr(self, attr, kwargs.get(attr))
         self.T = 0.0
         self.Mix_T_Delta = 0.0
         self.Q_mass = 0
-        self.ContData = Interpolator(dt=IniParams["dt"])
-        self.T_tribs = Interpolator(dt=IniParams["dt"])
-        self.Q_tribs = Interpolator(dt=IniParams["dt"])
+        # Handles of the node's series in the Forcing registry, which until
+        # the interface says otherwise are the empty one
+        self.ContData = Forcing.none
+        self.T_tribs = Forcing.none
+        self.Q_tribs = Forcing.none
         # Create an internal dictionary that we can pass to the C module, this contains self.slots attributes
         # and other things the C module needs
         for attr in ["F_Conduction","F_Convection","F_Longwave","F_Evaporation"]:
@@ -104,7 +108,7 @@ class StreamNode(object):
         self.UTC_offset = IniParams["offset"]
     def GetNodeData(self):
         data = {}
-        for attr in self.__slots:
+        for attr in self.__slots__:
             data[attr] = getattr(self,attr)
         return data
 
@@ -141,6 +145,18 @@ class StreamNode(object):
             _HS = py_HS
         else:
             _HS = C_HS
+        # The headwater holds the lists that CalcHeatFluxes() fills in for
+        # whichever node of the reach is calculating, so that a timestep
+        # doesn't build new ones for every node: the nine ground fluxes,
+        # F_Total and Delta_T, then the MacCormick Temp, S and T_mix, then
+        # the solar flux blocked by each vegetation zone and the diffuse
+        # blocked. That last is an array, so that it goes into the node's
+        # Solar_Blocked with a single add.
+        zones = int(IniParams["transsample_count"])
+        head = self.head
+        if head.Scratch is None or len(head.Scratch[2]) != zones + 1:
+            head.Scratch = ([0]*11, [0]*3, np.zeros(zones + 1))
+        self.Scratch = head.Scratch
 
         self.CalcDischarge = self.CalculateDischarge
         self.C_args = (self.W_b, self.Elevation, self.TopoFactor, self.ViewToSky, self.phi, self.VDensity, self.VHeight,
@@ -150,13 +166,13 @@ class StreamNode(object):
 
     def CalcDischarge_Opt(self,time):
         """A Version of CalculateDischarge() that does not require checking for boundary conditions"""
-        inputs = self.Q_in + sum(self.Q_tribs[time]) - self.Q_out - self.E
+        inputs = self.Q_in + sum(Forcing[self.Q_tribs][time]) - self.Q_out - self.E
         self.Q_mass += inputs
         up = self.prev_km
         try:
             Q, (self.d_w, self.A, self.P_w, self.R_h, self.W_w, self.U, self.Disp) = \
                 _HS.CalcFlows(self.U, self.W_w, self.W_b, self.S, self.dx, self.dt, self.z, self.n, self.d_cont,
-                                 self.Q, up.Q, up.Q_prev, inputs, -1)
+                                 self.Q, up.Q, up.Q_prev, inputs, -1, self.Rating)
         except _HS.HeatSourceError, (stderr):
             self.CatchException(stderr, time)
 
@@ -174,7 +190,7 @@ class StreamNode(object):
         try:
             Q, (self.d_w, self.A, self.P_w, self.R_h, self.W_w, self.U, self.Disp) = \
                     _HS.CalcFlows(self.U, self.W_w, self.W_b, self.S, self.dx, self.dt, self.z, self.n, self.d_cont,
-                                  0.0, 0.0, 0.0, 0.0, Q_bc)
+                                  0.0, 0.0, 0.0, 0.0, Q_bc, self.Rating)
         except _HS.HeatSourceError, (stderr):
             self.CatchException(stderr, time)
 
@@ -196,19 +212,19 @@ class StreamNode(object):
         discharge value is placed in Q_prev for use by the downstream channel. This method
         makes some assumptions, one is that Q_bc is a TimeList instance holding boundary conditions
         for the given node, and that this is only True if this node has no upstream channel. Two
-        is that the values for Q_tribs is a TimeList instance or None, that Q_in and Q_out are values
+        is that Q_tribs is the handle of a series in the Forcing registry, that Q_in and Q_out are values
         in cubic meters per second of inputs and withdrawls or None. The argument t is for a
         Python datetime object and can (should) be None if we are not at a spatial boundary. dt is
         the timestep in minutes, which cannot be None.
         """
-        inputs = self.Q_in + sum(self.Q_tribs[time]) - self.Q_out - self.E
+        inputs = self.Q_in + sum(Forcing[self.Q_tribs][time]) - self.Q_out - self.E
         # Check if we are a spatial or temporal boundary node
         if self.prev_km: # There's an upstream channel, but no previous timestep.
             # In this case, we sum the incoming flow which is upstream's current timestep plus inputs.
             Q = self.prev_km.Q_prev + inputs # Add upstream node's discharge at THIS timestep- prev_km.Q would be next timestep.
             try:
                 Q, (self.d_w, self.A, self.P_w, self.R_h, self.W_w, self.U, self.Disp) = \
-                        _HS.CalcFlows(0.0, 0.0, self.W_b, self.S, self.dx, self.dt, self.z, self.n, self.d_cont, 0.0, 0.0, 0.0, inputs, Q)
+                        _HS.CalcFlows(0.0, 0.0, self.W_b, self.S, self.dx, self.dt, self.z, self.n, self.d_cont, 0.0, 0.0, 0.0, inputs, Q, self.Rating)
             except _HS.HeatSourceError, (stderr):
                 self.CatchException(stderr, time)
             # If we hit this once, we remap so we can avoid the if statements in the future.
@@ -220,7 +236,7 @@ class StreamNode(object):
             # We pad the arguments with 0 because some are unused (or currently None) in the boundary case
             try:
                 Q, (self.d_w, self.A, self.P_w, self.R_h, self.W_w, self.U, self.Disp) = \
-                        _HS.CalcFlows(0.0, 0.0, self.W_b, self.S, self.dx, self.dt, self.z, self.n, self.d_cont, 0.0, 0.0, 0.0, inputs, Q_bc)
+                        _HS.CalcFlows(0.0, 0.0, self.W_b, self.S, self.dx, self.dt, self.z, self.n, self.d_cont, 0.0, 0.0, 0.0, inputs, Q_bc, self.Rating)
             except _HS.HeatSourceError, (stderr):
                 self.CatchException(stderr, time)
             self.CalcDischarge = self.CalcDischarge_BoundaryNode
@@ -247,7 +263,9 @@ c_k: %3.4f""" % stderr
         else: msg += stderr.message
 
         msg += "\nThe model run has been halted. You may ignore any further error messages."
-        msgbox(msg)
+        if not IniParams["headless"]:
+            from ..Utils.easygui import msgbox
+            msgbox(msg)
         raise Exception(msg)
 
     def CalcHeat_Opt(self, time, hour, min, sec,JD,JDC,solar_only=False):
@@ -260,46 +278,80 @@ c_k: %3.4f""" % stderr
         self.T = None
         Altitude, Zenith, Daytime, dir = self.head.SolarPos
 
+        fluxes, Mac, veg_block = self.Scratch
         try:
-            self.F_Solar, \
-                (self.F_Conduction, self.T_sed, self.F_Longwave, self.F_LW_Atm, self.F_LW_Stream, \
-                 self.F_LW_Veg, self.F_Evaporation, self.F_Convection, self.E), self.F_Total, self.Delta_T, (self.T, self.S1, self.Mix_T_Delta), veg_block = \
-                _HS.CalcHeatFluxes(self.ContData[time], self.C_args, self.d_w, self.A, self.P_w, self.W_w, self.U,
-                            self.Q_tribs[time], self.T_tribs[time], self.T_prev, self.T_sed,
+            _HS.CalcHeatFluxes(Forcing[self.ContData][time], self.C_args, self.d_w, self.A, self.P_w, self.W_w, self.U,
+                            Forcing[self.Q_tribs][time], Forcing[self.T_tribs][time], self.T_prev, self.T_sed,
                             self.Q_hyp,self.next_km.T_prev, self.ShaderList[dir], self.Disp,
-                            hour, JD, Daytime,Altitude, Zenith, self.prev_km.Q_prev, self.prev_km.T_prev, solar_only, self.next_km.Mix_T_Delta)
-
+                            hour, JD, Daytime,Altitude, Zenith, self.prev_km.Q_prev, self.prev_km.T_prev, solar_only, self.next_km.Mix_T_Delta,
+                            self.F_Solar, veg_block, fluxes, Mac)
         except _HS.HeatSourceError, (stderr):
             self.CatchException(stderr, time)
+        self.F_Conduction, self.T_sed, self.F_Longwave, self.F_LW_Atm, self.F_LW_Stream, \
+            self.F_LW_Veg, self.F_Evaporation, self.F_Convection, self.E, self.F_Total, self.Delta_T = fluxes
+        self.T, self.S1, self.Mix_T_Delta = Mac
+
+        daily = self.F_DailySum
+        daily[1] += self.F_Solar[1]
+        daily[4] += self.F_Solar[4]
+        self.Solar_Blocked[dir] += veg_block
 
-        self.F_DailySum[1] += self.F_Solar[1]
-        self.F_DailySum[4] += self.F_Solar[4]
-        for i in range(len(self.Solar_Blocked[dir])):
-            self.Solar_Blocked[dir][i] += veg_block[i]
-        self.Solar_Blocked['diffuse'] += veg_block[-1]
+    def CalcHeat_Night(self, time, hour, min, sec,JD,JDC,solar_only=False):
+        """CalcHeat_Opt for when the sun is down at the headwater
+
+        There is no solar flux to calculate or add to the daily sums,
+        so the reach calls this for every node below the headwater
+        instead, once the headwater has found that it's night."""
+        self.T_prev = self.T
+        self.T = None
+        fluxes, Mac = self.Scratch[:2]
+        F_Solar = self.F_Solar
+        F_Solar[0] = F_Solar[1] = F_Solar[2] = F_Solar[3] = F_Solar[4] = F_Solar[5] = F_Solar[6] = F_Solar[7] = 0
+        if solar_only:
+            # The same empty calories as CalcHeatFluxes
+            self.F_Conduction = self.T_sed = self.F_Longwave = self.F_LW_Atm = self.F_LW_Stream = \
+                self.F_LW_Veg = self.F_Evaporation = self.F_Convection = self.E = 0
+            self.F_Total = self.Delta_T = 0.0
+            self.T = self.S1 = self.Mix_T_Delta = 0
+            return
+        try:
+            _HS.CalcNightFluxes(Forcing[self.ContData][time], self.C_args, self.d_w, self.A, self.P_w, self.W_w, self.U,
+                            Forcing[self.Q_tribs][time], Forcing[self.T_tribs][time], self.T_prev, self.T_sed,
+                            self.Q_hyp, self.next_km.T_prev, self.Disp,
+                            self.prev_km.Q_prev, self.prev_km.T_prev, self.next_km.Mix_T_Delta,
+                            fluxes, Mac)
+        except _HS.HeatSourceError, (stderr):
+            self.CatchException(stderr, time)
+        self.F_Conduction, self.T_sed, self.F_Longwave, self.F_LW_Atm, self.F_LW_Stream, \
+            self.F_LW_Veg, self.F_Evaporation, self.F_Convection, self.E, self.F_Total, self.Delta_T = fluxes
+        self.T, self.S1, self.Mix_T_Delta = Mac
 
     def CalcHeat_BoundaryNode(self, time, hour, min, sec,JD,JDC, solar_only=False):
         # Reset temperatures
         self.T_prev = self.T
         self.T = None
-        Altitude, Zenith, Daytime, dir = _HS.CalcSolarPosition(self.Latitude, self.Longitude, hour, min, sec, self.UTC_offset, JDC, IniParams["radialsample_count"])
+        if self.Ephemeris:
+            Altitude, Zenith, Daytime, dir = self.Ephemeris[time]
+        else:
+            Altitude, Zenith, Daytime, dir = _HS.CalcSolarPosition(self.Latitude, self.Longitude, hour, min, sec, self.UTC_offset, JDC, IniParams["radialsample_count"])
         self.SolarPos = Altitude, Zenith, Daytime, dir
+        fluxes, Mac, veg_block = self.Scratch
         try:
-            self.F_Solar, \
-                (self.F_Conduction, self.T_sed, self.F_Longwave, self.F_LW_Atm, self.F_LW_Stream, \
-                 self.F_LW_Veg, self.F_Evaporation, self.F_Convection, self.E), self.F_Total, self.Delta_T, veg_block = \
-                _HS.CalcHeatFluxes(self.ContData[time], self.C_args, self.d_w, self.A, self.P_w, self.W_w, self.U,
-                            self.Q_tribs[time], self.T_tribs[time], self.T_prev, self.T_sed,
+            _HS.CalcHeatFluxes(Forcing[self.ContData][time], self.C_args, self.d_w, self.A, self.P_w, self.W_w, self.U,
+                            Forcing[self.Q_tribs][time], Forcing[self.T_tribs][time], self.T_prev, self.T_sed,
                             self.Q_hyp, self.next_km.T_prev, self.ShaderList[dir], self.Disp,
-                            hour, JD, Daytime, Altitude, Zenith, 0.0, 0.0, solar_only, self.next_km.Mix_T_Delta)
+                            hour, JD, Daytime, Altitude, Zenith, 0.0, 0.0, solar_only, self.next_km.Mix_T_Delta,
+                            self.F_Solar, veg_block, fluxes)
         except _HS.HeatSourceError, (stderr, time):
             self.CatchException(stderr)
-        self.F_DailySum[1] += self.F_Solar[1]
-        self.F_DailySum[4] += self.F_Solar[4]
-        #test = len(self.Solar_Blocked[dir])
-        for i in range(len(self.Solar_Blocked[dir])):
-            self.Solar_Blocked[dir][i] += veg_block[i]
-        self.Solar_Blocked['diffuse'] += veg_block[-1]
+        self.F_Conduction, self.T_sed, self.F_Longwave, self.F_LW_Atm, self.F_LW_Stream, \
+            self.F_LW_Veg, self.F_Evaporation, self.F_Convection, self.E, self.F_Total, self.Delta_T = fluxes
+        # Nothing to add up at night
+        if Daytime:
+            daily = self.F_DailySum
+            daily[1] += self.F_Solar[1]
+            daily[4] += self.F_Solar[4]
+            self.Solar_Blocked[dir] += veg_block
 
         # Check if we have interpolation on, and use the appropriate time
         self.T = self.T_bc[time]
@@ -315,7 +367,7 @@ c_k: %3.4f""" % stderr
         #Throw away S and mix because we won't need them.
 
         self.T, S, mix = _HS.CalcMacCormick(self.dt, self.dx, self.U, self.T_sed, self.T_prev, self.Q_hyp,
-                                    self.Q_tribs[time], self.T_tribs[time], self.prev_km.Q, self.Delta_T, self.Disp,
+                                    Forcing[self.Q_tribs][time], Forcing[self.T_tribs][time], self.prev_km.Q, self.Delta_T, self.Disp,
                                     True, self.S1, self.prev_km.T, self.T, self.next_km.T, self.Q_in, self.T_in, self.next_km.Mix_T_Delta)
 
     def CalcDispersion(self):
@@ -376,9 +428,10 @@ c_k: %3.4f""" % stderr
     def MixItUp(self, time, Q_up, T_up):
         Q_in = 0
         T_in = 0
-        for i in xrange(len(self.Q_tribs[time])):
-            Q_in += self.Q_tribs[time][i] if self.Q_tribs[time][i] > 0 else 0
-            T_in += self.T_tribs[time][i] if self.Q_tribs[time][i] > 0 else 0
+        Q_tribs, T_tribs = Forcing[self.Q_tribs][time], Forcing[self.T_tribs][time]
+        for i in xrange(len(Q_tribs)):
+            Q_in += Q_tribs[i] if Q_tribs[i] > 0 else 0
+            T_in += T_tribs[i] if Q_tribs[i] > 0 else 0
 
         # Hyporheic flows if available
         Q_hyp = self.Q_hyp or 0
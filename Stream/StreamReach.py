@@ -0,0 +1,297 @@
+"""StreamReach holds the state of an entire reach in NumPy arrays
+
+Instead of asking each StreamNode to calculate itself, the StreamReach
+copies the node attributes into contiguous arrays (one element per node,
+headwater first) and uses the routines in VectorHeatsource to advance
+all of the nodes at once. It has the same run_hs/run_sh/run_hy methods
+as ModelControl, so it can stand in for the per-node list comprehensions.
+
+The StreamNodes are still the official record of the model state. The
+first timestep of a run is calculated by the nodes themselves (this is
+where they sort out their boundary conditions and initial discharge)
+and then copied in with Gather(). After that, Scatter() copies the
+arrays back to the nodes whenever someone else (e.g. Output) needs them.
+If the nodes are ArrayStreamNodes, which already keep their state in
+arrays, the copies are a whole array at a time.
+"""
+from __future__ import division
+import numpy as np
+from time import ctime
+
+from ..Dieties.IniParamsDiety import IniParams
+from ..Utils.Logger import Logger
+from ..Dieties.ForcingDiety import Forcing
+import PyHeatsource as py_HS
+import VectorHeatsource as vec_HS
+from RatingTable import ReachRating
+from ShadeGeometry import StackShaderLists
+from DailySums import DailySums
+from PyHeatsource import HeatSourceError
+
+class StreamReach(object):
+    """Array based representation of a list of StreamNodes"""
+    # Attributes that do not change during the model run
+    static = ("W_b", "z", "n", "S", "dx", "dt", "d_cont", "Elevation", "TopoFactor",
+              "ViewToSky", "phi", "VDensity", "VHeight", "SedDepth", "SedThermCond",
+              "SedThermDiff", "Q_in", "T_in", "Q_out", "hyp_percent")
+    # Attributes that change every timestep
+    dynamic = ("T", "T_prev", "T_sed", "Q", "Q_prev", "Q_hyp", "Q_mass", "d_w", "A",
+               "P_w", "R_h", "W_w", "U", "Disp", "S1", "Mix_T_Delta", "Delta_T", "E",
+               "F_Conduction", "F_Convection", "F_Evaporation", "F_Longwave",
+               "F_LW_Atm", "F_LW_Stream", "F_LW_Veg", "F_Total")
+
+    def __init__(self, reachlist, run_type=0, daily=None):
+        """StreamReach(reachlist, run_type, daily) -> Class instance
+
+        reachlist is the list of StreamNodes ordered from the headwater
+        to the mouth, as ModelControl keeps it, and daily is their
+        DailySums (a new one if not given)."""
+        self.nodes = reachlist
+        self.daily = daily if daily is not None else DailySums(reachlist)
+        self.head = reachlist[0]
+        self.mouth = reachlist[-1]
+        self.run_type = run_type
+        self.initialized = False
+        for attr in self.static:
+            setattr(self, attr, np.array([getattr(x, attr) or 0.0 for x in reachlist], dtype=float))
+        # The (node, direction) and (node, direction, zone) arrays of the shade geometry
+        self.FullSunAngle, self.TopoShadeAngle, self.BankShadeAngle, self.RipExtinction, self.VegetationAngle = \
+            StackShaderLists([x.ShaderList for x in reachlist])
+        self.directions, self.zones = self.VegetationAngle.shape[1:]
+        # The solar fluxes whenever the sun is down, which nobody changes, so we only need the one
+        self.NightSolar = np.zeros((len(reachlist), 8))
+
+        # Nodes without their own continuous data share their neighbor's ContData
+        # series, so we only interpolate once per site and fan out with an index.
+        self.sites = []
+        index = {}
+        for x in reachlist:
+            if x.ContData not in index:
+                index[x.ContData] = len(self.sites)
+                self.sites.append(Forcing[x.ContData])
+        self.site_index = np.array([index[x.ContData] for x in reachlist])
+        # Most nodes have no tributaries, so we keep a short list of the ones that do
+        self.tribs = [i for i in xrange(len(reachlist)) if reachlist[i].Q_tribs != Forcing.none]
+        ratings = [x.Rating for x in reachlist]
+        self.rating = ReachRating(ratings) if None not in ratings else None
+        self.forcing_time = None
+        # The nodes' own arrays, if they're ArrayStreamNodes in the same order as us
+        self.arrays = getattr(reachlist[0], "arrays", None)
+        self.rows = self.arrays.Rows(reachlist) if self.arrays is not None else None
+
+        # Localize the model parameters that go into C_args
+        self.SampleDist = IniParams["transsample"]
+        self.emergent = IniParams["emergent"]
+        self.wind_a = IniParams["wind_a"]
+        self.wind_b = IniParams["wind_b"]
+        self.calcevap = IniParams["calcevap"]
+        self.penman = IniParams["penman"]
+        self.calcalluvium = IniParams["calcalluvium"]
+        self.alluviumtemp = IniParams["alluviumtemp"]
+
+    def Gather(self):
+        """Copy the current state of the StreamNodes into the arrays"""
+        nodes = self.nodes
+        for attr in self.dynamic:
+            if self.rows is not None:
+                a = getattr(self.arrays, attr)[self.rows].copy()
+                a[a != a] = 0.0 # NaN is None, which we take as zero
+            else:
+                a = np.array([getattr(x, attr) or 0.0 for x in nodes], dtype=float)
+            setattr(self, attr, a)
+        self.F_Solar = np.array([x.F_Solar for x in nodes], dtype=float)
+        self.initialized = True
+
+    def Scatter(self):
+        """Copy the arrays back into the StreamNodes"""
+        for attr in self.dynamic:
+            if self.rows is not None:
+                getattr(self.arrays, attr)[self.rows] = getattr(self, attr)
+                continue
+            for x, v in zip(self.nodes, getattr(self, attr).tolist()):
+                setattr(x, attr, v)
+        # The daily sums are shared with the nodes already
+        for x, v in zip(self.nodes, self.F_Solar.tolist()):
+            x.F_Solar = v
+
+    def CatchException(self, stderr, time, offset=0):
+        """Hand an exception from the array routines to the offending StreamNode"""
+        msg, i = stderr.args
+        self.nodes[i + offset].CatchException(msg, time)
+
+    def GetForcing(self, time):
+        """Look up the continuous and tributary data for this timestep
+
+        Each dictionary is interpolated once per timestep, no matter
+        how many nodes refer to it."""
+        if time == self.forcing_time: return
+        self.forcing_time = time
+        cont = np.array([site[time] for site in self.sites], dtype=float)[self.site_index]
+        self.cloud, self.wind, self.humidity, self.T_air = cont.T
+        # Sum of all tributary flow (for discharge), and the sum and flow weighted temperature
+        # of the positive inflows (for mixing).
+        N = len(self.nodes)
+        self.Q_tribs = np.zeros(N)
+        self.Q_trib_in = np.zeros(N)
+        self.T_trib_in = np.zeros(N)
+        for i in self.tribs:
+            node = self.nodes[i]
+            Q_tup, T_tup = Forcing[node.Q_tribs][time], Forcing[node.T_tribs][time]
+            Q_in = numerator = 0.0
+            for Qitem, Titem in zip(Q_tup, T_tup):
+                # make sure there's a value for discharge. Temp can be blank if discharge is negative (withdrawl)
+                if Qitem is None or (Qitem > 0 and Titem is None):
+                    node.CatchException("Problem with null value in tributary discharge or temperature", time)
+                if Qitem > 0:
+                    Q_in += Qitem
+                    numerator += Qitem*Titem
+            self.Q_tribs[i] = sum(Q_tup)
+            self.Q_trib_in[i] = Q_in
+            if numerator and (Q_in > 0):
+                self.T_trib_in[i] = numerator/Q_in
+
+    def CalcDischarge(self, time):
+        """Route discharge down the reach and update the channel geometry"""
+        self.GetForcing(time)
+        Q_old = self.Q
+        inputs = self.Q_in + self.Q_tribs - self.Q_out - self.E
+        Q_bc = self.head.Q_bc[time]
+        inputs[0] = Q_bc
+        self.Q_mass += inputs
+        try:
+            # The Muskingum coefficients for every node below the headwater are based
+            # on the upstream node's discharge at the previous timestep...
+            C1, C2, C3 = vec_HS.CalcMuskingum(Q_old[:-1] + inputs[1:], self.U[1:], self.W_w[1:],
+                                              self.S[1:], self.dx[1:], self.dt[1:])
+        except HeatSourceError, (stderr):
+            self.CatchException(stderr, time, 1)
+        # ... but we also need the upstream node's discharge at this timestep, which makes
+        # the routing a recurrence: Q[i] = C1*Q[i-1] + (C1*inputs + C2*(Q_old[i-1]+inputs) + C3*Q_old[i])
+        Q = np.empty(len(Q_old))
+        Q[0] = Q_bc
+        Q[1:] = vec_HS.LinearRecurrence(C1 * inputs[1:] + C2 * (Q_old[:-1] + inputs[1:]) + C3 * Q_old[1:], C1, Q_bc)
+        # The rating tables give the depth straight away, except for the nodes
+        # they don't cover, which are left at zero for the solver.
+        D_est = self.d_cont if self.rating is None else np.where(self.d_cont != 0, self.d_cont, self.rating.Depth(Q))
+        self.d_w, self.A, self.P_w, self.R_h, self.W_w, self.U, self.Disp = \
+            vec_HS.GetStreamGeometry(Q, self.W_b, self.z, self.n, self.S, D_est, self.dx, self.dt)
+        self.Q_prev = Q_old
+        self.Q = Q
+        self.Q_hyp = Q * self.hyp_percent # Hyporheic discharge
+        # ModelControl keeps a running mass balance from the mouth every timestep
+        self.mouth.Q = Q[-1]
+        dry = Q < 0.003
+        if dry.any():
+            for i in np.flatnonzero(dry):
+                Logger.write("The channel is going dry at %s, model time: %s." % (self.nodes[i], ctime(time)))
+
+    def CalcHeat(self, time, hour, min, sec, JD, JDC, solar_only=False):
+        """Calculate the heat fluxes and the MacCormick predictor for every node"""
+        self.GetForcing(time)
+        head = self.head
+        if head.Ephemeris:
+            Altitude, Zenith, Daytime, dir = head.Ephemeris[time]
+        else:
+            Altitude, Zenith, Daytime, dir = py_HS.CalcSolarPosition(head.Latitude, head.Longitude, hour, min, sec,
+                                                                     head.UTC_offset, JDC, IniParams["radialsample_count"])
+        head.SolarPos = Altitude, Zenith, Daytime, dir
+        # T_prev of the node downstream has not been updated yet when a node calculates its
+        # heat in the per-node model, so we hang on to the old one for the predictor.
+        T_prev_dn = self.T_prev
+        T_prev = self.T
+        if Daytime:
+            self.F_Solar, veg_block = vec_HS.GetSolarFlux(hour, JD, Altitude, Zenith, self.cloud, self.d_w,
+                        self.W_b, self.Elevation, self.TopoFactor, self.ViewToSky, self.SampleDist, self.phi,
+                        self.emergent, self.VDensity, self.VHeight, self.FullSunAngle[:, dir],
+                        self.TopoShadeAngle[:, dir], self.BankShadeAngle[:, dir], self.RipExtinction[:, dir],
+                        self.VegetationAngle[:, dir])
+            self.daily.Add(dir, self.F_Solar, veg_block)
+        else:
+            self.F_Solar = self.NightSolar
+
+        T_bc = head.T_bc[time]
+        if solar_only:
+            # We're only running shade, so the ground fluxes and temperatures are empty calories
+            for attr in ("F_Conduction", "T_sed", "F_Longwave", "F_LW_Atm", "F_LW_Stream", "F_LW_Veg",
+                         "F_Evaporation", "F_Convection", "E", "F_Total", "Delta_T", "S1", "Mix_T_Delta"):
+                setattr(self, attr, np.zeros(len(self.nodes)))
+            self.T = np.zeros(len(self.nodes))
+            self.T[0] = T_bc
+            self.T_prev = self.T.copy()
+            return
+
+        try:
+            (self.F_Conduction, T_sed, self.F_Longwave, self.F_LW_Atm, self.F_LW_Stream,
+             self.F_LW_Veg, self.F_Evaporation, self.F_Convection, self.E) = \
+                vec_HS.GetGroundFluxes(self.cloud, self.wind, self.humidity, self.T_air, self.Elevation,
+                        self.phi, self.VHeight, self.ViewToSky, self.SedDepth, self.dx,
+                        self.dt, self.SedThermCond, self.SedThermDiff, self.calcalluvium, self.alluviumtemp,
+                        self.P_w, self.W_w, self.emergent, self.penman, self.wind_a, self.wind_b,
+                        self.calcevap, T_prev, self.T_sed, self.Q_hyp, self.F_Solar[:, 5], self.F_Solar[:, 7])
+        except HeatSourceError, (stderr):
+            self.CatchException(stderr, time)
+        self.T_sed = T_sed
+        self.F_Total = self.F_Solar[:, 6] + self.F_Conduction + self.F_Longwave + self.F_Evaporation + self.F_Convection
+        self.Delta_T = self.F_Total * self.dt / ((self.A / self.W_w) * 4182 * 998.2) # Vars are Cp (J/kg *C) and P (kgS/m3)
+
+        # The headwater node's temperature is the boundary condition, and the nodes below
+        # see it as the upstream temperature.
+        T_prev = T_prev.copy()
+        T_prev[0] = T_bc
+        T = T_prev.copy()
+        Mix_T_Delta = self.Mix_T_Delta
+        S1 = self.S1.copy()
+        if len(self.nodes) > 1:
+            # The mouth has no downstream node, so it uses itself.
+            T2 = np.append(T_prev_dn[2:], T_prev[-1])
+            Mix_dn = np.append(Mix_T_Delta[2:], Mix_T_Delta[-1])
+            T[1:], S1[1:], mix = vec_HS.CalcMacCormick(self.dt[1:], self.dx[1:], self.U[1:], T_sed[1:],
+                    T_prev[1:], self.Q_hyp[1:], self.Q_trib_in[1:], self.T_trib_in[1:], self.Q_prev[:-1],
+                    self.Delta_T[1:], self.Disp[1:], T_prev[:-1], T_prev[1:], T2, self.Q_in[1:], self.T_in[1:], Mix_dn)
+            Mix_T_Delta = Mix_T_Delta.copy()
+            Mix_T_Delta[1:] = mix
+        self.T_prev = T_prev
+        self.T = T
+        self.S1 = S1
+        self.Mix_T_Delta = Mix_T_Delta
+
+    def MacCormick(self, time):
+        """Corrector step of the MacCormick scheme for every node below the headwater"""
+        if len(self.nodes) < 2: return
+        self.GetForcing(time)
+        T = self.T
+        T2 = np.append(T[2:], T[-1])
+        Mix_dn = np.append(self.Mix_T_Delta[2:], self.Mix_T_Delta[-1])
+        T_new = T.copy()
+        T_new[1:] = vec_HS.CalcMacCormickCorrector(self.dt[1:], self.dx[1:], self.U[1:], self.T_sed[1:],
+                    self.T_prev[1:], self.Q_hyp[1:], self.Q_trib_in[1:], self.T_trib_in[1:], self.Q[:-1],
+                    self.Delta_T[1:], self.Disp[1:], self.S1[1:], T[0], T[1:], T2, self.Q_in[1:], self.T_in[1:], Mix_dn)
+        self.T = T_new
+
+    #############################################################
+    # The same three run methods as ModelControl. The first timestep
+    # is run by the StreamNodes themselves, then we take over.
+    def run_hs(self, time, H, M, S, JD, JDC):
+        """Call both hydraulic and solar routines for the reach"""
+        if not self.initialized:
+            [x.CalcDischarge(time) for x in self.nodes]
+            [x.CalcHeat(time, H, M, S, JD, JDC) for x in self.nodes]
+            [x.MacCormick2(time) for x in self.nodes]
+            return self.Gather()
+        self.CalcDischarge(time)
+        self.CalcHeat(time, H, M, S, JD, JDC)
+        self.MacCormick(time)
+
+    def run_hy(self, time, H, M, S, JD, JDC):
+        """Call hydraulic routines for the reach"""
+        if not self.initialized:
+            [x.CalcDischarge(time) for x in self.nodes]
+            return self.Gather()
+        self.CalcDischarge(time)
+
+    def run_sh(self, time, H, M, S, JD, JDC):
+        """Call solar routines for the reach"""
+        if not self.initialized:
+            [x.CalcHeat(time, H, M, S, JD, JDC, True) for x in self.nodes]
+            return self.Gather()
+        self.CalcHeat(time, H, M, S, JD, JDC, True)
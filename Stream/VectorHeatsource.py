@@ -0,0 +1,427 @@
+"""Array versions of the routines in PyHeatsource
+
+The functions in this module mirror those in PyHeatsource.py, but
+they take NumPy arrays holding the values for every node in a reach
+and evaluate them all at once. Scalar arguments (flags, the sun's
+position for a single timestep, etc.) are broadcast against the
+arrays, so most of these routines will just as happily take arrays
+shaped (timesteps, nodes) as (nodes,).
+
+They are used by the StreamReach class and should give the same
+answers as their scalar counterparts, to within roundoff.
+"""
+from __future__ import division
+import numpy as np
+from math import pi
+from itertools import izip
+
+from PyHeatsource import HeatSourceError
+from PyHeatsource import GetStreamGeometry as _GetStreamGeometry
+
+def LinearRecurrence(c, k, x0):
+    """Return x where x[i] = c[i] + k[i]*x[i-1] and x[-1] = x0
+
+    Both the Muskingum routing and the MacCormick corrector need
+    the *current* timestep's value from the upstream node, which
+    makes them a first order recurrence down the reach. Everything
+    else is computed for all nodes at once, so this is the only
+    place left where we loop over the nodes in Python."""
+    x = np.empty(len(c))
+    last = x0
+    i = 0
+    for ci, ki in izip(c.tolist(), k.tolist()):
+        last = ci + ki * last
+        x[i] = last
+        i += 1
+    return x
+
+def CalcSolarPosition(lat, lon, hour, min, sec, offset, JDC, radial_samples):
+    """Return arrays of Altitude, Zenith, Daytime and direction for arrays of times
+
+    hour, min, sec and JDC are arrays with one element per timestep. The
+    terms that only depend on the julian century (i.e. on the day) are
+    calculated once for each distinct day."""
+    toRadians = pi/180.0
+    toDegrees = 180.0/pi
+    days, day_index = np.unique(JDC, return_inverse=True)
+    JDC = days
+    MeanObliquity = 23.0 + (26.0 + ((21.448 - JDC * (46.815 + JDC * (0.00059 - JDC * 0.001813))) / 60.0)) / 60.0
+    Obliquity = MeanObliquity + 0.00256 * np.cos(toRadians*(125.04 - 1934.136 * JDC))
+    Eccentricity = 0.016708634 - JDC * (0.000042037 + 0.0000001267 * JDC)
+    GeoMeanLongSun = 280.46646 + JDC * (36000.76983 + 0.0003032 * JDC)
+    # Repeated additions, like the scalar version, so we get the same rounding
+    while (GeoMeanLongSun < 0).any():
+        GeoMeanLongSun = np.where(GeoMeanLongSun < 0, GeoMeanLongSun + 360, GeoMeanLongSun)
+    while (GeoMeanLongSun > 360).any():
+        GeoMeanLongSun = np.where(GeoMeanLongSun > 360, GeoMeanLongSun - 360, GeoMeanLongSun)
+    GeoMeanAnomalySun = 357.52911 + JDC * (35999.05029 - 0.0001537 * JDC)
+
+    Dummy1 = toRadians*GeoMeanAnomalySun
+    Dummy2 = np.sin(Dummy1)
+    Dummy3 = np.sin(Dummy2 * 2)
+    Dummy4 = np.sin(Dummy3 * 3)
+    SunEqofCenter = Dummy2 * (1.914602 - JDC * (0.004817 + 0.000014 * JDC)) + Dummy3 * (0.019993 - 0.000101 * JDC) + Dummy4 * 0.000289
+    SunApparentLong = (GeoMeanLongSun + SunEqofCenter) - 0.00569 - 0.00478 * np.sin(toRadians*((125.04 - 1934.136 * JDC)))
+
+    Dummy1 = np.sin(toRadians*Obliquity) * np.sin(toRadians*SunApparentLong)
+    Declination = toDegrees*(np.arctan(Dummy1 / np.sqrt(-Dummy1 * Dummy1 + 1)))
+
+    #======================================================
+    #Equation of time (minutes)
+    Dummy = np.power((np.tan(Obliquity * pi / 360)),2)
+    Dummy1 = np.sin(toRadians*(2 * GeoMeanLongSun))
+    Dummy2 = np.sin(toRadians*(GeoMeanAnomalySun))
+    Dummy3 = np.cos(toRadians*(2 * GeoMeanLongSun))
+    Dummy4 = np.sin(toRadians*(4 * GeoMeanLongSun))
+    Dummy5 = np.sin(toRadians*(2 * GeoMeanAnomalySun))
+    Et = toDegrees*(4 * (Dummy * Dummy1 - 2 * Eccentricity * Dummy2 + 4 * Eccentricity * Dummy * Dummy2 * Dummy3 - 0.5 * np.power(Dummy,2) * Dummy4 - 1.25 * np.power(Eccentricity,2) * Dummy5))
+    # Back to one value per timestep
+    Et = Et[day_index]
+    Declination = Declination[day_index]
+
+    SolarTime = (hour*60.0) + min + (sec/60.0) + (Et - 4.0 * -lon + (offset*60.0))
+    while (SolarTime > 1440.0).any():
+        SolarTime = np.where(SolarTime > 1440.0, SolarTime - 1440.0, SolarTime)
+    HourAngle = SolarTime / 4.0 - 180.0
+    HourAngle = np.where(HourAngle < -180.0, HourAngle + 360.0, HourAngle)
+
+    Dummy = np.sin(toRadians*lat) * np.sin(toRadians*Declination) + np.cos(toRadians*lat) * np.cos(toRadians*Declination) * np.cos(toRadians*HourAngle)
+    Dummy = np.clip(Dummy, -1.0, 1.0)
+
+    Zenith = toDegrees*(np.arccos(Dummy))
+    Dummy = np.cos(toRadians*lat) * np.sin(toRadians*Zenith)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        Azimuth = (np.sin(toRadians*lat) * np.cos(toRadians*Zenith) - np.sin(toRadians*Declination)) / Dummy
+        Azimuth = 180 - toDegrees*(np.arccos(np.clip(Azimuth, -1.0, 1.0)))
+    Azimuth = np.where(HourAngle > 0, Azimuth * -1.0, Azimuth)
+    Azimuth = np.where(np.abs(Dummy) >= 0.000999, Azimuth, 180.0 if lat > 0 else 0.0)
+    Azimuth = np.where(Azimuth < 0, Azimuth + 360.0, Azimuth)
+
+    AtmElevation = 90 - Zenith
+    with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        Dummy = np.tan(toRadians*(AtmElevation))
+        RefractionCorrection = np.where(AtmElevation > 5,
+                58.1 / Dummy - 0.07 / np.power(Dummy,3) + 0.000086 / np.power(Dummy,5),
+                np.where(AtmElevation > -0.575,
+                         1735 + AtmElevation * (-518.2 + AtmElevation * (103.4 + AtmElevation * (-12.79 + AtmElevation * 0.711))),
+                         -20.774 / Dummy))
+    RefractionCorrection = np.where(AtmElevation > 85, 0, RefractionCorrection / 3600)
+
+    Zenith = Zenith - RefractionCorrection
+    Altitude = 90 - Zenith
+    Daytime = (Altitude > 0.0).astype(int)
+    if radial_samples == -999:  #-999 is a code indicating that the numver of radial samples was blank, so we assumed old methods.
+        dir = np.searchsorted((0.0,67.5,112.5,157.5,202.5,247.5,292.5), Azimuth, side="right")-1
+    else: #using terms from GIS sampling routine
+        WedgeZones = radial_samples
+        Angle_Incr = 360.0 / WedgeZones
+        WedgeNumbers = range(1,WedgeZones)
+        WedgeAngleStart = [x*Angle_Incr-Angle_Incr/2 for x in WedgeNumbers]
+        Azimuth_mod = np.where(Azimuth < WedgeAngleStart[0], Azimuth + 360, Azimuth)
+        dir = np.searchsorted(WedgeAngleStart, Azimuth_mod, side="right")-1
+    return Altitude, Zenith, Daytime, dir
+
+def CalcMuskingum(Q_est, U, W_w, S, dx, dt):
+    """Return the Muskingum routing coefficients for an array of nodes"""
+    c_k = (5/3) * U  # Wave celerity
+    X = 0.5 * (1 - Q_est / (W_w * S * dx * c_k))
+    X = np.clip(X, 0.0, 0.5)
+    K = dx / c_k
+
+    # Check the celerity to ensure stability. These tests are from the VB code.
+    unstable = dt >= (2 * K * (1 - X))
+    if unstable.any():
+        i = np.flatnonzero(unstable)[0]
+        raise HeatSourceError("Unstable timestep. K=%0.3f, X=%0.3f" % (K[i], X[i]), i)
+
+    # These calculations are from Chow's "Applied Hydrology"
+    D = K * (1 - X) + 0.5 * dt
+    C1 = (0.5*dt - K * X) / D
+    C2 = (0.5*dt + K * X) / D
+    C3 = (K * (1 - X) - 0.5*dt) / D
+    return C1, C2, C3
+
+def SolveDepth(Q_est, W_b, z, n, S, dx, dt):
+    """Secant solution for wetted depth from Manning's equation
+
+    This is the same iteration that GetStreamGeometry() does, but
+    run for all nodes at once. Each node stops iterating when it
+    has converged, so the answers are the same as the scalar routine.
+    Any node that wanders off (negative depth, or no convergence) is
+    handed to the scalar routine, which knows how to restart itself."""
+    power = 2/3
+    dy = 0.01
+    D = np.zeros(len(Q_est))
+    target = (n * Q_est) / np.sqrt(S)
+    root = np.sqrt(1 + z**2)
+    idx = np.arange(len(Q_est))
+    count = 0
+    while idx.size:
+        D_est, w, zz, r, t = D[idx], W_b[idx], z[idx], root[idx], target[idx]
+        Fy = (D_est * (w + zz * D_est)) * ((D_est * (w + zz * D_est)) / (w + 2 * D_est * r))**power - t
+        thed = D_est + dy
+        Fyy = (thed * (w + zz * thed)) * ((thed * (w + zz * thed)) / (w + 2 * thed * r))**power - t
+        dFy = (Fyy - Fy) / dy
+        dFy[dFy <= 0] = 0.99
+        D_est = D_est - Fy / dFy
+        D[idx] = D_est
+        lost = (D_est < 0) | (D_est > 5000) | (count > 10000)
+        for i in idx[lost]:
+            D[i] = _GetStreamGeometry(Q_est[i], W_b[i], z[i], n[i], S[i], 0.0, dx[i], dt[i])[0]
+        idx = idx[(np.abs(Fy / dFy) > 1e-7) & ~lost]
+        count += 1
+    return D
+
+def GetStreamGeometry(Q_est, W_b, z, n, S, D_est, dx, dt):
+    """Return channel geometry arrays for a discharge array
+
+    Nodes with a control depth (D_est) keep that depth, the rest
+    are solved for with SolveDepth()."""
+    W_b = np.where(W_b == 0, 0.01, W_b) #ASSUMPTION: Make bottom width 1 cm to prevent undefined numbers in the math.
+    D = np.array(D_est, dtype=float)
+    solve = D == 0
+    if solve.any():
+        D[solve] = SolveDepth(Q_est[solve], W_b[solve], z[solve], n[solve], S[solve], dx[solve], dt[solve])
+    # Use the calculated wetted depth to calculate new channel characteristics
+    A = D * (W_b + z * D)
+    Pw = W_b + 2 * D * np.sqrt(1 + z**2)
+    Rh = A / Pw
+    Ww = W_b + 2 * z * D
+    U = Q_est / A
+
+    # THis is a sheer velocity estimate, followed by an estimate of numerical dispersion
+    with np.errstate(invalid="ignore"):
+        Shear_Velocity = np.where(S == 0.0, U, np.sqrt(9.8 * D * S))
+    Dispersion = (0.011 * U**2 * Ww**2) / (D * Shear_Velocity)
+    Dispersion = np.where((Dispersion * dt / dx**2) > 0.5, (0.45 * dx**2) / dt, Dispersion)
+    return D, A, Pw, Rh, Ww, U, Dispersion
+
+def GetSolarFlux(hour, JD, Altitude, Zenith, cloud, d_w, W_b, Elevation, TopoFactor,
+                 ViewToSky, SampleDist, phi, emergent, VDensity, VHeight,
+                 FullSunAngle, TopoShadeAngle, BankShadeAngle, RipExtinction, VegetationAngle):
+    """Array version of GetSolarFlux()
+
+    The ShaderList tuple of the scalar routine is passed as its five
+    parts. RipExtinction and VegetationAngle have a trailing zone
+    axis. Returns an array of the eight solar fluxes (trailing axis
+    of length 8) and the flux blocked by each vegetation zone plus
+    the diffuse flux blocked (trailing axis of length zones+1)."""
+    zones = VegetationAngle.shape[-1]
+    sin_alt = np.sin(np.radians(Altitude))
+    #======================================================
+    # 0 - Edge of atmosphere
+    Rad_Vec = 1 + 0.017 * np.cos((2 * pi / 365) * (186 - JD + hour / 24))
+    Solar_Constant = 1367 #W/m2
+    Direct0 = (Solar_Constant / (Rad_Vec ** 2)) * sin_alt #Global Direct Solar Radiation
+    #======================================================
+    # 1 - Above Topography
+    Air_Mass = (35 / np.sqrt(1224 * sin_alt + 1)) * np.exp(-0.0001184 * Elevation)
+    Trans_Air = 0.0685 * np.cos((2 * pi / 365) * (JD + 10)) + 0.8
+    #Calculate Diffuse Fraction
+    Dummy = Direct0 * (Trans_Air ** Air_Mass) * (1 - 0.65 * cloud ** 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        Clearness_Index = np.where(Direct0 == 0, 1, Dummy / Direct0)
+    Diffuse_Fraction = (0.938 + 1.071 * Clearness_Index) - \
+        (5.14 * (Clearness_Index ** 2)) + \
+        (2.98 * (Clearness_Index ** 3)) - \
+        (np.sin(2 * pi * (JD - 40) / 365)) * \
+        (0.009 - 0.078 * Clearness_Index)
+    Direct1 = Dummy * (1 - Diffuse_Fraction)
+    Diffuse1 = Dummy * (Diffuse_Fraction) * (1 - 0.65 * cloud ** 2)
+    #======================================================
+    #3 - Above Stream Surface (Above Bank Shade)
+    topo = Altitude <= TopoShadeAngle #>Topographic Shade IS Occurring<
+    partial = ~topo & (Altitude < FullSunAngle) #Partial shade from veg
+    Direct2 = np.where(topo, 0.0, Direct1)
+    Diffuse2 = np.where(topo, Diffuse1 * TopoFactor, Diffuse1 * (1 - TopoFactor))
+    shape = np.broadcast(Direct2, VegetationAngle[..., 0]).shape
+    blocked = np.zeros(shape + (zones + 1,))
+    Dummy1 = np.broadcast_to(Direct2, shape).copy()
+    path = SampleDist / np.cos(np.radians(Altitude))
+    for zone in xrange(zones - 1, -1, -1):
+        shading = partial & (Altitude < VegetationAngle[..., zone]) #veg shading is occurring from this zone
+        fraction_passed = (1-(1-np.exp(-1 * RipExtinction[..., zone] * path)))
+        blocked[..., zone] = np.where(shading, Dummy1 - Dummy1 * fraction_passed, 0.0)
+        Dummy1 = np.where(shading, Dummy1 * fraction_passed, Dummy1)
+    Direct3 = Dummy1
+    Diffuse3 = Diffuse2 * ViewToSky
+    blocked[..., zones] = Diffuse2 - Diffuse3
+    #4 - Above Stream Surface (What a Solar Pathfinder measures)
+    #Account for bank shade
+    bank = (Altitude > TopoShadeAngle) & (Altitude <= BankShadeAngle)
+    Direct4 = np.where(bank, 0.0, Direct3)
+    Diffuse4 = Diffuse3
+
+    #Account for emergent vegetation
+    if emergent:
+        pathEmergent = np.minimum(VHeight / sin_alt, W_b)
+        full, empty = VDensity == 1, VDensity == 0
+        VDensity = np.where(full, 0.9999, np.where(empty, 0.00001, VDensity))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ripExtinctEmergent = -np.log(1 - VDensity) / 10
+            shadeDensityEmergent = np.where(full, 1.0, np.where(empty, 0.0,
+                                            1 - np.exp(-ripExtinctEmergent * pathEmergent)))
+            Direct4 = Direct4 * (1 - shadeDensityEmergent)
+            # if there's no VHeight, we get ZeroDivisionError because we don't need this next step
+            ripExtinctEmergent = -np.log(1 - VDensity) / VHeight
+            shadeDensityEmergent = 1 - np.exp(-ripExtinctEmergent * VHeight)
+        Diffuse4 = np.where(VHeight != 0, Diffuse4 * (1 - shadeDensityEmergent), Diffuse4)
+
+    #:::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    #5 - Entering Stream
+    Stream_Reflect = np.where(Zenith > 80, 0.0515 * Zenith - 3.636,
+                              0.091 * (1 / np.cos(Zenith * pi / 180)) - 0.0386)
+    Stream_Reflect = np.where(np.abs(Stream_Reflect) > 1, 0.0515 * (Zenith * pi / 180) - 3.636, Stream_Reflect)
+    Stream_Reflect = np.where(np.abs(Stream_Reflect) > 1, 0.091 * (1 / np.cos(Zenith * pi / 180)) - 0.0386, Stream_Reflect)
+    Diffuse5 = Diffuse4 * 0.91
+    Direct5 = Direct4 * (1 - Stream_Reflect)
+    #:::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    #7 - Received by Bed
+    sin_zen = np.sin(np.radians(Zenith)) / 1.3333
+    Water_Path = d_w / np.cos(np.arctan(sin_zen / np.sqrt(-sin_zen * sin_zen + 1)))         #Jerlov (1976)
+    Trans_Stream = np.minimum(0.415 - (0.194 * np.log10(Water_Path * 100)), 1)
+    Dummy1 = Direct5 * (1 - Trans_Stream)       #Direct Solar Radiation attenuated on way down
+    Dummy2 = Direct5 - Dummy1                   #Direct Solar Radiation Hitting Stream bed
+    Bed_Reflect = np.exp(0.0214 * (Zenith * pi / 180) - 1.941)   #Reflection Coef. for Direct Solar
+    BedRock = 1 - phi
+    Dummy3 = Dummy2 * (1 - Bed_Reflect)                #Direct Solar Radiation Absorbed in Bed
+    Dummy4 = 0.53 * BedRock * Dummy3                   #Direct Solar Radiation Immediately Returned to Water Column as Heat
+    Dummy5 = Dummy2 * Bed_Reflect                      #Direct Solar Radiation Reflected off Bed
+    Dummy6 = Dummy5 * (1 - Trans_Stream)               #Direct Solar Radiation attenuated on way up
+    Direct6 = Dummy1 + Dummy4 + Dummy6
+    Direct7 = Dummy3 - Dummy4
+    Trans_Stream = np.minimum(0.415 - (0.194 * np.log10(100 * d_w)), 1)
+    Dummy1 = Diffuse5 * (1 - Trans_Stream)      #Diffuse Solar Radiation attenuated on way down
+    Dummy2 = Diffuse5 - Dummy1                  #Diffuse Solar Radiation Hitting Stream bed
+    Bed_Reflect = np.exp(0.0214 * (0) - 1.941)               #Reflection Coef. for Diffuse Solar
+    Dummy3 = Dummy2 * (1 - Bed_Reflect)                #Diffuse Solar Radiation Absorbed in Bed
+    Dummy4 = 0.53 * BedRock * Dummy3                   #Diffuse Solar Radiation Immediately Returned to Water Column as Heat
+    Dummy5 = Dummy2 * Bed_Reflect                      #Diffuse Solar Radiation Reflected off Bed
+    Dummy6 = Dummy5 * (1 - Trans_Stream)               #Diffuse Solar Radiation attenuated on way up
+    Diffuse6 = Dummy1 + Dummy4 + Dummy6
+    Diffuse7 = Dummy3 - Dummy4
+
+    F_Solar = np.empty(shape + (8,))
+    F_Solar[..., 0] = Direct0
+    F_Solar[..., 1] = Diffuse1 + Direct1
+    F_Solar[..., 2] = Diffuse2 + Direct2
+    F_Solar[..., 3] = Diffuse3 + Direct3
+    F_Solar[..., 4] = Diffuse4 + Direct4
+    F_Solar[..., 5] = Diffuse5 + Direct5
+    F_Solar[..., 6] = Diffuse6 + Direct6
+    F_Solar[..., 7] = Diffuse7 + Direct7
+    return F_Solar, blocked
+
+def GetGroundFluxes(Cloud, Wind, Humidity, T_Air, Elevation, phi, VHeight, ViewToSky, SedDepth, dx,
+                    dt, SedThermCond, SedThermDiff, calcalluv, T_alluv, P_w, W_w, emergent, penman, wind_a,
+                    wind_b, calcevap, T_prev, T_sed, Q_hyp, F_Solar5, F_Solar7):
+    """Array version of GetGroundFluxes()"""
+    SedRhoCp = SedThermCond / (SedThermDiff / 10000)
+    rhow = 1000                             #density of water kg / m3
+    H2O_HeatCapacity = 4187                 #J/(kg *C)
+
+    #Conduction flux (positive is heat into stream)
+    F_Cond = SedThermCond * (T_sed - T_prev) / (SedDepth / 2)             #units of (W / m2)
+    #Calculate the conduction flux between deeper alluvium & substrate conditionally
+    Flux_Conduction_Alluvium = SedThermCond * (T_sed - T_alluv) / (SedDepth / 2) if calcalluv else 0.0
+    #Hyporheic flux (negative is heat into sediment)
+    F_hyp = Q_hyp * rhow * H2O_HeatCapacity * (T_sed - T_prev) / (W_w * dx)
+    NetFlux_Sed = F_Solar7 - F_Cond - Flux_Conduction_Alluvium - F_hyp
+    DT_Sed = NetFlux_Sed * dt / (SedDepth * SedRhoCp)
+    T_sed_new = T_sed + DT_Sed
+    bad = (T_sed_new > 50) | (T_sed_new < 0)
+    if bad.any():
+        raise HeatSourceError("Sediment temperature not bounded in 0<=temp<=50", np.flatnonzero(bad)[0])
+
+    #=====================================================
+    #Calculate Longwave FLUX
+    Sat_Vapor = 6.1275 * np.exp(17.27 * T_Air / (237.3 + T_Air)) #mbar (Chapra p. 567)
+    Air_Vapor = Humidity * Sat_Vapor
+    Sigma = 5.67e-8 #Stefan-Boltzmann constant (W/m2 K4)
+    Emissivity = 1.72 * (((Air_Vapor * 0.1) / (273.2 + T_Air)) ** (1 / 7)) * (1 + 0.22 * Cloud ** 2) #Dingman p 282
+    F_LW_Atm = 0.96 * ViewToSky * Emissivity * Sigma * (T_Air + 273.2) ** 4
+    F_LW_Stream = -0.96 * Sigma * (T_prev + 273.2) ** 4
+    F_LW_Veg = 0.96 * (1 - ViewToSky) * 0.96 * Sigma * (T_Air + 273.2) ** 4
+    F_Longwave = F_LW_Atm + F_LW_Stream + F_LW_Veg
+
+    #===================================================
+    #Calculate Evaporation FLUX
+    Pressure = 1013 - 0.1055 * Elevation #mbar
+    Sat_Vapor = 6.1275 * np.exp(17.27 * T_prev / (237.3 + T_prev)) #mbar (Chapra p. 567)
+    Air_Vapor = Humidity * Sat_Vapor
+    #Calculate the frictional reduction in wind velocity
+    if emergent:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            Friction_Velocity = np.where(VHeight > 0, Wind * 0.4 / np.log((2 - 0.7 * VHeight) / (0.1 * VHeight)), Wind)
+    else:
+        Friction_Velocity = Wind
+    Wind_Function = float(wind_a) + float(wind_b) * Friction_Velocity #m/mbar/s
+    #Latent Heat of Vaporization
+    LHV = 1000 * (2501.4 + (1.83 * T_prev)) #J/kg
+    P = 998.2 # kg/m3
+    if penman:
+        Gamma = 1003.5 * Pressure / (LHV * 0.62198) #mb/*C  Cuenca p 141
+        Delta = 6.1275 * np.exp(17.27 * T_Air / (237.3 + T_Air)) - 6.1275 * np.exp(17.27 * (T_Air - 1) / (237.3 + T_Air - 1))
+        NetRadiation = np.maximum(F_Solar5 + F_Longwave, 0)  #J/m2/s
+        Ea = Wind_Function * (Sat_Vapor - Air_Vapor)  #m/s
+        Evap_Rate = ((NetRadiation * Delta / (P * LHV)) + Ea * Gamma) / (Delta + Gamma)
+        F_Evap = -Evap_Rate * LHV * P #W/m2
+        Bowen = Gamma * (T_prev - T_Air) / (Sat_Vapor - Air_Vapor)
+    else:
+        Evap_Rate = Wind_Function * (Sat_Vapor - Air_Vapor)  #m/s
+        F_Evap = -Evap_Rate * LHV * P #W/m2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            Bowen = np.where((Sat_Vapor - Air_Vapor) != 0,
+                             0.61 * (Pressure / 1000) * (T_prev - T_Air) / (Sat_Vapor - Air_Vapor), 1)
+    F_Conv = F_Evap * Bowen
+    E = Evap_Rate * W_w if calcevap else np.zeros(np.shape(T_prev))
+    return F_Cond, T_sed_new, F_Longwave, F_LW_Atm, F_LW_Stream, F_LW_Veg, F_Evap, F_Conv, E
+
+def MixItUp(T_up, Q_up, Q_in, T_in, T_sed, Q_hyp, Q_accr, T_accr):
+    """Return the temperature change from mixing tribs, hyporheic and accretion flows
+
+    Q_in and T_in are the summed positive tributary inflow and its
+    flow weighted temperature."""
+    T_mix = ((Q_in * T_in) + (T_up * Q_up)) / (Q_up + Q_in)
+    #Calculate temperature change from mass transfer from hyporheic zone
+    T_mix = ((T_sed * Q_hyp) + (T_mix * (Q_up + Q_in))) / (Q_hyp + Q_up + Q_in)
+    #Calculate temperature change from accretion inflows
+    T_mix = ((Q_accr * T_accr) + (T_mix * (Q_up + Q_in + Q_hyp))) / (Q_accr + Q_up + Q_in + Q_hyp)
+    return T_mix - T_up
+
+def CalcMacCormick(dt, dx, U, T_sed, T_prev, Q_hyp, Q_in, T_in, Q_up, Delta_T, Disp,
+                   T0, T1, T2, Q_accr, T_accr, MixTDelta_dn):
+    """Predictor step of the MacCormick scheme for an array of nodes
+
+    Returns Temp, S, T_mix as the scalar routine does when its S1
+    argument is False."""
+    T_mix = MixItUp(T0, Q_up, Q_in, T_in, T_sed, Q_hyp, Q_accr, T_accr)
+    # We need to adjust the upstream temperature by the tributary mixing so the longitidunal slope of change in T is
+    # not over predicted.
+    T0 = T0 + T_mix
+    #Similarly we need to adjust the downstream temperature (T2) to account for mixing in that reach.
+    T2 = T2 - MixTDelta_dn
+    Dummy1 = -U * (T1 - T0) / dx
+    Dummy2 = Disp * (T2 - 2 * T1 + T0) / (dx**2)
+    S = Dummy1 + Dummy2 + Delta_T / dt
+    return T1 + S * dt, S, T_mix
+
+def CalcMacCormickCorrector(dt, dx, U, T_sed, T_prev, Q_hyp, Q_in, T_in, Q_up, Delta_T, Disp,
+                            S1_value, T_head, T1, T2, Q_accr, T_accr, MixTDelta_dn):
+    """Corrector step of the MacCormick scheme for the nodes below the headwater
+
+    The corrector uses the upstream node's corrected temperature for
+    this timestep, so T0 is not an argument. Instead, the mixing and
+    the finite difference are reduced to T = c + k*T_upstream for
+    each node, and the recurrence is walked down from T_head."""
+    # Mixing is linear in the upstream temperature: T0 + T_mix = alpha + beta*T0
+    Q_total = Q_accr + Q_hyp + Q_up + Q_in
+    alpha = (Q_in * T_in + T_sed * Q_hyp + Q_accr * T_accr) / Q_total
+    beta = Q_up / Q_total
+    T2 = T2 - MixTDelta_dn
+    # S = a + b*(alpha + beta*T0)
+    a = -U * T1 / dx + Disp * (T2 - 2 * T1) / (dx**2) + Delta_T / dt
+    b = U / dx + Disp / (dx**2)
+    c = T_prev + (S1_value + a + b * alpha) / 2 * dt
+    k = b * beta / 2 * dt
+    return LinearRecurrence(c, k, T_head)
@@ -0,0 +1,182 @@
+"""Run a batch of scenarios from one model
+
+A TMDL study usually runs the same model many times with a handful of
+inputs changed (restored shade, flow augmentation, a point source
+turned up or down). RunBatch() reads the base model once and then runs
+each scenario in its own process from a multiprocessing Pool, with the
+output for each scenario going to its own directory.
+
+A scenario is a dictionary, which makes it easy to keep a batch in a
+JSON file (see the command line usage at the bottom):
+
+    {"name": "restored",             # Name of the output subdirectory
+     "params": {"vectorize": True},  # Changes to IniParams
+     "kilometers": [10.0, 25.5],     # Limit the node changes to these kilometers (inclusive)
+     "nodes": {"Q_in": {"scale": 1.5}, "T_in": 14.0}, # Changes to StreamNode attributes
+     "landcover": {"210": [30.0, 0.8, 2.0]},          # New (height, density, overhang) for a land cover code
+     "boundary": {"T_bc": {"add": -0.5}}}             # Changes to the Q_bc or T_bc boundary conditions
+
+Each change is either a new value, a dictionary with "scale" and/or
+"add" (the new value is old*scale+add), or (from Python) a function
+taking the old value and returning the new one. IniParams that are
+used while reading the model (dates, dt, dx and the like) cannot be
+changed, since the model is only read once.
+
+Where the operating system can fork (i.e. not Windows), the workers
+inherit the model from the parent process. Otherwise each worker reads
+the model for itself. Either way, each worker runs a single scenario
+and is then replaced, so no scenario sees another's changes.
+"""
+from __future__ import division
+from multiprocessing import Pool
+from os.path import join, exists
+from os import makedirs, sep
+from time import time as Time
+from traceback import format_exc
+from optparse import OptionParser
+import os
+import json
+try:
+    import resource
+except ImportError:
+    resource = None # Windows, no peak memory figures
+
+from ..Dieties.IniParamsDiety import IniParams
+from ..Utils.Logger import Logger
+from ..BigRedButton import ModelControl, LoadInterface
+
+# The model read by the parent (or the worker, if it can't fork) and the run type it was read with
+_model = None
+_run_type = 0
+
+def Modify(value, change):
+    """Return value after applying a scenario change"""
+    if callable(change): return change(value)
+    if isinstance(change, dict):
+        return value * change.get("scale", 1.0) + change.get("add", 0.0)
+    return change
+
+def ApplyScenario(HS, scenario, run_type=0):
+    """Apply a scenario's changes to the nodes of a loaded model"""
+    reachlist = sorted(HS.Reach.itervalues(), reverse=True)
+    head = reachlist[0]
+    lo, hi = scenario.get("kilometers", (-1e300, 1e300))
+    nodes = [x for x in reachlist if lo <= x.km <= hi]
+    # The land cover has to go first, since rebuilding the zones resets the vegetation attributes
+    landcover = scenario.get("landcover", {})
+    if landcover:
+        if IniParams["lidar"]:
+            raise Exception("Land cover codes cannot be changed in a model that uses LiDAR data")
+        codes = HS.GetLandCoverCodes()
+        # Codes come out of the worksheet as floats if they look like numbers
+        for code, vals in landcover.iteritems():
+            try: code = float(code)
+            except ValueError: pass
+            codes[code] = tuple(vals)
+        HS.GetLandCoverCodes = lambda: codes
+        HS.BuildZonesNormal()
+    for attr, change in scenario.get("nodes", {}).iteritems():
+        for node in nodes:
+            setattr(node, attr, Modify(getattr(node, attr), change))
+    for attr, change in scenario.get("boundary", {}).iteritems():
+        if attr not in ("Q_bc", "T_bc"):
+            raise Exception("Boundary condition must be Q_bc or T_bc, not %s" % attr)
+        bc = getattr(head, attr)
+        for time in bc.keys():
+            if bc[time] is not None: bc[time] = Modify(bc[time], change)
+    # The nodes start out at the boundary temperature, as in InitializeNode()
+    if "T_bc" in scenario.get("boundary", {}) and run_type != 2:
+        T = head.T_bc[min(head.T_bc.keys())]
+        for node in reachlist:
+            node.T = node.T_prev = node.T_sed = T
+    # Rebuild the per-node constants (C_args) from the new values
+    for node in reachlist:
+        node.Initialize()
+
+def Initialize(spreadsheet, run_type):
+    """Pool initializer, which reads the model if we didn't inherit it"""
+    global _model, _run_type
+    if _model is None:
+        IniParams["headless"] = True
+        _model = LoadInterface(spreadsheet, Logger, run_type)
+        _run_type = run_type
+
+def RunScenario(args):
+    """Run one scenario in a worker process, returning a summary dictionary"""
+    scenario, outputdir = args
+    result = {"name": scenario["name"], "outputdir": outputdir, "error": None}
+    time1 = Time()
+    try:
+        IniParams["headless"] = True
+        IniParams.update(scenario.get("params", {}))
+        IniParams["outputdir"] = outputdir
+        if not exists(outputdir): makedirs(outputdir)
+        Logger.SetFile(join(outputdir, "outfile.log"))
+        ApplyScenario(_model, scenario, _run_type)
+        HSP = ModelControl(None, _run_type, _model)
+        HSP.Run()
+    # A headless run raises SystemExit on a model error, which shouldn't take the pool down with it
+    except (Exception, SystemExit):
+        result["error"] = format_exc()
+    result["wall_time"] = Time() - time1
+    # ru_maxrss is in kilobytes on Linux
+    result["peak_memory"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else None
+    return result
+
+def RunBatch(spreadsheet, scenarios, outputdir=None, run_type=0, processes=None):
+    """Run a list of scenarios, processes at a time (default is one per CPU)
+
+    Output for each scenario goes to a subdirectory (named for the
+    scenario) of outputdir, or of the model's own output directory.
+    Returns a list of dictionaries, in the order of scenarios, with the
+    name, outputdir, wall_time (seconds), peak_memory (megabytes) and
+    error (a traceback, or None) of each run."""
+    global _model, _run_type
+    names = [s["name"] for s in scenarios]
+    if len(set(names)) != len(names):
+        raise Exception("Scenario names must be unique, since they name the output directories")
+    if hasattr(os, "fork"):
+        # Read the model once and let the workers inherit it
+        IniParams["headless"] = True
+        _model = LoadInterface(spreadsheet, Logger, run_type)
+        _run_type = run_type
+        outputdir = outputdir or IniParams["outputdir"]
+    elif not outputdir:
+        raise Exception("An output directory is needed for a batch on this platform")
+    jobs = [(s, join(outputdir, s["name"]) + sep) for s in scenarios]
+    pool = Pool(processes, Initialize, (spreadsheet, run_type), maxtasksperchild=1)
+    try:
+        return pool.map(RunScenario, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+def Main():
+    parser = OptionParser(usage="%prog [options] model scenarios.json",
+                          description="Run a batch of Heat Source scenarios. The model is a "
+                          "workbook or a directory of exported worksheets, and scenarios.json "
+                          "holds a list of scenarios (see the Utils/Batch.py docstring).")
+    parser.add_option("-o", "--output", dest="outputdir", default=None,
+                      help="Directory to hold the output directories [default: the model's]")
+    parser.add_option("-p", "--processes", dest="processes", type="int", default=None,
+                      help="Number of scenarios to run at once [default: one per CPU]")
+    parser.add_option("-r", "--run-type", dest="run_type", type="int", default=0,
+                      help="0 for Heat Source, 1 for Shade-a-lator, 2 for hydraulics only [default: 0]")
+    options, args = parser.parse_args()
+    if len(args) != 2:
+        parser.error("Need a model and a scenario file")
+    f = open(args[1])
+    try:
+        scenarios = json.load(f)
+    finally:
+        f.close()
+    results = RunBatch(args[0], scenarios, options.outputdir, options.run_type, options.processes)
+    print "%-30s %12s %12s  %s" % ("Scenario", "Time (s)", "Memory (MB)", "Status")
+    for r in results:
+        print "%-30s %12.1f %12s  %s" % (r["name"], r["wall_time"],
+            "%0.1f" % r["peak_memory"] if r["peak_memory"] is not None else "-",
+            "ok" if r["error"] is None else r["error"].strip().splitlines()[-1])
+    return 1 if [r for r in results if r["error"]] else 0
+
+if __name__ == "__main__":
+    raise SystemExit(Main())
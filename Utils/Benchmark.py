@@ -0,0 +1,237 @@
+"""Benchmarks on synthetic reaches
+
+The only timing that Heat Source reports is the "microseconds in each
+stream node" at the end of a run, and that needs a real model. This
+module writes a synthetic model (as the directory of CSV worksheets
+read by CSVInterface, so no Excel is needed) with a chosen number of
+nodes, days, tributaries and sample counts, then runs it in each of
+the three modes and reports the time spent in each phase as JSON.
+
+Usage: python -m heatsource.Utils.Benchmark [options]
+
+The phases are "load" (reading the worksheets and building the nodes),
+"setup" (the rest of ModelControl's setup), "hydraulics", "heat" and
+"transport" (the three steps of each timestep), "output" (the hourly
+Output calls) and "run" (all of ModelControl.Run()). Shade-only runs
+have no hydraulics or transport, and hydraulics-only runs have no heat
+or transport. node_timesteps_per_second is the number of nodes times
+the number of timesteps, divided by the run time.
+"""
+from __future__ import division
+import csv
+import json
+import random
+import platform
+import sys
+from math import sin, cos, pi
+from os import makedirs
+from os.path import join, isdir
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time as Time
+from time import gmtime, strftime
+from calendar import timegm
+from optparse import OptionParser
+
+from ..Dieties.IniParamsDiety import IniParams
+from ..Utils.Logger import Logger
+from ..BigRedButton import ModelControl, LoadInterface
+from ..__version__ import version_string
+
+# Names and run types of the benchmark modes
+modes = (("full", 0), ("shade", 1), ("hydraulics", 2))
+
+class Timer(object):
+    """Wrap a callable, adding the time spent in it to a dictionary of phases"""
+    def __init__(self, func, phases, name):
+        self.func, self.phases, self.name = func, phases, name
+        phases.setdefault(name, 0.0)
+    def __call__(self, *args, **kwargs):
+        t = Time()
+        try:
+            return self.func(*args, **kwargs)
+        finally:
+            self.phases[self.name] += Time() - t
+    def __getattr__(self, name):
+        # So that the wrapped Output can still be closed
+        return getattr(self.func, name)
+
+def WriteSheet(dirname, name, cells):
+    """Write a worksheet from a dictionary of {(row, column): value}, with rows counted from one"""
+    rows = max([r for r, c in cells])
+    cols = max([c for r, c in cells]) + 1
+    grid = [[""] * cols for i in xrange(rows)]
+    for (r, c), v in cells.iteritems():
+        grid[r-1][c] = v
+    f = open(join(dirname, name + ".csv"), "wb")
+    try:
+        csv.writer(f).writerows(grid)
+    finally:
+        f.close()
+
+def WriteModel(dirname, nodes=100, days=2, flushdays=1, tribs=2, sites=2, radial=8, trans=4, seed=0):
+    """Write a synthetic model with nodes distance steps to dirname
+
+    The reach has a 200 m distance step with 100 m samples, and hourly
+    boundary, tributary and continuous data (with sites continuous
+    data sites) starting on July 1st, 2001. The land cover and
+    topography are random, from the given seed."""
+    rand = random.Random(seed)
+    outputdir = join(dirname, "output")
+    if not isdir(outputdir): makedirs(outputdir)
+    samples = 2 * (nodes - 1) + 1
+    start = timegm((2001, 7, 1, 0, 0, 0))
+    length = (samples - 1) * 100 / 1000 # Kilometers
+    date = lambda t, fmt="%m/%d/%Y %H:%M": strftime(fmt, gmtime(t))
+    # Cells in the Heat Source Inputs sheet. Columns count from zero (C is 2, E is 4, G is 6).
+    inputs = {(4, 2): "Benchmark", (5, 2): length, (6, 2): outputdir + "/", (8, 2): date(start),
+              (11, 2): date(start + (days - 1) * 86400, "%m/%d/%Y"), (12, 2): flushdays, (13, 2): -7,
+              (4, 4): 1, (5, 4): 200, (6, 4): 100, (7, 4): 8, (8, 4): tribs, (9, 4): sites,
+              (11, 4): "TRUE", (12, 4): "Mass Transfer", (13, 4): 1.505e-9, (14, 4): 1.6e-9,
+              (15, 4): "TRUE", (16, 4): 12, (17, 4): "FALSE", (18, 4): "FALSE", (21, 4): "point",
+              (6, 6): radial, (7, 6): trans}
+    WriteSheet(dirname, "Heat Source Inputs", inputs)
+    kms = [length - i * 0.1 for i in xrange(samples)]
+    zones = radial * trans
+    # TTools data: the emergent zone and land cover codes, then the elevations of the zones
+    cells = {}
+    for i, km in enumerate(kms):
+        r = 6 + i
+        cells[(r, 0)], cells[(r, 1)], cells[(r, 2)], cells[(r, 3)] = i, km, -123.0 + i * 1e-4, 44.0
+        for c in (4, 5, 6): cells[(r, c)] = rand.uniform(2, 15) # Topographic shade angles
+        for j in xrange(zones + 1): cells[(r, 7 + j)] = rand.choice((100, 200, 300))
+        for j in xrange(zones): cells[(r, 8 + zones + j)] = 300 - i * 0.5 + rand.uniform(0, 5)
+    WriteSheet(dirname, "TTools Data", cells)
+    cells = {}
+    for i, km in enumerate(kms):
+        r = 6 + i
+        # Elevation, gradient, bottom width, z, n, sed. conductivity, diffusivity, depth, hyporheic, porosity
+        values = [300 - i * 0.5, 0.004 + 0.002 * rand.random(), 5 + 3 * rand.random(), 1.0, 0.04,
+                  1.57, 0.0064, 0.2, 0.05, 0.3, "", "", 0, 0]
+        cells[(r, 1)] = km
+        for k, v in enumerate(values): cells[(r, 2 + k)] = v
+    WriteSheet(dirname, "Morphology Data", cells)
+    WriteSheet(dirname, "Land Cover Codes", {(3, 1): "Code",
+                                             (4, 1): 100, (4, 2): 5, (4, 3): 0.5, (4, 4): 0.5,
+                                             (5, 1): 200, (5, 2): 20, (5, 3): 0.8, (5, 4): 1,
+                                             (6, 1): 300, (6, 2): 0, (6, 3): 0.0, (6, 4): 0})
+    # The hourly data has to go one hour past the end of the model
+    hours = xrange(days * 24 + 1)
+    cells = {}
+    for s in xrange(sites):
+        cells[(5 + s, 3)] = kms[s * (samples - 1) // sites]
+    for h in hours:
+        r, hh = 5 + h, h % 24
+        cells[(r, 5)] = date(start + h * 3600)
+        cells[(r, 6)] = 2.0 + 0.1 * sin(hh / 3) # Boundary flow
+        cells[(r, 7)] = 14 + 3 * sin((hh - 10) / 24 * 2 * pi) # Boundary temperature
+        for s in xrange(sites):
+            c = 9 + 5 * s # Cloudiness, wind, humidity, air temperature, stream temperature
+            cells[(r, c)], cells[(r, c+1)], cells[(r, c+2)] = 0.2 + 0.1 * s, 1.5 + sin(hh / 3), 0.5 + 0.2 * cos(hh / 4)
+            cells[(r, c+3)], cells[(r, c+4)] = 15 + 8 * sin((hh - 9) / 24 * 2 * pi), ""
+    WriteSheet(dirname, "Continuous Data", cells)
+    cells = {}
+    for i, km in enumerate(kms):
+        # Accretion flow and temperature, and withdrawals
+        cells[(4 + i, 1)], cells[(4 + i, 2)], cells[(4 + i, 3)], cells[(4 + i, 4)] = km, 0.001, 12.0, 0.0
+    for t in xrange(tribs):
+        cells[(4 + t, 9)] = kms[(t + 1) * (samples - 1) // (tribs + 1)]
+    for h in hours:
+        r, hh = 4 + h, h % 24
+        cells[(r, 11)] = date(start + h * 3600)
+        for t in xrange(tribs):
+            cells[(r, 12 + 2 * t)], cells[(r, 13 + 2 * t)] = 0.3 + 0.05 * t, 10 + hh / 6
+    WriteSheet(dirname, "Flow Data", cells)
+
+def RunMode(dirname, run_type, params):
+    """Run the model in dirname, returning a dictionary of results"""
+    phases = {}
+    IniParams.update(params)
+    t = Time()
+    HS = LoadInterface(dirname, Logger, run_type)
+    phases["load"] = Time() - t
+    t = Time()
+    HSP = ModelControl(dirname, run_type, HS)
+    phases["setup"] = Time() - t
+    # Time each step of the timestep by wrapping the methods that run_all() calls
+    if HSP.Reach:
+        reach = HSP.Reach
+        for name, method in (("hydraulics", "CalcDischarge"), ("heat", "CalcHeat"), ("transport", "MacCormick")):
+            setattr(reach, method, Timer(getattr(reach, method), phases, name))
+    else:
+        nodes = HSP.reachlist
+        hydraulics, heat, transport = [Timer(lambda f: f(), phases, name) for name in ("hydraulics", "heat", "transport")]
+        def run_hs(time, H, M, S, JD, JDC):
+            hydraulics(lambda: [x.CalcDischarge(time) for x in nodes])
+            heat(lambda: HSP.CalcHeat(time, H, M, S, JD, JDC))
+            transport(lambda: [x.MacCormick2(time) for x in nodes])
+        def run_hy(time, H, M, S, JD, JDC):
+            hydraulics(lambda: [x.CalcDischarge(time) for x in nodes])
+        def run_sh(time, H, M, S, JD, JDC):
+            heat(lambda: HSP.CalcHeat(time, H, M, S, JD, JDC, True))
+        HSP.run_all = (run_hs, run_sh, run_hy)[run_type]
+    HSP.Output = Timer(HSP.Output, phases, "output")
+    timesteps = int((IniParams["modelend"] - IniParams["flushtimestart"]) // IniParams["dt"]) + 1
+    t = Time()
+    HSP.Run()
+    phases["run"] = Time() - t
+    # Drop the phases that this mode doesn't have
+    phases = dict([(k, v) for k, v in phases.iteritems() if v or k in ("load", "setup", "run")])
+    return {"run_type": run_type, "nodes": len(HSP.reachlist), "timesteps": timesteps, "phases": phases,
+            "node_timesteps_per_second": len(HSP.reachlist) * timesteps / phases["run"]}
+
+def RunBenchmark(nodes=100, days=2, flushdays=1, tribs=2, sites=2, radial=8, trans=4,
+                 run_modes=("full", "shade", "hydraulics"), params=None, dirname=None):
+    """Write a synthetic model and run it in each of run_modes
+
+    params are IniParams changes (e.g. {"vectorize": True}) for every
+    run. The model is written to a temporary directory unless dirname
+    is given. Returns a dictionary that can be saved as JSON."""
+    config = {"nodes": nodes, "days": days, "flushdays": flushdays, "tribs": tribs, "sites": sites,
+              "radial": radial, "trans": trans, "params": params or {}}
+    results = {"version": version_string, "python": sys.version.split()[0], "platform": platform.platform(),
+               "numpy": __import__("numpy").__version__, "config": config, "modes": {}}
+    temp = dirname is None
+    dirname = dirname or mkdtemp(prefix="hs_benchmark_")
+    try:
+        WriteModel(dirname, nodes, days, flushdays, tribs, sites, radial, trans)
+        for name, run_type in modes:
+            if name in run_modes:
+                results["modes"][name] = RunMode(dirname, run_type, dict(config["params"], headless=True))
+    finally:
+        if temp: rmtree(dirname, True)
+    return results
+
+def Main():
+    parser = OptionParser(usage="%prog [options]",
+                          description="Time Heat Source on a synthetic reach and print the results as JSON.")
+    parser.add_option("-n", "--nodes", type="int", default=100, help="Number of nodes [default: %default]")
+    parser.add_option("-d", "--days", type="int", default=2, help="Number of model days [default: %default]")
+    parser.add_option("-f", "--flush", type="int", default=1, help="Number of spin-up days [default: %default]")
+    parser.add_option("-t", "--tribs", type="int", default=2, help="Number of tributaries [default: %default]")
+    parser.add_option("-s", "--sites", type="int", default=2, help="Number of continuous data sites [default: %default]")
+    parser.add_option("-r", "--radial", type="int", default=8, help="Number of radial sample directions [default: %default]")
+    parser.add_option("-z", "--trans", type="int", default=4, help="Number of transverse samples per direction [default: %default]")
+    parser.add_option("-m", "--modes", default="full,shade,hydraulics", help="Modes to run [default: %default]")
+    parser.add_option("-p", "--param", action="append", default=[],
+                      help="Set an IniParams value for the runs, as name=value (a Python literal). May be repeated.")
+    parser.add_option("-o", "--output", default=None, help="Write the JSON to this file instead of the screen")
+    options, args = parser.parse_args()
+    params = {}
+    for p in options.param:
+        name, value = p.split("=", 1)
+        params[name] = eval(value, {}, {})
+    results = RunBenchmark(options.nodes, options.days, options.flush, options.tribs, options.sites,
+                           options.radial, options.trans, options.modes.split(","), params)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if options.output:
+        f = open(options.output, "w")
+        try:
+            f.write(text)
+        finally:
+            f.close()
+    else:
+        print text
+
+if __name__ == "__main__":
+    Main()
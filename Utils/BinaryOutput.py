@@ -0,0 +1,140 @@
+"""Binary output for Heat Source
+
+BinaryOutput collects the same values as Output, but instead of
+formatting them into fixed width text, each day's rows are copied into
+preallocated arrays of time x node (SolarBlock is day x node x zone).
+The copying is done by Output's writer, so with IniParams["output_queue"]
+it happens in the background as well.
+IniParams["output_format"] picks the container:
+
+    "memmap" - one NumPy .npy file per output, written through a memory
+               map, plus output_meta.npz with the kilometers and times
+    "npz"    - everything in a single output.npz, written at the end
+    "hdf5"   - everything in a single output.h5 (needs h5py)
+
+IniParams["output_dtype"] is the float type of the arrays. The times
+are stored as seconds since the epoch ("time" for the hourly outputs,
+"daily_time" for Shade, VTS and SolarBlock), and "km" holds the stream
+kilometer of each node column. Each output's description is stored as
+well. If a run stops early, the memmap files keep their full length,
+and "rows" in output_meta.npz says how much of each was written.
+"""
+from __future__ import division
+import numpy as np
+from os.path import join
+
+from ..Dieties.IniParamsDiety import IniParams
+from Output import Output, daily_outputs
+
+class BinaryOutput(Output):
+    """Output that writes arrays instead of text files"""
+    def OpenFiles(self, desc, state=None):
+        """Preallocate an array for each output, or reopen them from a checkpoint's state"""
+        self.format = IniParams["output_format"]
+        if self.format not in ("memmap", "npz", "hdf5"):
+            raise Exception("Unknown output format (%s). Must be text, memmap, npz or hdf5" % self.format)
+        self.desc = desc
+        dtype = np.dtype(IniParams["output_dtype"])
+        outputdir = IniParams["outputdir"]
+        # Output only records on the hour after the spin-up, up to the end of the model
+        hours = int((IniParams["modelend"] - self.start_time) // 3600) + 1
+        days = -(-hours // 24)
+        self.zones = IniParams["radialsample_count"] * IniParams["transsample_count"] + 1
+        shapes = {}
+        for name in desc.iterkeys():
+            if name == "SolarBlock": shapes[name] = (days, len(self.nodes), self.zones)
+            elif name in daily_outputs: shapes[name] = (days, len(self.nodes))
+            else: shapes[name] = (hours, len(self.nodes))
+        self.rows = dict([(name, 0) for name in desc.iterkeys()])
+        self.time = []
+        self.daily_time = []
+        if state is not None:
+            self.rows, self.time, self.daily_time = state["rows"], state["time"], state["daily_time"]
+        self.arrays = {}
+        if self.format == "memmap":
+            from numpy.lib.format import open_memmap
+            for name, shape in shapes.iteritems():
+                self.arrays[name] = open_memmap(join(outputdir, name + ".npy"), "w+" if state is None else "r+", dtype, shape)
+        elif self.format == "npz":
+            for name, shape in shapes.iteritems():
+                self.arrays[name] = np.zeros(shape, dtype)
+                # These only live in memory, so the checkpoint holds what's been written so far
+                if state is not None:
+                    self.arrays[name][:self.rows[name]] = state["arrays"][name]
+        else:
+            try:
+                import h5py
+            except ImportError:
+                raise Exception("HDF5 output requires the h5py package")
+            if state is None:
+                self.h5 = h5py.File(join(outputdir, "output.h5"), "w")
+                for name, shape in shapes.iteritems():
+                    self.arrays[name] = self.h5.create_dataset(name, shape, dtype)
+                    self.arrays[name].attrs["description"] = desc[name]
+            else:
+                self.h5 = h5py.File(join(outputdir, "output.h5"), "a")
+                for name in shapes.iterkeys():
+                    self.arrays[name] = self.h5[name]
+        self.files = {}
+
+    def GetState(self):
+        """Return what a checkpoint needs to restart the output"""
+        self.Drain()
+        state = {"first_hour": self.first_hour, "hours": self.day[:len(self.times)].copy(),
+                 "times": list(self.times), "rows": self.rows, "time": self.time, "daily_time": self.daily_time}
+        if self.format == "memmap":
+            for array in self.arrays.itervalues():
+                array.flush()
+        elif self.format == "npz":
+            state["arrays"] = dict([(name, array[:self.rows[name]].copy()) for name, array in self.arrays.iteritems()])
+        else:
+            self.h5.flush()
+        return state
+
+    def close(self):
+        """Trim the arrays to what was written, and write the metadata"""
+        self.Stop()
+        meta = {"km": np.array([x.km for x in self.nodes]),
+                "time": np.array(self.time),
+                "daily_time": np.array(self.daily_time)}
+        if self.format == "memmap":
+            for array in self.arrays.itervalues():
+                array.flush()
+            names = sorted(self.desc.keys())
+            np.savez(join(IniParams["outputdir"], "output_meta.npz"),
+                     names=np.array(names), description=np.array([self.desc[n] for n in names]),
+                     rows=np.array([self.rows[n] for n in names]), **meta)
+            del self.arrays
+        elif self.format == "npz":
+            arrays = dict([(name, array[:self.rows[name]]) for name, array in self.arrays.iteritems()])
+            arrays.update(meta)
+            np.savez(join(IniParams["outputdir"], "output.npz"), **arrays)
+        else:
+            for name, array in self.arrays.iteritems():
+                array.resize(self.rows[name], axis=0)
+            for name, value in meta.iteritems():
+                self.h5.create_dataset(name, data=value)
+            self.h5.close()
+
+    def write(self, hours, times, daily):
+        """Copy a day's (hour, output, node) array of hourly outputs, and the daily outputs if there are any"""
+        for name, array in self.arrays.iteritems():
+            if name in self.row:
+                block = hours[:, self.row[name]]
+            elif daily is None:
+                continue
+            else:
+                block = np.array([daily[name]])
+            r = self.rows[name]
+            array[r:r+len(block)] = block
+            self.rows[name] = r + len(block)
+        # The timestamps are the Excel day strings made by __call__()
+        seconds = lambda t: round((float(t) - 25569) * 86400)
+        self.time.extend([seconds(t) for t in times])
+        if daily is not None: self.daily_time.append(seconds(times[-1]))
+
+    def daily(self, timestamp):
+        """Return the daily data, with the flux blocked in every direction"""
+        data = Output.daily(self, timestamp)
+        data["SolarBlock"] = self.daily_sums.Blocked() / (86400.0/float(IniParams["dt"]))
+        return data
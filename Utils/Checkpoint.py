@@ -0,0 +1,108 @@
+"""Save and restore the model state part way through a run
+
+A checkpoint holds everything that changes during a run: the dynamic
+attributes of every StreamNode, the Chronos clock, the mass balance
+counters in ModelControl.Run() and the Output state (the buffered data,
+and how far each output file had got). Restarting from a checkpoint
+gives the same output as a run that was never interrupted.
+
+The file is a pickle (the highest protocol, so the node arrays are
+stored as binary) of a dictionary. It carries a key made from the run
+type, timestep, start times and node kilometers, so that a checkpoint
+is never loaded into a model that it doesn't belong to.
+
+ModelControl saves a checkpoint every IniParams["checkpoint_days"] days
+(and when the quit button is used) if IniParams["checkpoint_file"] is
+set, and resumes from it if IniParams["resume"] is set. The state at the
+end of the spin-up period can also be kept in IniParams["spinup_file"]
+and reused by any run with the same flush period, such as the other
+scenarios of a batch. A spin-up state doesn't include the Output, which
+has nothing in it until the spin-up is over.
+"""
+from __future__ import division
+import cPickle
+import numpy as np
+from os import remove, rename
+from os.path import exists
+
+from ..Dieties.IniParamsDiety import IniParams
+from ..Dieties.ChronosDiety import Chronos
+from ..Stream.StreamReach import StreamReach
+
+def Key(reachlist, run_type):
+    """Return the key that ties a checkpoint to a model"""
+    return (run_type, IniParams["dt"], IniParams["flushtimestart"], IniParams["modelstart"],
+            tuple([x.km for x in reachlist]))
+
+def GetNodeState(reachlist):
+    """Return the dynamic state of the nodes as a dictionary of arrays"""
+    # None becomes NaN in the float arrays, which is how ArrayStreamNodes keep it already
+    arrays = getattr(reachlist[0], "arrays", None)
+    rows = arrays.Rows(reachlist) if arrays is not None else None
+    if rows is not None:
+        state = dict([(attr, getattr(arrays, attr)[rows].copy()) for attr in StreamReach.dynamic])
+    else:
+        state = dict([(attr, np.array([getattr(x, attr) for x in reachlist], dtype=float))
+                      for attr in StreamReach.dynamic])
+    state["F_Solar"] = np.array([x.F_Solar for x in reachlist], dtype=float)
+    # The daily sums are rows of the reach's DailySums, if the nodes have been given one
+    if reachlist[0].F_DailySum is not None:
+        state["F_DailySum"] = np.array([x.F_DailySum for x in reachlist], dtype=float)
+        state["Solar_Blocked"] = np.array([x.Solar_Blocked for x in reachlist], dtype=float)
+    return state
+
+def SetNodeState(reachlist, state):
+    """Put the state from GetNodeState() back into the nodes"""
+    arrays = getattr(reachlist[0], "arrays", None)
+    rows = arrays.Rows(reachlist) if arrays is not None else None
+    for attr in StreamReach.dynamic:
+        if rows is not None:
+            getattr(arrays, attr)[rows] = state[attr]
+            continue
+        for x, v in zip(reachlist, state[attr].tolist()):
+            setattr(x, attr, v if v == v else None)
+    for x, v in zip(reachlist, state["F_Solar"].tolist()):
+        x.F_Solar = v
+    # Copied into the nodes' rows, so that they're still shared with the DailySums
+    if "F_DailySum" in state:
+        for x, s, b in zip(reachlist, state["F_DailySum"], state["Solar_Blocked"]):
+            x.F_DailySum[:] = s
+            x.Solar_Blocked[:] = b
+    # Every node is past its first timestep, which is where the discharge routine is chosen
+    for x in reachlist:
+        x.CalcDischarge = x.CalcDischarge_Opt if x.prev_km else x.CalcDischarge_BoundaryNode
+
+def Save(filename, reachlist, run_type, run, output=None):
+    """Write a checkpoint
+
+    run is a dictionary of ModelControl.Run()'s own counters, and output
+    is the Output instance, or None for a spin-up state."""
+    state = {"key": Key(reachlist, run_type),
+             "nodes": GetNodeState(reachlist),
+             "chronos": Chronos.GetState(),
+             "run": run,
+             "output": output.GetState() if output else None}
+    # Write to a temporary file first, so a crash while writing leaves the last checkpoint alone
+    f = open(filename + ".tmp", "wb")
+    try:
+        cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+    finally:
+        f.close()
+    if exists(filename): remove(filename)
+    rename(filename + ".tmp", filename)
+
+def Load(filename, reachlist, run_type):
+    """Read a checkpoint, returning its state dictionary
+
+    The nodes and Chronos are restored straight away. The caller has
+    to restore the rest (the "run" counters and the "output" state)."""
+    f = open(filename, "rb")
+    try:
+        state = cPickle.load(f)
+    finally:
+        f.close()
+    if state["key"] != Key(reachlist, run_type):
+        raise Exception("Checkpoint %s was saved from a different model (or run type, timestep or start time)" % filename)
+    SetNodeState(reachlist, state["nodes"])
+    Chronos.SetState(state["chronos"])
+    return state
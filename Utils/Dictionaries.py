@@ -2,8 +2,10 @@ from __future__ import division
 from time import ctime, gmtime
 from collections import defaultdict
 from bisect import bisect_right, bisect_left
+import numpy as np
 
 from ..Dieties.IniParamsDiety import IniParams
+from ..Dieties.ForcingDiety import Forcing
 from .. import opt
 
 class Interpolator(defaultdict):
@@ -84,6 +86,83 @@ class Interpolator(defaultdict):
             d[k] = self[k]
         return d
 
+class ForcingTable(object):
+    def __init__(self, source, start, stop, dt):
+        """Interpolator values resampled once onto the model's timestep grid
+
+        Looking up an Interpolator between its keys bisects and builds a new
+        tuple every time, and the result is not stored because it would eat
+        the memory. This class does all of those interpolations up front,
+        for every timestep from start to stop, and stores them in a NumPy
+        array with one row per timestep, so a lookup is just an index.
+        The values are calculated exactly as Interpolator.__missing__ does.
+        Times that are off the grid, or outside of the data, are handed back
+        to the source Interpolator."""
+        self.source = source
+        self.start = start
+        self.dt = dt
+        steps = int((stop - start) // dt) + 1
+        grid = start + dt * np.arange(steps)
+        keys = sorted(source.keys())
+        values = [source[k] for k in keys]
+        self.scalar = not isinstance(values[0], tuple) if len(keys) else False
+        if not len(keys):
+            # An empty Interpolator returns (0.0,) for everything
+            self.data = np.zeros((steps, 1))
+            self.first, self.last = 0, steps - 1
+            self.width = 1
+            return
+        if self.scalar:
+            y = np.array([np.nan if v is None else v for v in values], dtype=float)[:,np.newaxis]
+        else:
+            y = np.array([[np.nan if v is None else v for v in tup] for tup in values], dtype=float)
+            y = y.reshape(len(keys), -1)
+        x = np.array(keys, dtype=float)
+        # Same bracketing and arithmetic as __missing__, but for the whole grid at once
+        ind = np.clip(np.searchsorted(x, grid, side="right") - 1, 0, len(keys) - 1)
+        x0 = x[ind][:,np.newaxis]
+        x1 = x[np.minimum(ind + 1, len(keys) - 1)][:,np.newaxis]
+        y0 = y[ind]
+        y1 = y[np.minimum(ind + 1, len(keys) - 1)]
+        t = grid[:,np.newaxis]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.data = np.where(t == x0, y0, y0 + ((y1 - y0) * (t - x0)) / (x1 - x0))
+        if self.scalar: self.data = self.data[:,0]
+        self.width = y.shape[1]
+        # Only the timesteps bracketed by the data are in the table
+        self.first = int(np.searchsorted(grid, x[0], side="left"))
+        self.last = int(np.searchsorted(grid, x[-1], side="right")) - 1
+
+    def __getitem__(self, time):
+        step = (time - self.start) / self.dt
+        i = int(step)
+        if i != step or i < self.first or i > self.last:
+            return self.source[time]
+        if self.scalar: return self.data.item(i)
+        return tuple(self.data[i].tolist())
+
+def ResampleForcing(reachlist, start, stop, dt):
+    """Replace the forcing Interpolators with ForcingTables
+
+    Every series in the Forcing registry is resampled once, however many
+    nodes share it, and so are the boundary conditions of a list of
+    StreamNodes. The empty series of the nodes without tributaries is
+    left as it is."""
+    for handle in xrange(len(Forcing)):
+        if isinstance(Forcing[handle], Interpolator):
+            try:
+                Forcing[handle] = ForcingTable(Forcing[handle], start, stop, dt)
+            except ValueError:
+                pass # Tuples of different lengths, leave it to the Interpolator
+    tables = {}
+    for node in reachlist:
+        for attr in ("Q_bc", "T_bc"):
+            source = getattr(node, attr)
+            if not isinstance(source, Interpolator): continue
+            if id(source) not in tables:
+                tables[id(source)] = ForcingTable(source, start, stop, dt)
+            setattr(node, attr, tables[id(source)])
+
 try:
     if opt(__name__):
         import psyco
@@ -0,0 +1,83 @@
+"""Keep a model that has been read from its inputs in a binary file
+
+Reading a big model takes a while: the workbook is read cell by cell
+over COM (or parsed from the exported sheets), and then the nodes,
+their shade geometry and the forcing dictionaries are built up from it.
+If IniParams["model_cache"] names a directory, HeatSourceInterface
+saves the model it built there (the IniParams read from the inputs,
+the attributes of every StreamNode apart from the ones that point at
+other nodes, the shade geometry arrays and the boundary and forcing
+data) and the next run with the same inputs loads it instead.
+
+The file is a pickle, like a checkpoint, named for a hash of the input
+files (the workbook, or every worksheet file in an input directory),
+the run type, and the versions of Heat Source and of the cache format,
+so changing any of them reads the model again. A workbook with unsaved
+changes isn't cached at all, since the file doesn't have the changes.
+"""
+from __future__ import division
+import cPickle
+from hashlib import sha1
+from os.path import join, exists, basename
+from os import remove, rename
+
+from ..__version__ import version_info
+
+# Version of what goes into the cache, which must change along with it
+version = 3
+
+class ModelCache(object):
+    def __init__(self, interface, cachedir):
+        """ModelCache(interface, cachedir) -> Class instance
+
+        interface is the HeatSourceInterface that is reading the model,
+        with its document already open."""
+        self.interface = interface
+        self.filename = None
+        files = interface.SourceFiles()
+        if files is None:
+            interface.PB("The workbook has unsaved changes, so the model cache is not used")
+            return
+        h = sha1(repr((version, version_info, interface.run_type)))
+        for name in files:
+            h.update(basename(name))
+            f = open(name, "rb")
+            try:
+                for block in iter(lambda: f.read(1 << 20), ""):
+                    h.update(block)
+            finally:
+                f.close()
+        self.key = h.hexdigest()
+        self.filename = join(cachedir, "model_%s.pkl" % self.key)
+
+    def Load(self):
+        """Restore the interface from the cache, returning whether it was there"""
+        if not self.filename or not exists(self.filename):
+            return False
+        self.interface.PB("Loading the model from %s" % self.filename)
+        f = open(self.filename, "rb")
+        try:
+            state = cPickle.load(f)
+        finally:
+            f.close()
+        if state["key"] != self.key or state["version"] != version:
+            return False
+        self.interface.SetState(state)
+        self.interface.log.write("Loaded the model from %s" % self.filename)
+        return True
+
+    def Save(self):
+        """Write the interface's model to the cache"""
+        if not self.filename: return
+        state = self.interface.GetState()
+        state["key"] = self.key
+        state["version"] = version
+        # Write to a temporary file first, so a crash while writing doesn't leave half a model
+        f = open(self.filename + ".tmp", "wb")
+        try:
+            cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        if exists(self.filename): remove(self.filename)
+        rename(self.filename + ".tmp", self.filename)
+        self.interface.log.write("Saved the model to %s" % self.filename)
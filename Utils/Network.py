@@ -0,0 +1,202 @@
+"""Run a network of reaches, feeding each reach's outflow to the one below
+
+A model only has one mainstem, so a modelled tributary usually has to
+be run on its own, and its outflow copied by hand into the "Flow Data"
+sheet of the reach it flows into. RunNetwork() does this for a whole
+network: each reach is its own model (a workbook or a directory of
+exported worksheets), and a reach with an "outlet" has its hourly
+discharge and temperature at the mouth added to the tributary inputs of
+the outlet reach's node at the given kilometer (picked the same way as
+a "Flow Data" site). "params" are changes to a reach's IniParams, as in
+a batch scenario (see Utils/Batch.py). A network is a dictionary,
+usually kept in a JSON file:
+
+    {"reaches": [
+        {"name": "north_fork", "model": "north_fork/",
+         "outlet": {"reach": "mainstem", "km": 12.5}},
+        {"name": "south_fork", "model": "south_fork.xls",
+         "outlet": {"reach": "mainstem", "km": 8.0}},
+        {"name": "mainstem", "model": "mainstem/", "params": {"vectorize": True}}]}
+
+The reaches are run in levels: first every reach with nothing flowing
+into it, then every reach whose inflows have all been run, and so on.
+The reaches in a level are independent, so they run at the same time,
+each in its own process from a multiprocessing Pool (the model settings
+live in the global IniParams, so each process only ever holds one
+model). Every reach must cover the outlet reach's model period. The
+outflow during the outlet reach's spin-up is made up the way the
+"Flow Data" sheet's is: the discharge at the model start, and the first
+day's temperatures over again.
+"""
+from __future__ import division
+from multiprocessing import Pool
+from os.path import join, exists
+from os import makedirs, sep
+from bisect import bisect
+from time import time as Time
+from traceback import format_exc
+from optparse import OptionParser
+import json
+import numpy as np
+
+from ..Dieties.IniParamsDiety import IniParams
+from ..Dieties.ForcingDiety import Forcing
+from ..Utils.Logger import Logger
+from ..Utils.Dictionaries import Interpolator
+from ..BigRedButton import ModelControl, LoadInterface
+
+class MouthRecorder(object):
+    def __init__(self, output, mouth):
+        """MouthRecorder(output, mouth) -> Class instance
+
+        Stands in for ModelControl's Output, keeping the discharge and
+        temperature of the mouth node every hour that is written."""
+        self.output = output
+        self.mouth = mouth
+        self.series = []
+
+    def __call__(self, time, hour):
+        if time >= self.output.start_time:
+            self.series.append((time, self.mouth.Q, self.mouth.T))
+        self.output(time, hour)
+
+    def __getattr__(self, name):
+        return getattr(self.output, name)
+
+def Levels(reaches):
+    """Return the reaches in a list of levels, each level only flowing into later ones"""
+    names = [r["name"] for r in reaches]
+    if len(set(names)) != len(names):
+        raise Exception("Reach names must be unique")
+    byname = dict([(r["name"], r) for r in reaches])
+    for r in reaches:
+        if "outlet" in r and r["outlet"]["reach"] not in byname:
+            raise Exception("Reach %s flows into %s, which isn't in the network" % (r["name"], r["outlet"]["reach"]))
+    levels = []
+    done = set()
+    while len(done) < len(reaches):
+        level = [r for r in reaches if r["name"] not in done and
+                 not [u for u in reaches if u.get("outlet", {}).get("reach") == r["name"] and u["name"] not in done]]
+        if not level:
+            raise Exception("The network has a loop in it: %s" % ", ".join([n for n in names if n not in done]))
+        levels.append(level)
+        done.update([r["name"] for r in level])
+    return levels
+
+def AddInflow(HS, km, series):
+    """Add a series of (time, Q, T) to the tributary inputs of HS's node at km"""
+    kms = sorted(HS.Reach.keys())
+    node = HS.Reach[kms[max(bisect(kms, km) - 1, 0)]]
+    start, end = IniParams["modelstart"], IniParams["modelend"]
+    times = np.array([s[0] for s in series], dtype=float)
+    if not len(times) or times[0] > start or times[-1] < end - 3600:
+        raise Exception("The inflow at km %s doesn't cover the model period" % km)
+    Q = np.array([s[1] for s in series], dtype=float)
+    T = np.array([s[2] for s in series], dtype=float)
+    Q_tribs, T_tribs = Forcing[node.Q_tribs], Forcing[node.T_tribs]
+    # Every hour of the spin-up and the model, and any times the node already has data for
+    keys = set(HS.flushtimelist) | set(HS.flowtimelist) | set(Q_tribs.keys())
+    # Look everything up before changing anything, since the lookups interpolate between the keys
+    old = [(time, Q_tribs[time], T_tribs[time]) for time in sorted(keys)]
+    if node.Q_tribs == Forcing.none:
+        # The node had no tributaries, and so shares the empty series
+        node.Q_tribs = Forcing.Add(Interpolator())
+        node.T_tribs = Forcing.Add(Interpolator())
+        Q_tribs, T_tribs = Forcing[node.Q_tribs], Forcing[node.T_tribs]
+    for time, Q_tup, T_tup in old:
+        if time < start:
+            # Discharge at the model start, and the first day repeated, as in GetTributaryData()
+            q = np.interp(start, times, Q)
+            t = np.interp(start + (time - start) % 86400, times, T)
+        else:
+            q, t = np.interp(time, times, Q), np.interp(time, times, T)
+        Q_tribs[time] = Q_tup + (float(q),)
+        T_tribs[time] = T_tup + (float(t),)
+    Q_tribs.sortedkeys = T_tribs.sortedkeys = None
+
+def RunReach(args):
+    """Run one reach in a worker process, returning a summary dictionary"""
+    reach, inflows, outputdir, run_type = args
+    result = {"name": reach["name"], "outputdir": outputdir, "series": None, "error": None}
+    time1 = Time()
+    try:
+        IniParams["headless"] = True
+        HS = LoadInterface(reach["model"], Logger, run_type)
+        IniParams.update(reach.get("params", {}))
+        if outputdir:
+            IniParams["outputdir"] = outputdir
+            if not exists(outputdir): makedirs(outputdir)
+            Logger.SetFile(join(outputdir, "outfile.log"))
+        result["outputdir"] = IniParams["outputdir"]
+        for km, series in inflows:
+            AddInflow(HS, km, series)
+        HSP = ModelControl(None, run_type, HS)
+        HSP.Output = MouthRecorder(HSP.Output, HSP.reachlist[-1])
+        HSP.Run()
+        result["series"] = HSP.Output.series
+    # A headless run raises SystemExit on a model error, which shouldn't take the pool down with it
+    except (Exception, SystemExit):
+        result["error"] = format_exc()
+    result["wall_time"] = Time() - time1
+    return result
+
+def RunNetwork(network, outputdir=None, run_type=0, processes=None):
+    """Run a network of reaches, processes at a time (default is one per CPU)
+
+    If outputdir is given, each reach's output goes to a subdirectory
+    of it named for the reach, otherwise to the reach model's own output
+    directory. Returns a list of dictionaries, in the order the reaches
+    were run, with the name, outputdir, wall_time (seconds), series (the
+    hourly (time, Q, T) at the mouth) and error (a traceback, or None) of
+    each reach. A reach below one that failed isn't run."""
+    reaches = network["reaches"]
+    levels = Levels(reaches)
+    results = {}
+    pool = Pool(processes, maxtasksperchild=1)
+    try:
+        for level in levels:
+            jobs = []
+            for reach in level:
+                upstream = [u for u in reaches if u.get("outlet", {}).get("reach") == reach["name"]]
+                failed = [u["name"] for u in upstream if results[u["name"]]["error"]]
+                if failed:
+                    results[reach["name"]] = {"name": reach["name"], "outputdir": None, "series": None, "wall_time": 0.0,
+                                              "error": "Not run, since %s failed" % ", ".join(failed)}
+                    continue
+                inflows = [(u["outlet"]["km"], results[u["name"]]["series"]) for u in upstream]
+                jobs.append((reach, inflows, join(outputdir, reach["name"]) + sep if outputdir else None, run_type))
+            for result in pool.map(RunReach, jobs, chunksize=1):
+                results[result["name"]] = result
+    finally:
+        pool.close()
+        pool.join()
+    return [results[r["name"]] for level in levels for r in level]
+
+def Main():
+    parser = OptionParser(usage="%prog [options] network.json",
+                          description="Run a network of Heat Source reaches, adding the outflow of "
+                          "each reach to the tributary inputs of the reach it flows into (see the "
+                          "Utils/Network.py docstring).")
+    parser.add_option("-o", "--output", dest="outputdir", default=None,
+                      help="Directory to hold an output directory for each reach [default: each model's own]")
+    parser.add_option("-p", "--processes", dest="processes", type="int", default=None,
+                      help="Number of reaches to run at once [default: one per CPU]")
+    parser.add_option("-r", "--run-type", dest="run_type", type="int", default=0,
+                      help="0 for Heat Source, 1 for Shade-a-lator, 2 for hydraulics only [default: 0]")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("Need a network file")
+    f = open(args[0])
+    try:
+        network = json.load(f)
+    finally:
+        f.close()
+    results = RunNetwork(network, options.outputdir, options.run_type, options.processes)
+    print "%-30s %12s  %s" % ("Reach", "Time (s)", "Status")
+    for r in results:
+        print "%-30s %12.1f  %s" % (r["name"], r["wall_time"],
+            "ok" if r["error"] is None else r["error"].strip().splitlines()[-1])
+    return 1 if [r for r in results if r["error"]] else 0
+
+if __name__ == "__main__":
+    raise SystemExit(Main())
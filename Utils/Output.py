@@ -1,9 +1,25 @@
+"""Hourly output of Heat Source
+
+Output is called on the hour with the time. It copies the values of
+every hourly output from the nodes into a preallocated (output x node)
+array, and hands that to the writer, which keeps the hours of the
+current day and writes them all out (with the daily outputs) after the
+23rd hour, as fixed width text. Formatting and writing the day takes a
+while, so if IniParams["output_queue"] is more than zero, the writer is
+a background thread instead, that many hours behind the model at most:
+there are only that many arrays (plus one each for the model and the
+writer), and the model waits for the writer to hand one back when they
+are all in use. The writer thread's errors are raised in the model's
+thread at the next hour.
+"""
 from __future__ import division
 from time import ctime, strftime, gmtime
 from os.path import join, exists
 from os import makedirs
-from copy import deepcopy
-from pywintypes import Time as pyTime
+from threading import Thread
+from Queue import Queue
+from traceback import format_exc
+import numpy as np
 
 
 from ..Dieties.IniParamsDiety import IniParams
@@ -16,11 +32,16 @@ try:
         object = psyco.classes.psyobj
 except ImportError: pass
 
+# Outputs that get one row per day rather than one per hour
+daily_outputs = ("Shade", "VTS", "SolarBlock")
+
 class Output(object):
     """Data and fileobject storage class"""
-    def __init__(self, reach, start_time, run_type):
+    def __init__(self, reach, start_time, run_type, state=None, daily=None):
         # Store a sorted list of StreamNodes. This all could be a bit more abstracted.
         self.nodes = sorted(reach.itervalues(),reverse=True)
+        # The nodes' DailySums, in the same order, which the daily outputs are read from
+        self.daily_sums = daily
         # A reference to the model's starting time (i.e. when spin-up is over)
         self.start_time = start_time
 
@@ -59,14 +80,96 @@ class Output(object):
             desc["Temp_Sed"] = "Sediment Temperature (*C)"
             desc["Hyd_Disp"] = "Hydraulic Dispersion (m2/s)"
 
-        # Storage dictionary for the data.
-        self.data = {}
-        for name in desc.keys():
-            self.data[name] = {}
-        # make a deepcopy of the empty variables dictionary for use later
-        self.empty_vars = deepcopy(self.data)
+        # The hourly outputs, in the order of the rows of the hour arrays,
+        # and the hours of the day so far, which the writer keeps
+        self.hourly = sorted([name for name in desc.iterkeys() if name not in daily_outputs])
+        self.row = dict([(name, i) for i, name in enumerate(self.hourly)])
+        self.day = np.empty((24, len(self.hourly), len(self.nodes)))
+        self.times = []
+        self.OpenFiles(desc, state)
+        # If we're restarting from a checkpoint, pick up the buffered hours as well
+        if state is not None:
+            self.first_hour = state["first_hour"]
+            self.times = state["times"]
+            self.day[:len(self.times)] = state["hours"]
+        self.StartWriter(int(IniParams["output_queue"]))
+
+    def StartWriter(self, queue):
+        """Make the arrays for the hours, and start the writer thread if queue is more than zero"""
+        self.queue = Queue()
+        self.free = Queue()
+        for i in xrange(queue + 1):
+            self.free.put(np.empty((len(self.hourly), len(self.nodes))))
+        self.failed = None
+        self.writer = None
+        if queue > 0:
+            self.writer = Thread(target=self.Writer, name="Output writer")
+            self.writer.setDaemon(True)
+            self.writer.start()
+
+    def Writer(self):
+        """Write the hours from the queue until it gives us None"""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            # After a failure, we only hand the arrays back so that the model doesn't wait forever
+            try:
+                if self.failed is None: self.Write(*item)
+            except:
+                self.failed = format_exc()
+            self.free.put(item[1])
+            self.queue.task_done()
+
+    def Put(self, timestamp, hours, hour, daily):
+        """Hand an hour's array (and at the end of the day, the daily outputs) to the writer"""
+        if self.writer is None:
+            self.Write(timestamp, hours, hour, daily)
+            self.free.put(hours)
+        else:
+            self.queue.put((timestamp, hours, hour, daily))
+
+    def Drain(self):
+        """Wait until the writer has written everything it has been given"""
+        if self.writer is not None: self.queue.join()
+        if self.failed is not None:
+            raise Exception("The output could not be written:\n" + self.failed)
+
+    def Stop(self):
+        """Write everything that's left to write, and stop the writer thread"""
+        if self.writer is not None:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+        if self.failed is not None:
+            raise Exception("The output could not be written:\n" + self.failed)
+
+    def Write(self, timestamp, hours, hour, daily):
+        """Keep an hour's outputs, and write out the day after the 23rd hour"""
+        self.day[len(self.times)] = hours
+        self.times.append(timestamp)
+        # Zero for an hour means a new day, so we add daily outputs
+        # and write to the file. Writing only every day saves us
+        # 24xF file accesses where F=len(self.files). Each file access
+        # has quite a bit of overhead, so we lump them. It's "A Good Thing."
+        if hour == 23:
+            self.write(self.day[:len(self.times)], self.times, daily)
+            self.times = []
+
+    def OpenFiles(self, desc, state=None):
+        """Create the output files and write their headers
+
+        If state is given (from GetState()), the files are reopened
+        and cut back to where they were when the state was saved."""
         # Empty dictionary to store file objects
         self.files = {}
+        if state is not None:
+            for key in desc.iterkeys():
+                self.files[key] = open(join(IniParams["outputdir"], key + ".txt"), 'r+')
+                self.files[key].seek(state["offsets"][key])
+                self.files[key].truncate()
+            return
 
         # Here we build up the self.files attribute by cycling through the
         # filenames and descriptions
@@ -92,10 +195,21 @@ class Output(object):
             self.files[key] = open(join(IniParams["outputdir"], key + ".txt"), 'w')
             self.files[key].write(header)
 
+    def GetState(self):
+        """Return what a checkpoint needs to restart the output"""
+        self.Drain()
+        offsets = {}
+        for key, f in self.files.iteritems():
+            f.flush()
+            offsets[key] = f.tell()
+        return {"first_hour": self.first_hour, "hours": self.day[:len(self.times)].copy(),
+                "times": list(self.times), "offsets": offsets}
+
     def close(self):
-        # Flush the rest of the values from the dataset by flushing the
-        # daily values and by calling the write() method
+        # Wait for the writer to finish. The hours of a day that isn't
+        # over are not written.
         # self.write(self.run_type < 2)  #commented out this line so shade wouldn't output last day twice - DT
+        self.Stop()
         # Then close all of the file objects cleanly
         [f.close() for f in self.files.itervalues()]
 
@@ -109,9 +223,11 @@ class Output(object):
             #return
         # Create an Excel-friendly time string
         timestamp = ("%0.6f" % float(time/86400 + 25569)).ljust(14)
-        # Localize variables to save a bit of time
+        # Localize variables to save a bit of time. The array waits
+        # for the writer to give one back if they're all in use.
         nodes = self.nodes
-        data = self.data
+        hours = self.free.get()
+        row = self.row
         # Cycle through each datatype, creating a list of values
         # corresponding to the nodes for this timestamp. Thus, each
         # timestamp conforms to a single line, and each element in the
@@ -121,80 +237,69 @@ class Output(object):
 
         # Run only with solar
         if self.run_type < 2:
-            data["Heat_Cond"][timestamp] = [x.F_Conduction for x in nodes]
-            data["Heat_Conv"][timestamp] = [x.F_Convection for x in nodes]
-            data["Heat_Evap"][timestamp] = [x.F_Evaporation for x in nodes]
-            data["Heat_SR1"][timestamp] = [x.F_Solar[1] for x in nodes]
-            data["Heat_SR4"][timestamp] = [x.F_Solar[4] for x in nodes]
-            data["Heat_SR6"][timestamp] = [x.F_Solar[6] for x in nodes]
-            data["Heat_TR"][timestamp] = [x.F_Longwave for x in nodes]
+            hours[row["Heat_Cond"]] = [x.F_Conduction for x in nodes]
+            hours[row["Heat_Conv"]] = [x.F_Convection for x in nodes]
+            hours[row["Heat_Evap"]] = [x.F_Evaporation for x in nodes]
+            hours[row["Heat_SR1"]] = [x.F_Solar[1] for x in nodes]
+            hours[row["Heat_SR4"]] = [x.F_Solar[4] for x in nodes]
+            hours[row["Heat_SR6"]] = [x.F_Solar[6] for x in nodes]
+            hours[row["Heat_TR"]] = [x.F_Longwave for x in nodes]
         # Run only with hydro
         if self.run_type != 1:
-            data["Hyd_DA"][timestamp] = [(x.A / x.W_w) for x in nodes]
-            data["Hyd_DM"][timestamp] = [x.d_w for x in nodes]
-            data["Hyd_Flow"][timestamp] = [x.Q for x in nodes]
-            data["Hyd_Hyp"][timestamp] = [x.Q_hyp for x in nodes]
-            data["Hyd_Vel"][timestamp] = [x.U for x in nodes]
-            data["Hyd_WT"][timestamp] = [x.W_w for x in nodes]
+            hours[row["Hyd_DA"]] = [(x.A / x.W_w) for x in nodes]
+            hours[row["Hyd_DM"]] = [x.d_w for x in nodes]
+            hours[row["Hyd_Flow"]] = [x.Q for x in nodes]
+            hours[row["Hyd_Hyp"]] = [x.Q_hyp for x in nodes]
+            hours[row["Hyd_Vel"]] = [x.U for x in nodes]
+            hours[row["Hyd_WT"]] = [x.W_w for x in nodes]
         # Run only with both solar and hydro
         if not self.run_type:
-            data["Rate_Evap"][timestamp] = [(x.E / x.dx / x.W_w * 3600 * 1000) for x in nodes] #TODO: Check
-            data["Temp_H2O"][timestamp] = [x.T for x in nodes]
-            data["Temp_Sed"][timestamp] = [x.T_sed for x in nodes]
-            data["Hyd_Disp"][timestamp] = [x.Disp for x in nodes]
+            hours[row["Rate_Evap"]] = [(x.E / x.dx / x.W_w * 3600 * 1000) for x in nodes] #TODO: Check
+            hours[row["Temp_H2O"]] = [x.T for x in nodes]
+            hours[row["Temp_Sed"]] = [x.T_sed for x in nodes]
+            hours[row["Hyd_Disp"]] = [x.Disp for x in nodes]
 
-        # Zero for an hour means a new day, so we add daily outputs
-        # and write to the file. Writing only every day saves us
-        # 24xF file accesses where F=len(self.files). Each file access
-        # has quite a bit of overhead, so we lump them. It's "A Good Thing."
+        # The daily outputs are taken now, before the daily sums start over
+        daily = None
         if hour == 23:
             print timestamp
-            self.write(self.run_type < 2, timestamp)
+            if self.run_type < 2: daily = self.daily(timestamp)
+        self.Put(timestamp, hours, hour, daily)
+        # Tell the model if the writer has failed
+        if self.failed is not None:
+            raise Exception("The output could not be written:\n" + self.failed)
 
     def daily(self, timestamp):
-        """Compile and store data that is collected every hour"""
-        nodes = self.nodes
-        self.data["Shade"][timestamp] = [((x.F_DailySum[1] - x.F_DailySum[4]) / x.F_DailySum[1]) for x in nodes]
-        self.data["VTS"][timestamp] = [x.ViewToSky for x in nodes]
-        self.data["SolarBlock"][timestamp] = []
-        # If there's no hour, we're at the beginning of a day, so we write the values
-        # to a file.
-
-    def write(self, daily, timestamp):
-        if daily: # don't call for hydraulics
-            #self.daily(("%0.6f" % float(pyTime(Chronos()))).ljust(14))
-            self.daily(timestamp)
-        # localize the
-        data = self.data
+        """Return the data that is collected every day, as a dictionary of node values"""
+        sums = self.daily_sums
+        data = {"Shade": sums.Shade(), "VTS": [x.ViewToSky for x in self.nodes]}
+        # The daily average of the flux blocked by each zone of the seven directions, and the diffuse
+        data["SolarBlock"] = sums.Blocked(7) / (86400.0/float(IniParams["dt"]))
+        return data
+
+    def write(self, hours, times, daily):
+        """Write a day's (hour, output, node) array of hourly outputs, and the daily outputs if there are any"""
         # Cycle through the file objects
         for name, fileobj in self.files.iteritems():
-            # Each time is a single line, so we want to iterate over all the times
-            # stored so far. We can do this because everytime we store data, we
-            # append the time string to self.times
-            timelist = sorted(data[name].keys())
+            # Each time is a single line of the file
             line = ""
-            if name != "SolarBlock":
-                for timestamp in timelist:
+            if name in self.row:
+                values = hours[:, self.row[name]].tolist()
+                for timestamp, v in zip(times, values):
                     line += timestamp
-                    line += "".join([("%0.4f" % x).ljust(14) for x in data[name][timestamp]])
+                    line += "".join([("%0.4f" % x).ljust(14) for x in v])
                     line += "\n"
+            elif daily is None:
+                continue
+            elif name != "SolarBlock":
+                line += times[-1]
+                line += "".join([("%0.4f" % x).ljust(14) for x in daily[name]])
+                line += "\n"
             else:
-                timesteps = 86400.0/float(IniParams["dt"])
-                for timestamp in timelist:
-                    for x in self.nodes:
-                        line += timestamp
-                        line += ("%0.3f" % x.km).ljust(14)
-                        for dir in range(7):  #Seven directions
-                            print IniParams["transsample_count"]
-                            for zone in range(IniParams["transsample_count"]):
-                                print zone
-                                daily_ave_blocked = x.Solar_Blocked[dir][zone] / timesteps
-                                line += ("%0.4f" % daily_ave_blocked).ljust(14)
-                        daily_ave_diffuse_blocked = x.Solar_Blocked['diffuse'] / timesteps
-                        line += ("%0.4f" % daily_ave_diffuse_blocked).ljust(14)
-                        line += "\n"
+                for x, v in zip(self.nodes, daily[name].tolist()):
+                    line += times[-1]
+                    line += ("%0.3f" % x.km).ljust(14)
+                    line += "".join([("%0.4f" % y).ljust(14) for y in v])
+                    line += "\n"
             # finally, write all the lines to the file
-            fileobj.write(line)
-        del data
-        # Now empty out the dictionary by simply copying a new one.
-        self.data = deepcopy(self.empty_vars)
\ No newline at end of file
+            fileobj.write(line)
\ No newline at end of file
@@ -0,0 +1,148 @@
+"""Timing of the model's hot spots
+
+When IniParams["profile"] is set, ModelControl.Run() installs a
+Profiler, which replaces the routines below with wrappers that count
+the calls and add up the time spent in them. At the end of the run,
+the totals and a day by day breakdown are written to profile.json and
+profile.csv in the output directory (next to outfile.log), and the
+original routines are put back.
+
+    CalcDischarge      The discharge methods of StreamNode and StreamReach
+    CalcSolarPosition  Solar position, whether calculated or from the Ephemeris
+    GetSolarFlux       Solar fluxes (scalar and array versions)
+    GetGroundFluxes    Ground fluxes (scalar and array versions)
+    CalcMacCormick     Both MacCormick steps (scalar and array versions)
+    Interpolator       Lookups in the forcing dictionaries and tables
+    Output.__call__    Hourly output, including Output.write
+    Output.write       Daily writing of the output
+
+The times include everything a routine calls, so GetSolarFlux and
+GetGroundFluxes time is part of the per-node heat calculation, and so
+on. Timing every call has a cost of its own, so a profiled run is
+slower than a normal one. The Profiler keeps its totals for one thread,
+so ModelControl refuses to run it with output_queue, which writes the
+output from another.
+"""
+from __future__ import division
+import json
+from time import time as Time
+from time import gmtime, strftime
+from os.path import join
+from collections import defaultdict
+
+from ..Stream import PyHeatsource as py_HS
+from ..Stream import VectorHeatsource as vec_HS
+from ..Stream.StreamNode import StreamNode
+from ..Stream.StreamReach import StreamReach
+from ..Stream.Ephemeris import Ephemeris
+from ..Utils.Dictionaries import Interpolator, ForcingTable
+from ..Utils.Output import Output
+from ..Utils.BinaryOutput import BinaryOutput
+
+# (owner, attribute, name in the report) for everything we time
+targets = ((StreamNode, "CalculateDischarge", "CalcDischarge"),
+           (StreamNode, "CalcDischarge_Opt", "CalcDischarge"),
+           (StreamNode, "CalcDischarge_BoundaryNode", "CalcDischarge"),
+           (StreamReach, "CalcDischarge", "CalcDischarge"),
+           (py_HS, "CalcSolarPosition", "CalcSolarPosition"),
+           (vec_HS, "CalcSolarPosition", "CalcSolarPosition"),
+           (Ephemeris, "__getitem__", "CalcSolarPosition"),
+           (py_HS, "GetSolarFlux", "GetSolarFlux"),
+           (vec_HS, "GetSolarFlux", "GetSolarFlux"),
+           (py_HS, "GetGroundFluxes", "GetGroundFluxes"),
+           (vec_HS, "GetGroundFluxes", "GetGroundFluxes"),
+           (py_HS, "CalcMacCormick", "CalcMacCormick"),
+           (vec_HS, "CalcMacCormick", "CalcMacCormick"),
+           (vec_HS, "CalcMacCormickCorrector", "CalcMacCormick"),
+           (Interpolator, "__getitem__", "Interpolator"),
+           (ForcingTable, "__getitem__", "Interpolator"),
+           (Output, "__call__", "Output.__call__"),
+           (Output, "write", "Output.write"),
+           (BinaryOutput, "write", "Output.write"))
+
+class Profiler(object):
+    def __init__(self):
+        """Profiler() -> Class instance
+
+        Call Install() to start timing, NewDay() at the start of each
+        model day, and Remove() and Write() at the end."""
+        self.days = [] # List of (day, stats) for the days that are finished
+        self.day = None # The day we're timing now
+        self.stats = self.NewStats()
+        self.originals = []
+        self.start = None
+
+    def NewStats(self):
+        """Return an empty dictionary of [calls, seconds] by name"""
+        return defaultdict(lambda: [0, 0.0])
+
+    def Timed(self, func, name):
+        """Return a version of func that records its calls under name"""
+        def timed(*args, **kwargs):
+            t = Time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                s = self.stats[name]
+                s[0] += 1
+                s[1] += Time() - t
+        timed.__name__ = func.__name__
+        return timed
+
+    def Install(self, reachlist):
+        """Swap the wrappers in for the real routines"""
+        for owner, attr, name in targets:
+            # Classes might inherit the attribute (e.g. __getitem__) rather than define it
+            original = owner.__dict__.get(attr)
+            func = original if original is not None else getattr(owner, attr)
+            self.originals.append((owner, attr, original))
+            setattr(owner, attr, self.Timed(func, name))
+        self.Rebind(reachlist)
+        self.start = Time()
+
+    def Remove(self, reachlist):
+        """Put the real routines back"""
+        for owner, attr, original in reversed(self.originals):
+            if original is None: delattr(owner, attr)
+            else: setattr(owner, attr, original)
+        self.originals = []
+        self.Rebind(reachlist)
+
+    def Rebind(self, reachlist):
+        """Point each node's CalcDischarge at the current version of its method"""
+        # The nodes hold the bound method, so they don't see changes to the class by themselves
+        for node in reachlist:
+            if node.CalcDischarge is not None:
+                node.CalcDischarge = getattr(node, node.CalcDischarge.__name__)
+
+    def NewDay(self, time):
+        """Start a new day's figures at time (seconds since the epoch)"""
+        if self.day is not None and len(self.stats):
+            self.days.append((self.day, self.stats))
+            self.stats = self.NewStats()
+        self.day = strftime("%Y-%m-%d", gmtime(time))
+
+    def Write(self, outputdir):
+        """Write profile.json and profile.csv to outputdir"""
+        self.NewDay(0) # Close off the last day
+        totals = self.NewStats()
+        for day, stats in self.days:
+            for name, (calls, seconds) in stats.iteritems():
+                totals[name][0] += calls
+                totals[name][1] += seconds
+        as_dict = lambda stats: dict([(name, {"calls": c, "seconds": s}) for name, (c, s) in stats.iteritems()])
+        report = {"wall_time": Time() - self.start, "total": as_dict(totals),
+                  "days": [dict(as_dict(stats), day=day) for day, stats in self.days]}
+        f = open(join(outputdir, "profile.json"), "w")
+        try:
+            json.dump(report, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+        f = open(join(outputdir, "profile.csv"), "w")
+        try:
+            f.write("Day,Name,Calls,Seconds\n")
+            for day, stats in self.days + [("Total", totals)]:
+                for name in sorted(stats.keys()):
+                    f.write("%s,%s,%i,%0.6f\n" % (day, name, stats[name][0], stats[name][1]))
+        finally:
+            f.close()